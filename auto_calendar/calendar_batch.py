@@ -0,0 +1,155 @@
+import os
+
+from auto_calendar.calendar_scheduler import is_retryable_error
+from monitoring.logger import get_logger
+from monitoring.metrics import span
+
+logger = get_logger(__name__)
+
+# Google Calendar 建議每個 batch 不超過 50 個請求
+CALENDAR_BATCH_SIZE = int(os.getenv("CALENDAR_BATCH_SIZE", "50"))
+
+
+class CalendarSyncReport:
+    """
+    一次同步班表到 Google Calendar 的結果
+
+    succeeded: {操作: {date_key: 回傳的 event}}
+    failed: {date_key: (操作, 錯誤訊息)}
+    fetched: 讀取既有事件的頁數、bytes 與事件數
+    plan: 這次同步的變更計畫（SyncPlan）
+    """
+
+    def __init__(self):
+        self.succeeded = {}
+        self.failed = {}
+        self.fetched = {"pages": 0, "bytes": 0, "events": 0}
+        self.plan = None
+
+    def add_fetched_page(self, size, event_count):
+        self.fetched["pages"] += 1
+        self.fetched["bytes"] += size
+        self.fetched["events"] += event_count
+
+    def add_success(self, operation, date_key, event):
+        self.succeeded.setdefault(operation, {})[date_key] = event
+
+    def add_failure(self, operation, date_key, error):
+        self.failed[date_key] = (operation, str(error))
+
+    def count(self, operation):
+        return len(self.succeeded.get(operation, {}))
+
+    @property
+    def ok(self):
+        return not self.failed
+
+    def summary(self):
+        lines = [
+            f"新增 {self.count('insert')} 筆、更新 {self.count('patch')} 筆、"
+            f"刪除 {self.count('delete')} 筆",
+        ]
+        if self.failed:
+            lines.append(f"以下 {len(self.failed)} 天處理失敗：")
+            for date_key in sorted(self.failed):
+                operation, error = self.failed[date_key]
+                lines.append(f"{date_key}（{operation}）: {error}")
+
+        return "\n".join(lines)
+
+
+def execute_in_batches(
+    service,
+    operations,
+    report,
+    batch_size=CALENDAR_BATCH_SIZE,
+    scheduler=None,
+    user_id=None,
+):
+    """
+    把多個 Calendar API 請求打包成 batch 送出
+
+    operations: [(操作名稱, date_key, HttpRequest)]，例如
+        ("insert", "2025-09-01", service.events().insert(...))
+    每個子回應依 date_key 記錄到 report，失敗的項目不會中斷其他項目
+
+    有傳入 scheduler 時，送出前先取得 token，遇到 rate limit / 5xx 的子請求
+    會在 backoff 後重新打包送出
+    """
+    pending = list(operations)
+    attempt = 0
+
+    while pending:
+        retry_operations = []
+
+        for i in range(0, len(pending), batch_size):
+            chunk = pending[i : i + batch_size]
+            retry_operations.extend(
+                _execute_batch(service, chunk, report, scheduler, user_id)
+            )
+
+        if not retry_operations:
+            break
+
+        if attempt >= scheduler.max_retries:
+            for operation, date_key, http_request, error in retry_operations:
+                report.add_failure(operation, date_key, error)
+            scheduler.record_failure(len(retry_operations))
+            break
+
+        scheduler.wait_before_retry(
+            attempt, retry_operations[0][3], count=len(retry_operations)
+        )
+        pending = [operation[:3] for operation in retry_operations]
+        attempt += 1
+
+    return report
+
+
+def _execute_batch(service, chunk, report, scheduler, user_id):
+    """送出一個 batch，回傳可重試的失敗項目 [(操作, date_key, HttpRequest, 錯誤)]"""
+    # request_id -> (操作, date_key, HttpRequest)
+    request_keys = {}
+    finished = set()
+    retry_operations = []
+
+    def callback(request_id, response, exception):
+        operation, date_key, http_request = request_keys[request_id]
+        finished.add(request_id)
+
+        if exception is None:
+            report.add_success(operation, date_key, response)
+        elif scheduler is not None and is_retryable_error(exception):
+            retry_operations.append((operation, date_key, http_request, exception))
+        else:
+            logger.warning(f"✗ {date_key} {operation} 失敗: {exception}")
+            report.add_failure(operation, date_key, exception)
+            if scheduler is not None:
+                scheduler.record_failure()
+
+    batch = service.new_batch_http_request(callback=callback)
+    for operation, date_key, http_request in chunk:
+        request_id = f"{operation}:{date_key}"
+        request_keys[request_id] = (operation, date_key, http_request)
+        batch.add(http_request, request_id=request_id)
+
+    if scheduler is not None:
+        scheduler.acquire(user_id, len(chunk))
+
+    try:
+        with span("calendar_write"):
+            batch.execute()
+    except Exception as e:
+        # 整個 batch 失敗（例如連線中斷），尚未有結果的項目依錯誤種類重試或視為失敗
+        logger.warning(f"✗ batch 請求失敗: {e}")
+        for request_id, (operation, date_key, http_request) in request_keys.items():
+            if request_id in finished:
+                continue
+            if scheduler is not None and is_retryable_error(e):
+                retry_operations.append((operation, date_key, http_request, e))
+            else:
+                report.add_failure(operation, date_key, e)
+                if scheduler is not None:
+                    scheduler.record_failure()
+
+    return retry_operations
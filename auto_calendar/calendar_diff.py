@@ -0,0 +1,196 @@
+import datetime
+from zoneinfo import ZoneInfo
+
+DEFAULT_TIME_ZONE = "Asia/Taipei"
+
+# 比對的欄位；其他欄位（描述、提醒…）可能由使用者修改過，不覆蓋
+COMPARED_FIELDS = ("summary", "start", "end")
+
+# LINE 確認訊息中最多列出幾天的變更
+PLAN_MESSAGE_MAX_LINES = 10
+
+
+def normalize_time(value):
+    """
+    把 Calendar 的 start / end 轉成可比較的值
+
+    - 全天事件：("date", "YYYY-MM-DD")
+    - 一般事件：("dateTime", UTC 時間)，沒有時區位移時依 timeZone（預設台北）解讀，
+      因此 "2025-09-01T08:00:00" + Asia/Taipei 與 "2025-09-01T08:00:00+08:00" 相同
+    """
+    if not value:
+        return None
+
+    if value.get("date"):
+        return ("date", value["date"])
+
+    if value.get("dateTime"):
+        moment = datetime.datetime.fromisoformat(value["dateTime"])
+        if moment.tzinfo is None:
+            moment = moment.replace(
+                tzinfo=ZoneInfo(value.get("timeZone") or DEFAULT_TIME_ZONE)
+            )
+        return ("dateTime", moment.astimezone(datetime.timezone.utc))
+
+    return None
+
+
+def normalize_field(field, value):
+    if field in ("start", "end"):
+        return normalize_time(value)
+    return (value or "").strip()
+
+
+def patch_time(new_value, current_value):
+    """全天 / 一般事件互換時，要把原本的 date 或 dateTime 清成 null"""
+    body = dict(new_value)
+    for key in ("date", "dateTime"):
+        if key not in body and (current_value or {}).get(key):
+            body[key] = None
+    return body
+
+
+class PlanItem:
+    def __init__(self, operation, date_key, new_event=None, current_event=None):
+        self.operation = operation
+        self.date_key = date_key
+        self.new_event = new_event
+        self.current_event = current_event
+        self.changed_fields = []
+
+    @property
+    def event_id(self):
+        return (self.current_event or {}).get("id")
+
+    def patch_body(self):
+        body = {}
+        for field in self.changed_fields:
+            if field in ("start", "end"):
+                body[field] = patch_time(
+                    self.new_event[field], self.current_event.get(field)
+                )
+            else:
+                body[field] = self.new_event[field]
+        return body
+
+    def describe(self):
+        month, day = self.date_key.split("-")[1:]
+        label = f"{int(month)}/{int(day)}"
+        before = (self.current_event or {}).get("summary", "")
+        after = (self.new_event or {}).get("summary", "")
+
+        if self.operation == "insert":
+            return f"{label} 新增 {after}"
+        if self.operation == "delete":
+            return f"{label} 刪除 {before}"
+        if "summary" in self.changed_fields:
+            return f"{label} {before} → {after}"
+        return f"{label} {after} 更新時間"
+
+
+class SyncPlan:
+    """
+    新班表與行事曆上既有 OCR 事件的比對結果
+
+    items 依日期排序，operation 為 insert / patch / delete / noop
+    """
+
+    def __init__(self, items):
+        self.items = sorted(items, key=lambda item: item.date_key)
+
+    def by_operation(self, operation):
+        return [item for item in self.items if item.operation == operation]
+
+    def counts(self):
+        counts = {"insert": 0, "patch": 0, "delete": 0, "noop": 0}
+        for item in self.items:
+            counts[item.operation] += 1
+        return counts
+
+    @property
+    def has_writes(self):
+        return any(item.operation != "noop" for item in self.items)
+
+    def describe(self, max_lines=PLAN_MESSAGE_MAX_LINES):
+        """給 LINE 確認訊息使用的變更摘要"""
+        counts = self.counts()
+        lines = [
+            f"將新增 {counts['insert']} 天、更新 {counts['patch']} 天、"
+            f"刪除 {counts['delete']} 天（{counts['noop']} 天不變）"
+        ]
+
+        changes = [item for item in self.items if item.operation != "noop"]
+        for item in changes[:max_lines]:
+            lines.append(item.describe())
+        if len(changes) > max_lines:
+            lines.append(f"…其餘 {len(changes) - max_lines} 天")
+
+        return "\n".join(lines)
+
+    def to_operations(self, service, mark_event, calendar_id="primary"):
+        """
+        轉成 execute_in_batches 使用的 [(操作, date_key, HttpRequest)]
+        noop 不會送出任何請求
+        """
+        events = service.events()
+        operations = []
+
+        for item in self.items:
+            if item.operation == "insert":
+                http_request = events.insert(
+                    calendarId=calendar_id, body=mark_event(dict(item.new_event))
+                )
+            elif item.operation == "patch":
+                http_request = events.patch(
+                    calendarId=calendar_id,
+                    eventId=item.event_id,
+                    body=item.patch_body(),
+                )
+            elif item.operation == "delete":
+                http_request = events.delete(
+                    calendarId=calendar_id, eventId=item.event_id
+                )
+            else:
+                continue
+
+            operations.append((item.operation, item.date_key, http_request))
+
+        return operations
+
+
+def diff_events(current_event_dict, new_event_dict, delete_missing=True, keep_dates=()):
+    """
+    逐欄位比對，產生最少的變更
+
+    current_event_dict: {date_key: 行事曆上既有的 OCR 事件}
+    new_event_dict: {date_key: 新班表的事件}
+    delete_missing: 新班表沒有、但行事曆上有 OCR 事件的日期要刪除
+    keep_dates: 班表中沒有辨識到班別的日期，既有事件保持不變（不刪除）
+    """
+    keep_dates = set(keep_dates)
+    items = []
+
+    for date_key, new_event in new_event_dict.items():
+        current_event = current_event_dict.get(date_key)
+
+        if current_event is None:
+            items.append(PlanItem("insert", date_key, new_event))
+            continue
+
+        item = PlanItem("noop", date_key, new_event, current_event)
+        item.changed_fields = [
+            field
+            for field in COMPARED_FIELDS
+            if normalize_field(field, new_event.get(field))
+            != normalize_field(field, current_event.get(field))
+        ]
+        if item.changed_fields:
+            item.operation = "patch"
+        items.append(item)
+
+    if delete_missing:
+        for date_key, current_event in current_event_dict.items():
+            if date_key not in new_event_dict and date_key not in keep_dates:
+                items.append(PlanItem("delete", date_key, None, current_event))
+
+    return SyncPlan(items)
@@ -0,0 +1,184 @@
+import os
+import json
+import time
+import tempfile
+import threading
+from urllib.parse import quote
+
+from monitoring.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 獲取當前檔案的絕對路徑
+current_file_path = os.path.abspath(__file__)
+
+# 獲取當前檔案所在的目錄
+current_directory = os.path.dirname(current_file_path)
+
+# 是否使用本機鏡像（syncToken 增量同步）讀取既有的 OCR 事件
+CALENDAR_MIRROR = os.getenv("CALENDAR_MIRROR", "1") == "1"
+
+# 鏡像存放位置（方便掛載 persistent disk）
+CALENDAR_MIRROR_FOLDER = os.getenv(
+    "CALENDAR_MIRROR_FOLDER", f"{current_directory}/calendar_mirror"
+)
+
+# 同步時只下載比對需要的欄位；刪除的事件只會有 id 與 status
+MIRROR_FIELDS = (
+    "nextPageToken,nextSyncToken,"
+    "items(id,status,summary,start,end,extendedProperties/private)"
+)
+
+
+def is_ocr_event(event):
+    extended_props = event.get("extendedProperties", {}).get("private", {})
+    return (
+        extended_props.get("created_by") == "ocr_service"
+        and extended_props.get("creation_method") == "ocr"
+    )
+
+
+def event_date_key(event):
+    """事件開始日期（YYYY-MM-DD）"""
+    start = event.get("start", {})
+    start_time = start.get("dateTime") or start.get("date", "")
+    return start_time.split("T")[0]
+
+
+class CalendarMirror:
+    """
+    每位使用者、每個行事曆的 OCR 事件本機鏡像
+
+    - 第一次同步時讀取整個行事曆（不能加 timeMin / privateExtendedProperty，
+      否則無法使用 syncToken），只保留 OCR 建立的事件與 nextSyncToken
+    - 之後每次同步只以 syncToken 讀取變動的事件，通常只有一個很小的請求
+    - syncToken 失效（410 Gone）時清除鏡像並重新完整同步
+    - 鏡像以 JSON 存在 folder/{user_id}/{calendar_id}.json
+
+    iter_pages(service, calendar_id, user_id=..., report=..., **list_kwargs)
+    需依 nextPageToken 逐頁回傳 events().list 的回應
+    """
+
+    def __init__(self, iter_pages, folder=CALENDAR_MIRROR_FOLDER):
+        self.iter_pages = iter_pages
+        self.folder = folder
+
+        self._lock = threading.Lock()
+        self._stats = {"full_syncs": 0, "delta_syncs": 0, "resyncs": 0}
+
+    def sync(self, service, user_id, calendar_id="primary", report=None):
+        """同步並回傳 {event_id: event}（只含 OCR 建立、未刪除的事件）"""
+        # 傳入 service 時 googleapiclient 已載入，import 不會拖慢啟動
+        from googleapiclient.errors import HttpError
+
+        state = self._load(user_id, calendar_id)
+
+        if state is not None and state.get("sync_token"):
+            try:
+                self._apply_delta(service, user_id, calendar_id, state, report)
+                self._save(user_id, calendar_id, state)
+                return state["events"]
+
+            except HttpError as e:
+                if e.resp.status != 410:
+                    raise
+                logger.warning(f"使用者 {user_id} 的 syncToken 已失效，重新完整同步")
+                with self._lock:
+                    self._stats["resyncs"] += 1
+
+        state = self._full_sync(service, user_id, calendar_id, report)
+        self._save(user_id, calendar_id, state)
+        return state["events"]
+
+    def range_events(
+        self,
+        service,
+        user_id,
+        first_date_key,
+        last_date_key,
+        calendar_id="primary",
+        report=None,
+    ):
+        """同步後回傳開始日期在 first_date_key ~ last_date_key（含）之間的 OCR 事件 list"""
+        events = self.sync(service, user_id, calendar_id, report)
+        return [
+            event
+            for event in events.values()
+            if first_date_key <= event_date_key(event) <= last_date_key
+        ]
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _full_sync(self, service, user_id, calendar_id, report):
+        events = {}
+        sync_token = None
+
+        for page in self.iter_pages(
+            service, calendar_id, user_id=user_id, report=report, fields=MIRROR_FIELDS
+        ):
+            for event in page.get("items", []):
+                if event.get("status") != "cancelled" and is_ocr_event(event):
+                    events[event["id"]] = event
+            sync_token = page.get("nextSyncToken") or sync_token
+
+        with self._lock:
+            self._stats["full_syncs"] += 1
+
+        return {"sync_token": sync_token, "events": events, "synced_at": time.time()}
+
+    def _apply_delta(self, service, user_id, calendar_id, state, report):
+        events = state["events"]
+        sync_token = state["sync_token"]
+
+        for page in self.iter_pages(
+            service,
+            calendar_id,
+            user_id=user_id,
+            report=report,
+            syncToken=sync_token,
+            fields=MIRROR_FIELDS,
+        ):
+            for event in page.get("items", []):
+                # 已刪除，或不再是 OCR 事件（例如使用者移除了標記）
+                if event.get("status") == "cancelled" or not is_ocr_event(event):
+                    events.pop(event["id"], None)
+                else:
+                    events[event["id"]] = event
+            sync_token = page.get("nextSyncToken") or sync_token
+
+        state["sync_token"] = sync_token
+        state["synced_at"] = time.time()
+
+        with self._lock:
+            self._stats["delta_syncs"] += 1
+
+    def _path(self, user_id, calendar_id):
+        return os.path.join(
+            self.folder, quote(user_id, safe=""), f"{quote(calendar_id, safe='')}.json"
+        )
+
+    def _load(self, user_id, calendar_id):
+        try:
+            with open(self._path(user_id, calendar_id), "r", encoding="utf-8") as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取行事曆鏡像失敗，重新完整同步: {e}")
+            return None
+
+    def _save(self, user_id, calendar_id, state):
+        path = self._path(user_id, calendar_id)
+        folder = os.path.dirname(path)
+
+        try:
+            os.makedirs(folder, exist_ok=True)
+            # 先寫暫存檔再 rename，避免其他 worker 讀到寫一半的檔案
+            fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(state, file, ensure_ascii=False)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"寫入行事曆鏡像失敗: {e}")
@@ -0,0 +1,233 @@
+import os
+import time
+import random
+import threading
+from contextlib import contextmanager
+
+from monitoring.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 每位使用者、整個 project 每秒可送出的 Calendar API 請求數（batch 內每個請求各算一次）
+CALENDAR_USER_QPS = float(os.getenv("CALENDAR_USER_QPS", "5"))
+CALENDAR_PROJECT_QPS = float(os.getenv("CALENDAR_PROJECT_QPS", "50"))
+
+# token bucket 在每個 process 各一份，不跨 process 共用；
+# 同時寫入行事曆的 process 數（gunicorn worker 數，gunicorn.conf.py 會設定 GUNICORN_WORKERS），
+# 每個 process 只使用上面 QPS 的 1 / CALENDAR_PROCESSES，合計不超過 quota
+CALENDAR_PROCESSES = max(
+    1, int(os.getenv("CALENDAR_PROCESSES", os.getenv("GUNICORN_WORKERS", "1")))
+)
+
+# 使用者超過此秒數沒有寫入時，移除其 token bucket 與 lock（下次寫入再建立）
+CALENDAR_USER_IDLE_SECONDS = float(os.getenv("CALENDAR_USER_IDLE_SECONDS", "600"))
+
+# 重試次數與 exponential backoff 的基準 / 上限秒數
+CALENDAR_MAX_RETRIES = int(os.getenv("CALENDAR_MAX_RETRIES", "5"))
+CALENDAR_BACKOFF_BASE = float(os.getenv("CALENDAR_BACKOFF_BASE", "1"))
+CALENDAR_BACKOFF_MAX = float(os.getenv("CALENDAR_BACKOFF_MAX", "32"))
+
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+RATE_LIMIT_REASONS = ("rateLimitExceeded", "userRateLimitExceeded")
+
+
+def is_retryable_error(error):
+    """429、5xx，以及 reason 為 rateLimitExceeded / userRateLimitExceeded 的 403 可以重試"""
+    # googleapiclient 在第一次建立 service 時才載入，webhook 啟動時不 import
+    from googleapiclient.errors import HttpError
+
+    if not isinstance(error, HttpError):
+        return False
+
+    status = error.resp.status
+    if status in RETRYABLE_STATUS:
+        return True
+
+    if status != 403:
+        return False
+
+    for detail in getattr(error, "error_details", None) or []:
+        if isinstance(detail, dict) and detail.get("reason") in RATE_LIMIT_REASONS:
+            return True
+
+    content = error.content or b""
+    if isinstance(content, bytes):
+        content = content.decode("utf-8", "ignore")
+    return any(reason in content for reason in RATE_LIMIT_REASONS)
+
+
+def backoff_seconds(attempt, base=CALENDAR_BACKOFF_BASE, maximum=CALENDAR_BACKOFF_MAX):
+    """第 attempt 次重試前要等待的秒數（full jitter）"""
+    return random.uniform(0, min(maximum, base * (2**attempt)))
+
+
+class TokenBucket:
+    """固定速率補充的 token bucket，acquire 在 token 不足時會等待"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens=1):
+        """取得 tokens 個 token，回傳等待的秒數"""
+        waited = 0.0
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(
+                    self.capacity, self._tokens + (now - self._updated_at) * self.rate
+                )
+                self._updated_at = now
+
+                # 一次要求超過容量時（大 batch），允許 token 變成負數，之後的請求再補回
+                if self._tokens >= min(tokens, self.capacity):
+                    self._tokens -= tokens
+                    return waited
+
+                wait = (min(tokens, self.capacity) - self._tokens) / self.rate
+
+            time.sleep(wait)
+            waited += wait
+
+
+class UserState:
+    """一位使用者的 token bucket 與寫入 lock；active > 0 時不會被移除"""
+
+    def __init__(self, rate):
+        self.bucket = TokenBucket(rate)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.used_at = time.monotonic()
+
+
+class CalendarScheduler:
+    """
+    Calendar API 寫入排程器（寫入工作本身由 jobs.job_queue 的 worker 執行）
+
+    - user_session(user_id)：同一使用者的同步工作在同一個 process 內依序執行
+    - acquire(user_id, n)：送出請求前先取得使用者與 project 的 token
+    - execute(user_id, http_request)：單一請求，遇到 403 rate limit / 429 / 5xx 時以
+      jittered exponential backoff 重試
+    - stats()：被節流、重試、失敗的次數
+
+    user_qps / project_qps 為整個服務的上限，每個 process 各使用 1 / processes；
+    閒置超過 idle_seconds 的使用者狀態會被移除
+    """
+
+    def __init__(
+        self,
+        user_qps=CALENDAR_USER_QPS,
+        project_qps=CALENDAR_PROJECT_QPS,
+        max_retries=CALENDAR_MAX_RETRIES,
+        processes=CALENDAR_PROCESSES,
+        idle_seconds=CALENDAR_USER_IDLE_SECONDS,
+    ):
+        self.user_qps = user_qps / processes
+        self.project_qps = project_qps / processes
+        self.max_retries = max_retries
+        self.idle_seconds = idle_seconds
+
+        self._project_bucket = TokenBucket(self.project_qps)
+        # user_id -> UserState
+        self._users = {}
+        self._pruned_at = time.monotonic()
+        self._lock = threading.Lock()
+
+        self._stats = {
+            "requests": 0,
+            "throttled": 0,
+            "throttled_seconds": 0.0,
+            "retried": 0,
+            "failed": 0,
+        }
+
+    @contextmanager
+    def user_session(self, user_id):
+        """同一位使用者的寫入工作不會同時執行"""
+        state = self._checkout(user_id)
+        try:
+            with state.lock:
+                yield
+        finally:
+            self._checkin(state)
+
+    def acquire(self, user_id, tokens=1):
+        state = self._checkout(user_id)
+        try:
+            waited = state.bucket.acquire(tokens)
+        finally:
+            self._checkin(state)
+        waited += self._project_bucket.acquire(tokens)
+
+        with self._lock:
+            self._stats["requests"] += tokens
+            if waited > 0:
+                self._stats["throttled"] += 1
+                self._stats["throttled_seconds"] += waited
+
+    def execute(self, user_id, http_request):
+        attempt = 0
+        while True:
+            self.acquire(user_id)
+            try:
+                return http_request.execute()
+            except Exception as e:
+                if not is_retryable_error(e) or attempt >= self.max_retries:
+                    self.record_failure()
+                    raise
+
+                self.wait_before_retry(attempt, e)
+                attempt += 1
+
+    def wait_before_retry(self, attempt, error=None, count=1):
+        wait = backoff_seconds(attempt)
+        logger.warning(
+            f"Calendar API 請求受限，{wait:.1f} 秒後重試（第 {attempt + 1} 次）: {error}"
+        )
+
+        with self._lock:
+            self._stats["retried"] += count
+
+        time.sleep(wait)
+
+    def record_failure(self, count=1):
+        with self._lock:
+            self._stats["failed"] += count
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["users"] = len(self._users)
+        return stats
+
+    def _checkout(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            if now - self._pruned_at >= min(self.idle_seconds, 60):
+                self._prune_locked(now)
+
+            state = self._users.get(user_id)
+            if state is None:
+                state = UserState(self.user_qps)
+                self._users[user_id] = state
+            state.active += 1
+            state.used_at = now
+            return state
+
+    def _checkin(self, state):
+        with self._lock:
+            state.active -= 1
+            state.used_at = time.monotonic()
+
+    def _prune_locked(self, now):
+        idle = [
+            user_id
+            for user_id, state in self._users.items()
+            if state.active == 0 and now - state.used_at > self.idle_seconds
+        ]
+        for user_id in idle:
+            del self._users[user_id]
+        self._pruned_at = now
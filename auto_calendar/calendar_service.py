@@ -0,0 +1,125 @@
+import os
+import json
+import threading
+from collections import OrderedDict
+
+from google.auth.credentials import AnonymousCredentials
+
+# 每個 process 保留幾位使用者的 Calendar service 物件
+CALENDAR_SERVICE_CACHE_SIZE = int(os.getenv("CALENDAR_SERVICE_CACHE_SIZE", "256"))
+
+CALENDAR_API_NAME = "calendar"
+CALENDAR_API_VERSION = "v3"
+
+
+class DiscoveryDocument:
+    """
+    Calendar v3 discovery document，每個 process 只讀取、解析一次
+
+    googleapiclient 第一次建立各 resource 的方法時會就地補齊 document 的欄位，
+    之後不再改變；因此在載入時先完整走過一次，之後多個 thread 共用同一個 dict
+    """
+
+    def __init__(self, name=CALENDAR_API_NAME, version=CALENDAR_API_VERSION):
+        self.name = name
+        self.version = version
+        self._lock = threading.Lock()
+        self._document = None
+
+    def get(self):
+        if self._document is not None:
+            return self._document
+
+        # 與 _warm_up 相同，googleapiclient 到第一次建立 service 時才載入
+        from googleapiclient import discovery_cache
+
+        with self._lock:
+            if self._document is None:
+                document = json.loads(
+                    discovery_cache.get_static_doc(self.name, self.version)
+                )
+                self._warm_up(document)
+                self._document = document
+        return self._document
+
+    @staticmethod
+    def _warm_up(document):
+        # googleapiclient.discovery 第一次載入 document 時才 import，不拖慢啟動
+        from googleapiclient.discovery import build_from_document
+
+        # 只建立物件、不送出請求，使用匿名憑證避免去找 application default credentials
+        service = build_from_document(document, credentials=AnonymousCredentials())
+        for resource_name in document.get("resources", {}):
+            getattr(service, resource_name)()
+
+
+class CalendarServiceFactory:
+    """
+    建立並重用每位使用者的 Calendar service 物件
+
+    - service 由已解析的 discovery document 建立，不重新讀取、解析 JSON
+    - 依 user_id 保留最近使用的 max_services 個 service（LRU）
+    - 憑證快取換成新的 Credentials 物件（例如使用者重新授權）時，重建 service；
+      token 更新是在同一個 Credentials 物件上進行，service 可繼續沿用
+    - 有傳入 transport（PooledTransport）時，所有 service 共用同一個連線池
+    """
+
+    def __init__(
+        self,
+        load_credentials,
+        max_services=CALENDAR_SERVICE_CACHE_SIZE,
+        document=None,
+        transport=None,
+    ):
+        self.load_credentials = load_credentials
+        self.max_services = max_services
+        self.document = document or DiscoveryDocument()
+        self.transport = transport
+
+        self._lock = threading.Lock()
+        # user_id -> (Credentials, service)
+        self._services = OrderedDict()
+        self._stats = {"hits": 0, "builds": 0, "evictions": 0}
+
+    def build(self, credentials):
+        """以快取的 discovery document 建立新的 service（不放入 LRU）"""
+        from googleapiclient.discovery import build_from_document
+
+        if self.transport is not None:
+            return build_from_document(
+                self.document.get(), http=self.transport.authorized_http(credentials)
+            )
+        return build_from_document(self.document.get(), credentials=credentials)
+
+    def get(self, user_id):
+        credentials = self.load_credentials(user_id)
+
+        with self._lock:
+            cached = self._services.get(user_id)
+            if cached is not None and cached[0] is credentials:
+                self._services.move_to_end(user_id)
+                self._stats["hits"] += 1
+                return cached[1]
+
+        service = self.build(credentials)
+
+        with self._lock:
+            self._services[user_id] = (credentials, service)
+            self._services.move_to_end(user_id)
+            self._stats["builds"] += 1
+
+            while len(self._services) > self.max_services:
+                self._services.popitem(last=False)
+                self._stats["evictions"] += 1
+
+        return service
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._services.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["services"] = len(self._services)
+            return stats
@@ -1,15 +1,40 @@
 import os.path
 import os
+import ast
+import logging
 import datetime
-from google.auth.transport.requests import Request
-from google.oauth2.credentials import Credentials
-from google_auth_oauthlib.flow import Flow
 
+from auto_calendar.calendar_batch import CalendarSyncReport, execute_in_batches
+from auto_calendar.calendar_diff import diff_events
+from auto_calendar.calendar_scheduler import CalendarScheduler
+from auto_calendar.credential_cache import CredentialCache
+from auto_calendar.credential_store import create_credential_store
+from auto_calendar.calendar_service import CalendarServiceFactory
+from auto_calendar.http_transport import PooledTransport
+from auto_calendar.calendar_mirror import CalendarMirror, CALENDAR_MIRROR
+from monitoring.logger import get_logger, SAMPLED
+from monitoring.metrics import span
 
-# 這是為了確保每次都重新進行授權流程
-# SCOPES = ["https://www.googleapis.com/auth/calendar"]
+logger = get_logger(__name__)
+
+
+def env_list(name, default):
+    """
+    讀取 list 格式的環境變數，例如 CALENDAR_SCOPES='["https://www.googleapis.com/auth/calendar"]'
+    以 ast.literal_eval 解析，只接受字面值，不會執行環境變數中的程式碼
+    """
+    value = os.getenv(name)
+    if not value:
+        return list(default)
+
+    parsed = ast.literal_eval(value)
+    if not isinstance(parsed, (list, tuple)):
+        raise ValueError(f"{name} 必須是 list，例如 '[\"...\"]'，目前為: {value}")
+    return list(parsed)
 
-SCOPES = eval(os.getenv("CALENDAR_SCOPES"))
+
+# 這是為了確保每次都重新進行授權流程
+SCOPES = env_list("CALENDAR_SCOPES", ["https://www.googleapis.com/auth/calendar"])
 
 CLIENT_SECRET_DICT = {
     "web": {
@@ -21,7 +46,7 @@ CLIENT_SECRET_DICT = {
             "CALENDAR_AUTH_PROVIDER_X509_CERT_URL"
         ),
         "client_secret": os.getenv("CALENDAR_CLIENT_SECRET"),
-        "redirect_uris": eval(os.getenv("CALENDAR_REDIRECT_URIS")),
+        "redirect_uris": env_list("CALENDAR_REDIRECT_URIS", []),
     }
 }
 
@@ -37,30 +62,52 @@ user_credential_folder = os.getenv(
     "USER_CREDENTIAL_FOLDER", f"{current_directory}/user_credentials"
 )
 
-# 確保憑證目錄存在（若使用者在運行時建立憑證，需可寫）
-os.makedirs(user_credential_folder, exist_ok=True)
+# 所有使用者共用的 Calendar API 排程器（token bucket 限速、rate limit 重試）
+calendar_scheduler = CalendarScheduler()
+
+# 所有 Google API 請求（Calendar 與 OAuth token 更新）共用的 keep-alive 連線池
+google_transport = PooledTransport()
+
+# 憑證儲存（每位使用者一個 JSON 檔，或單一 SQLite 檔案，見 CREDENTIAL_STORE）
+credential_store = create_credential_store(user_credential_folder, SCOPES)
+
+# 每個 process 共用的憑證快取，背景 thread 會在 token 到期前先更新
+credential_cache = CredentialCache(
+    credential_store.load,
+    credential_store.save,
+    credential_store.version,
+    mark_revoked=credential_store.mark_revoked,
+    request_factory=google_transport.auth_request,
+)
 
 
 def load_OAuth_credentials(user_id):
-    cred_file = os.path.join(user_credential_folder, f"{user_id}.json")
+    creds = credential_cache.get(user_id)
 
-    if not os.path.exists(cred_file):
-        raise FileNotFoundError(f"Credential file not found: {cred_file}")
+    if creds is None:
+        raise FileNotFoundError(f"Credential not found for user: {user_id}")
 
-    creds = Credentials.from_authorized_user_file(cred_file, SCOPES)
     return creds
 
 
 def save_OAuth_credentials(user_id, creds):
-    # 確保目錄存在，再寫入憑證
-    os.makedirs(user_credential_folder, exist_ok=True)
-    cred_path = os.path.join(user_credential_folder, f"{user_id}.json")
+    credential_cache.put(user_id, creds)
+
+
+# 每位使用者的 Calendar service 物件，discovery document 每個 process 只解析一次
+calendar_service_factory = CalendarServiceFactory(
+    load_OAuth_credentials, transport=google_transport
+)
+
 
-    with open(cred_path, "w") as token:
-        token.write(creds.to_json())
+def get_calendar_service(user_id):
+    """取得使用者的 Google Calendar 服務（重用同一組憑證建立過的 service）"""
+    return calendar_service_factory.get(user_id)
 
 
 def get_flow(redirect_uri):
+    # oauthlib 只有未授權的使用者才會用到，不在啟動時載入
+    from google_auth_oauthlib.flow import Flow
 
     flow = None
 
@@ -68,94 +115,198 @@ def get_flow(redirect_uri):
         flow = Flow.from_client_config(
             client_config=CLIENT_SECRET_DICT, scopes=SCOPES, redirect_uri=redirect_uri
         )
-        print("✅ 使用 環境變數建立 OAuth Flow")
+        logger.info("✅ 使用 環境變數建立 OAuth Flow")
 
     except Exception as e:
 
-        print(f"❌ 使用 環境變數 建立 OAuth Flow 失敗: {e}")
+        logger.warning(f"❌ 使用 環境變數 建立 OAuth Flow 失敗: {e}")
 
         flow = Flow.from_client_secrets_file(
             f"{current_directory}/client_secret.json",
             scopes=SCOPES,
             redirect_uri=redirect_uri,
         )
-        print("使用 client_secret.json 建立 OAuth Flow")
+        logger.info("使用 client_secret.json 建立 OAuth Flow")
     return flow
 
 
 def OAuth_user_credential_is_valid(user_id):
     """
     判斷user憑證不存在或過期
+
+    只看 credential_cache 快取的狀態，不等待 token 更新；token 過期但有
+    refresh token 時視為有效，實際的更新在背景工作取得 service 時進行
     """
     try:
-        cred_path = os.path.join(user_credential_folder, f"{user_id}.json")
+        return credential_cache.is_usable(user_id)
+    except Exception as e:
+        logger.warning(f"檢查憑證有效性時發生錯誤: {e}")
+        return False
 
-        if not os.path.exists(cred_path):
-            return False
 
-        else:
-            creds = Credentials.from_authorized_user_file(
-                f"{user_credential_folder}/{user_id}.json", SCOPES
-            )
+# OCR 建立的事件在 extendedProperties.private 的標記，讀取時交給 Calendar 在 server 端篩選
+OCR_PRIVATE_PROPERTY = "created_by=ocr_service"
 
-        if not creds.valid:
-            if creds.expired and creds.refresh_token:
-                creds.refresh(Request())
-                # 將更新後的憑證儲存起來以供下次使用
-                with open(cred_path, "w") as token:
-                    token.write(creds.to_json())
-                return True
-            else:
-                return False
-
-        return True
-    except Exception as e:
-        print(f"檢查憑證有效性時發生錯誤: {e}")
-        return False
+# 比對班表只需要這些欄位，其餘欄位（描述、參與者、提醒…）不下載
+OCR_EVENT_FIELDS = (
+    "nextPageToken,items(id,summary,start,end,extendedProperties/private)"
+)
+
+
+def date_range_time_window(first_date_key, last_date_key):
+    """
+    first_date_key ~ last_date_key（YYYY-MM-DD，台北時間，含最後一天）的開始與結束，
+    回傳 Calendar API 使用的 UTC 字串
+    """
+    start_date = datetime.datetime.fromisoformat(first_date_key) - datetime.timedelta(
+        hours=8
+    )
+    end_date = (
+        datetime.datetime.fromisoformat(last_date_key)
+        + datetime.timedelta(days=1)
+        - datetime.timedelta(hours=8)
+    )
+
+    return start_date.isoformat() + "Z", end_date.isoformat() + "Z"
 
 
-def get_events_in_month(service, calendar_id="primary", year=None, month=None):
-    """獲取指定月份的所有事件"""
-    if year is None:
-        year = datetime.now().year
-    if month is None:
-        month = datetime.now().month
+def record_response_size(http_request, on_size):
+    """在 HttpRequest 解析回應前記錄回應的 bytes 數"""
+    postproc = http_request.postproc
 
-    # 設定月份開始和結束時間
-    start_date = datetime.datetime(year, month, 1) - datetime.timedelta(hours=8)
-    if month == 12:
-        next_month = datetime.datetime(year + 1, 1, 1)
+    def measured_postproc(resp, content):
+        on_size(len(content or b""))
+        return postproc(resp, content)
 
-    else:
-        next_month = datetime.datetime(year, month + 1, 1)
+    http_request.postproc = measured_postproc
+    return http_request
 
-    end_date = next_month - datetime.timedelta(hours=8)
 
-    time_min = start_date.isoformat() + "Z"
-    time_max = end_date.isoformat() + "Z"
+def iter_event_pages(
+    service,
+    calendar_id="primary",
+    user_id=None,
+    report=None,
+    **list_kwargs,
+):
+    """
+    依 nextPageToken 逐頁讀取 events().list，每頁 yield 一次回應
+    （items、nextPageToken、nextSyncToken）
 
-    events_result = (
-        service.events()
-        .list(
-            calendarId=calendar_id,
-            timeMin=time_min,
-            timeMax=time_max,
-            singleEvents=True,
-            orderBy="startTime",
+    有傳入 report 時，記錄每頁的 bytes 與事件數
+    """
+    page_token = None
+
+    while True:
+        # 重試時同一個請求會執行多次，只計算最後一次成功的回應
+        sizes = []
+        http_request = record_response_size(
+            service.events().list(
+                calendarId=calendar_id, pageToken=page_token, **list_kwargs
+            ),
+            sizes.append,
         )
-        .execute()
-    )
+        with span("calendar_list"):
+            page = calendar_scheduler.execute(user_id, http_request)
+
+        items = page.get("items", [])
+        if report is not None:
+            report.add_fetched_page(sizes[-1] if sizes else 0, len(items))
+
+        yield page
+
+        page_token = page.get("nextPageToken")
+        if not page_token:
+            return
+
+
+# OCR 事件的本機鏡像，以 syncToken 增量同步
+calendar_mirror = CalendarMirror(iter_event_pages)
+
+
+def get_events_in_range(
+    service,
+    calendar_id="primary",
+    time_min=None,
+    time_max=None,
+    user_id=None,
+    private_property=None,
+    fields=None,
+    report=None,
+):
+    """
+    獲取 time_min ~ time_max 之間的所有事件（會讀完所有分頁）
 
-    return events_result.get("items", [])
+    private_property: 例如 "created_by=ocr_service"，只讓 server 回傳符合的事件
+    fields: partial response 欄位，只下載需要的欄位
+    """
+    list_kwargs = {
+        "timeMin": time_min,
+        "timeMax": time_max,
+        "singleEvents": True,
+        "orderBy": "startTime",
+    }
+    if private_property is not None:
+        list_kwargs["privateExtendedProperty"] = private_property
+    if fields is not None:
+        list_kwargs["fields"] = fields
+
+    events = []
+    for page in iter_event_pages(
+        service, calendar_id, user_id=user_id, report=report, **list_kwargs
+    ):
+        events.extend(page.get("items", []))
+
+    return events
+
+
+def get_ocr_events_in_range(
+    service,
+    calendar_id="primary",
+    first_date_key=None,
+    last_date_key=None,
+    user_id=None,
+    report=None,
+):
+    """
+    獲取開始日期在 first_date_key ~ last_date_key（含）之間、由ocr_service創建的事件，
+    返回以開始日期為key的字典
 
+    班表跨月份時也只讀取一次（一個時間範圍），不必每個月分別讀取
+    """
 
-def get_current_month_ocr_events(service, calendar_id="primary", year=None, month=None):
-    """獲取當月所有由ocr_service創建的事件，返回以開始日期為key的字典"""
+    all_events = None
 
-    # 獲取該月份所有事件
-    all_events = get_events_in_month(service, calendar_id, year, month)
+    if CALENDAR_MIRROR and user_id is not None:
+        # 從本機鏡像取得，只送出一個 syncToken 增量請求
+        try:
+            all_events = calendar_mirror.range_events(
+                service,
+                user_id,
+                first_date_key,
+                last_date_key,
+                calendar_id,
+                report=report,
+            )
+        except Exception as e:
+            logger.warning(f"行事曆鏡像同步失敗，改為直接讀取事件: {e}")
+
+    if all_events is None:
+        time_min, time_max = date_range_time_window(first_date_key, last_date_key)
+
+        # 只讀取由 ocr_service 創建的事件（server 端篩選，只取需要的欄位）
+        all_events = get_events_in_range(
+            service,
+            calendar_id,
+            time_min,
+            time_max,
+            user_id,
+            private_property=OCR_PRIVATE_PROPERTY,
+            fields=OCR_EVENT_FIELDS,
+            report=report,
+        )
 
-    # 篩選出由ocr_service創建的事件，並按日期分組
+    # 按日期分組
     ocr_event_dict = {}
 
     for event in all_events:
@@ -178,66 +329,54 @@ def get_current_month_ocr_events(service, calendar_id="primary", year=None, mont
             # date 格式: 2024-01-15
             date_key = start_time
 
+        # timeMin / timeMax 以事件結束時間判斷，前一天跨夜的事件也會被讀到
+        if not first_date_key <= date_key <= last_date_key:
+            continue
+
         # 該日期應該只能有一個事件
         if date_key in ocr_event_dict:
-            print(f"{date_key}的事件已存在")
+            logger.warning(f"{date_key}的事件已存在")
             continue
 
         ocr_event_dict[date_key] = event
 
     total_events = len(ocr_event_dict.keys())
-    print(f"找到 {total_events} 個由ocr_service創建的事件")
-    print(f"涉及 {len(ocr_event_dict)} 個日期")
+    logger.info(f"找到 {total_events} 個由ocr_service創建的事件", extra=SAMPLED)
 
     return ocr_event_dict
 
 
-def update_exist_ocr_events(service, current_event_dict, new_event_dict):
-
-    to_create_event_list = []
-
-    for date, new_event in new_event_dict.items():
-
-        current_date_event_dict = current_event_dict.get(date, None)
-
-        if current_date_event_dict == None:
-
-            to_create_event_list.append(new_event)
-
-            continue
-        if current_date_event_dict.get("summary") == new_event.get("summary"):
-
-            continue
-
-        update_date_event_dict = current_date_event_dict.copy()
-
-        update_date_event_dict["summary"] = new_event["summary"]
-        update_date_event_dict["start"] = new_event["start"]
-        update_date_event_dict["end"] = new_event["end"]
-
-        try:
-            updated_event = (
-                service.events()
-                .update(
-                    calendarId="primary",
-                    eventId=update_date_event_dict["id"],
-                    body=update_date_event_dict,
-                )
-                .execute()
-            )
-
-            print(f"✓ 成功新增事件")
-            print(f"更新前:{current_date_event_dict['summary']}")
-            print(f"更新後:{update_date_event_dict['summary']}")
-
-        except Exception as e:
+def plan_calendar_sync(
+    new_event_dict, service, user_id=None, report=None, keep_dates=()
+):
+    """
+    比對新班表涵蓋的日期範圍內已存在的 OCR 事件與新班表，回傳 SyncPlan（不送出任何寫入）
 
-            print(f"✗ 更新事件失敗: {e}")
+    班表可能跨月份（格子中前後月份的日期），所有月份以同一個時間範圍讀取、比對：
+    - 新班表有、行事曆沒有：insert
+    - 兩者都有但 summary / start / end 不同：patch（只送出改變的欄位）
+    - 範圍內行事曆有、新班表沒有：delete（keep_dates 中沒辨識到班別的日期除外）
+    - 完全相同：noop
+    """
+    if not new_event_dict:
+        return diff_events({}, {})
+
+    sorted_dates = sorted(new_event_dict.keys())
+
+    current_event_dict = get_ocr_events_in_range(
+        service,
+        calendar_id="primary",
+        first_date_key=sorted_dates[0],
+        last_date_key=sorted_dates[-1],
+        user_id=user_id,
+        report=report,
+    )
 
-    return to_create_event_list
+    return diff_events(current_event_dict, new_event_dict, keep_dates=keep_dates)
 
 
-def create_new_event(service, to_create_event):
+def mark_ocr_event(to_create_event):
+    """在事件的 extendedProperties 記錄為 OCR 建立，之後才能找回並更新"""
 
     if "extendedProperties" not in to_create_event:
         to_create_event["extendedProperties"] = {"private": {}, "shared": {}}  # 可選
@@ -251,43 +390,51 @@ def create_new_event(service, to_create_event):
         }
     )
 
-    try:
-        # 執行新增操作
-        created_event = (
-            service.events()
-            .insert(calendarId="primary", body=to_create_event)
-            .execute()
-        )
+    return to_create_event
 
-        print(f"✓ 成功新增事件: {created_event.get('summary', '無標題')}")
-        return created_event
 
-    except Exception as e:
-        print(f"✗ 新增事件失敗: {e}")
+def create_events_in_calendar(
+    new_event_dict, service, user_id=None, dry_run=False, keep_dates=()
+):
+    """
+    new_event_dict = calender_event_dict # key: date, value: event（可跨月份）
 
+    先比對出最少的變更（plan_calendar_sync），新增、更新與刪除的請求
+    會打包成 batch 送出，並經過 calendar_scheduler 限速與重試；
+    班表與行事曆相同時不會送出任何寫入
 
-def create_events_in_calendar(year, month, new_event_dict, service):
+    dry_run=True 時只產生變更計畫，不寫入行事曆
+    keep_dates: 沒辨識到班別的日期，既有事件不刪除
+    回傳 CalendarSyncReport，report.plan 為這次的變更計畫
     """
-    year = 2025
-    month = 9
+    report = CalendarSyncReport()
 
-    new_event_dict = calender_event_dict # key: date, value: event
-    """
-    current_event_dict = get_current_month_ocr_events(
-        service, calendar_id="primary", year=year, month=month
+    plan = plan_calendar_sync(
+        new_event_dict, service, user_id=user_id, report=report, keep_dates=keep_dates
     )
-
-    to_create_event_list = update_exist_ocr_events(
-        service, current_event_dict, new_event_dict
+    report.plan = plan
+    logger.info(
+        f"讀取既有事件 {report.fetched['pages']} 頁、{report.fetched['bytes']} bytes，"
+        f"變更 {plan.counts()}",
+        extra=SAMPLED,
+    )
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug(plan.describe())
+
+    if dry_run or not plan.has_writes:
+        return report
+
+    execute_in_batches(
+        service,
+        plan.to_operations(service, mark_ocr_event),
+        report,
+        scheduler=calendar_scheduler,
+        user_id=user_id,
     )
 
-    count = 0
-    for event in to_create_event_list:
-
-        create_new_event(service, event)
-
-        # count += 1
+    logger.info(
+        f"✓ 新增 {report.count('insert')} 筆、更新 {report.count('patch')} 筆、"
+        f"刪除 {report.count('delete')} 筆、失敗 {len(report.failed)} 筆"
+    )
 
-        # if count > 10:
-        #     print("已新增10個事件，停止新增")
-        #     break
+    return report
@@ -0,0 +1,339 @@
+import os
+import time
+import datetime
+import threading
+from concurrent.futures import Future
+
+from google.auth.exceptions import RefreshError
+from google.auth.transport.requests import Request
+
+from monitoring.logger import get_logger
+from monitoring.metrics import span
+
+logger = get_logger(__name__)
+
+# token 在到期前多少秒由背景 thread 先更新
+CREDENTIAL_REFRESH_MARGIN = int(os.getenv("CREDENTIAL_REFRESH_MARGIN", "300"))
+
+# 背景 thread 多久檢查一次快取中的 token
+CREDENTIAL_REFRESH_INTERVAL = int(os.getenv("CREDENTIAL_REFRESH_INTERVAL", "60"))
+
+# 快取的憑證多久重新確認一次版本（例如檔案 mtime），偵測其他 worker 寫入的新憑證
+CREDENTIAL_VERSION_CHECK_SECONDS = float(
+    os.getenv("CREDENTIAL_VERSION_CHECK_SECONDS", "30")
+)
+
+# 快取最多保留幾位使用者的憑證，超過時移除最久未使用的
+CREDENTIAL_CACHE_MAX_USERS = int(os.getenv("CREDENTIAL_CACHE_MAX_USERS", "5000"))
+
+# 最近多少秒內用過憑證的使用者才由背景 thread 預先更新，其餘在下次使用時才更新
+CREDENTIAL_ACTIVE_SECONDS = float(os.getenv("CREDENTIAL_ACTIVE_SECONDS", "1800"))
+
+
+def is_revoked_error(error):
+    """
+    RefreshError 是否代表 refresh token 已失效（token endpoint 回覆 invalid_grant）
+
+    5xx、逾時等可重試的錯誤不算撤銷，憑證保留，下次使用時或由背景 thread 再更新
+    """
+    if getattr(error, "retryable", False):
+        return False
+    return any("invalid_grant" in str(arg) for arg in error.args)
+
+
+def utcnow():
+    # google-auth 的 expiry 為不含時區的 UTC 時間
+    return datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+
+
+class CredentialEntry:
+    def __init__(self, credentials, version):
+        self.credentials = credentials
+        self.version = version
+        self.checked_at = time.monotonic()
+        self.used_at = time.monotonic()
+        # refresh token 已被撤銷，需要使用者重新授權
+        self.revoked = False
+
+
+class CredentialCache:
+    """
+    每個 process 共用的 OAuth 憑證快取，以 LINE user_id 為 key
+
+    - load(user_id) / save(user_id, creds) / version(user_id) 由呼叫端提供，
+      version 改變（例如檔案 mtime）時重新讀取；mark_revoked(user_id) 只在
+      token endpoint 回覆 invalid_grant 時呼叫，其他錯誤保留憑證、之後再更新
+    - 背景 thread 在 token 到期前 refresh_margin 秒先更新並寫回，只處理
+      active_seconds 內用過的使用者，其餘在下次使用時才更新
+    - 同一位使用者同時有多個 refresh 時，只會呼叫一次 token endpoint
+    """
+
+    def __init__(
+        self,
+        load,
+        save,
+        version,
+        refresh_margin=CREDENTIAL_REFRESH_MARGIN,
+        refresh_interval=CREDENTIAL_REFRESH_INTERVAL,
+        version_check_seconds=CREDENTIAL_VERSION_CHECK_SECONDS,
+        max_users=CREDENTIAL_CACHE_MAX_USERS,
+        active_seconds=CREDENTIAL_ACTIVE_SECONDS,
+        mark_revoked=None,
+        request_factory=Request,
+    ):
+        self.load = load
+        self.save = save
+        self.version = version
+        self.mark_revoked = mark_revoked
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+        self.refresh_interval = refresh_interval
+        self.version_check_seconds = version_check_seconds
+        self.max_users = max_users
+        self.active_seconds = active_seconds
+
+        # refresh 使用的 google.auth Request（可換成共用連線池的版本）
+        self.request_factory = request_factory
+
+        self._lock = threading.Lock()
+        self._entries = {}
+        self._inflight = {}
+        self._refresher_pid = None
+        self._stop = threading.Event()
+
+        self._stats = {
+            "hits": 0,
+            "loads": 0,
+            "reloads": 0,
+            "refreshes": 0,
+            "background_refreshes": 0,
+            "coalesced": 0,
+            "refresh_failures": 0,
+            "revoked": 0,
+        }
+
+    def get(self, user_id):
+        """
+        取得可用的憑證，沒有憑證或已被撤銷時回傳 None
+
+        token 通常已由背景 thread 更新；只有在背景 thread 來不及時才會同步 refresh，
+        token endpoint 暫時失敗時拋出 RefreshError，憑證保留
+        """
+        self._ensure_refresher()
+
+        entry = self._get_entry(user_id)
+        if entry is None or entry.revoked:
+            return None
+
+        credentials = entry.credentials
+        if not credentials.valid:
+            if not credentials.refresh_token:
+                return None
+            self.refresh(user_id, entry)
+            if entry.revoked:
+                return None
+
+        return credentials
+
+    def is_usable(self, user_id):
+        """
+        使用者是否有可用的憑證（webhook 使用）
+
+        只看快取的狀態，不呼叫 token endpoint：有 refresh token 且未被撤銷即可使用。
+        token 已過期時在背景開始更新（不等待），實際的更新與錯誤處理在背景工作
+        呼叫 get() 時進行
+        """
+        self._ensure_refresher()
+
+        entry = self._get_entry(user_id)
+        if entry is None or entry.revoked:
+            return False
+
+        credentials = entry.credentials
+        if credentials.valid:
+            return True
+        if not credentials.refresh_token:
+            return False
+
+        self._schedule_refresh(user_id, entry)
+        return True
+
+    def put(self, user_id, credentials):
+        """寫入新的憑證（例如剛完成 OAuth 授權）並更新快取"""
+        self.save(user_id, credentials)
+        entry = CredentialEntry(credentials, self.version(user_id))
+        with self._lock:
+            self._entries[user_id] = entry
+            self._evict_locked()
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def refresh(self, user_id, entry=None):
+        """更新使用者的 token；同時有多個呼叫時，其他呼叫等待第一個的結果"""
+        if entry is None:
+            entry = self._get_entry(user_id)
+            if entry is None:
+                return None
+
+        with self._lock:
+            future = self._inflight.get(user_id)
+            if future is not None:
+                self._stats["coalesced"] += 1
+                owner = False
+            else:
+                future = Future()
+                self._inflight[user_id] = future
+                owner = True
+
+        if not owner:
+            return future.result()
+
+        try:
+            with span("credential_refresh"):
+                entry.credentials.refresh(self.request_factory())
+            self.save(user_id, entry.credentials)
+            entry.version = self.version(user_id)
+            entry.checked_at = time.monotonic()
+            with self._lock:
+                self._stats["refreshes"] += 1
+            future.set_result(entry.credentials)
+            return entry.credentials
+
+        except RefreshError as e:
+            if not is_revoked_error(e):
+                # 5xx、逾時等暫時性錯誤：保留憑證，下次使用或背景 thread 再更新
+                logger.warning(f"更新使用者 {user_id} 的 token 暫時失敗: {e}")
+                with self._lock:
+                    self._stats["refresh_failures"] += 1
+                future.set_exception(e)
+                raise
+
+            # invalid_grant：refresh token 已失效，需要使用者重新授權
+            logger.warning(f"使用者 {user_id} 的 refresh token 已失效: {e}")
+            entry.revoked = True
+            with self._lock:
+                self._stats["refresh_failures"] += 1
+                self._stats["revoked"] += 1
+            if self.mark_revoked is not None:
+                self.mark_revoked(user_id)
+            future.set_result(None)
+            return None
+
+        except Exception as e:
+            with self._lock:
+                self._stats["refresh_failures"] += 1
+            future.set_exception(e)
+            raise
+
+        finally:
+            with self._lock:
+                self._inflight.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["users"] = len(self._entries)
+            return stats
+
+    def stop(self):
+        self._stop.set()
+
+    def _get_entry(self, user_id):
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None:
+                entry.used_at = now
+                if now - entry.checked_at < self.version_check_seconds:
+                    self._stats["hits"] += 1
+                    return entry
+
+        # 第一次讀取，或超過確認間隔時，比對版本（其他 worker 可能已更新憑證）
+        version = self.version(user_id)
+        if version is None:
+            self.invalidate(user_id)
+            return None
+
+        if entry is not None and entry.version == version:
+            entry.checked_at = now
+            with self._lock:
+                self._stats["hits"] += 1
+            return entry
+
+        with span("credential_load"):
+            credentials = self.load(user_id)
+        if credentials is None:
+            self.invalidate(user_id)
+            return None
+
+        new_entry = CredentialEntry(credentials, version)
+        with self._lock:
+            self._stats["reloads" if entry is not None else "loads"] += 1
+            self._entries[user_id] = new_entry
+            self._evict_locked()
+        return new_entry
+
+    def _evict_locked(self):
+        overflow = len(self._entries) - self.max_users
+        if overflow <= 0:
+            return
+
+        oldest = sorted(self._entries.items(), key=lambda item: item[1].used_at)
+        for user_id, _ in oldest[:overflow]:
+            del self._entries[user_id]
+
+    def _needs_refresh(self, entry):
+        credentials = entry.credentials
+        if entry.revoked or not credentials.refresh_token:
+            return False
+        # 一段時間沒用過的使用者不預先更新，下次使用時由 get() 同步更新
+        if time.monotonic() - entry.used_at > self.active_seconds:
+            return False
+        if credentials.token is None or credentials.expiry is None:
+            return True
+        return credentials.expiry - utcnow() < self.refresh_margin
+
+    def _refresh_quietly(self, user_id, entry):
+        try:
+            self.refresh(user_id, entry)
+        except Exception as e:
+            logger.warning(f"更新使用者 {user_id} 的 token 失敗: {e}")
+
+    def _schedule_refresh(self, user_id, entry):
+        # 已有更新在進行時不另外啟動 thread；重複啟動也只會呼叫一次 token endpoint
+        with self._lock:
+            if user_id in self._inflight:
+                return
+        thread = threading.Thread(
+            target=self._refresh_quietly, args=(user_id, entry), daemon=True
+        )
+        thread.start()
+
+    def _ensure_refresher(self):
+        # gunicorn fork 後，子行程要啟動自己的背景 thread
+        if self.refresh_interval <= 0 or self._refresher_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._refresher_pid == os.getpid():
+                return
+            self._refresher_pid = os.getpid()
+
+        thread = threading.Thread(
+            target=self._refresh_loop, name="credential-refresher", daemon=True
+        )
+        thread.start()
+
+    def _refresh_loop(self):
+        while not self._stop.wait(self.refresh_interval):
+            with self._lock:
+                entries = list(self._entries.items())
+
+            for user_id, entry in entries:
+                if not self._needs_refresh(entry):
+                    continue
+
+                with self._lock:
+                    self._stats["background_refreshes"] += 1
+                self._refresh_quietly(user_id, entry)
@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import sqlite3
+import argparse
+import datetime
+import tempfile
+import threading
+
+from google.oauth2.credentials import Credentials
+
+from monitoring.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 憑證儲存方式：file（每位使用者一個 JSON 檔，預設）或 sqlite（單一資料庫檔案）
+CREDENTIAL_STORE = os.getenv("CREDENTIAL_STORE", "file")
+
+# SQLite 檔案位置，未設定時放在憑證資料夾內
+CREDENTIAL_DB_PATH = os.getenv("CREDENTIAL_DB_PATH")
+
+REVOKED_SUFFIX = ".revoked"
+
+
+def expiry_timestamp(creds):
+    """token 到期時間（UTC epoch 秒），沒有到期時間時回傳 None"""
+    if creds.expiry is None:
+        return None
+    return creds.expiry.replace(tzinfo=datetime.timezone.utc).timestamp()
+
+
+class FileCredentialStore:
+    """
+    原本的格式：user_credential_folder/{user_id}.json
+
+    寫入時先寫暫存檔再 rename，兩個 worker 同時更新也不會讀到寫一半的檔案
+    """
+
+    def __init__(self, folder, scopes):
+        self.folder = folder
+        self.scopes = scopes
+        # iter_credentials 略過的檔案數量
+        self.skipped = 0
+        os.makedirs(folder, exist_ok=True)
+
+    def path(self, user_id):
+        return os.path.join(self.folder, f"{user_id}.json")
+
+    def load(self, user_id):
+        try:
+            with open(self.path(user_id), "r") as file:
+                info = json.load(file)
+        except FileNotFoundError:
+            return None
+
+        return Credentials.from_authorized_user_info(info, self.scopes)
+
+    def save(self, user_id, creds):
+        self._write_atomic(self.path(user_id), creds.to_json())
+
+    def version(self, user_id):
+        """以檔案 mtime 作為憑證版本，檔案不存在時回傳 None"""
+        try:
+            return os.stat(self.path(user_id)).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def delete(self, user_id):
+        for path in (self.path(user_id), self.path(user_id) + REVOKED_SUFFIX):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+    def mark_revoked(self, user_id):
+        """refresh token 已失效：改名保留，使用者會被要求重新授權"""
+        try:
+            os.replace(self.path(user_id), self.path(user_id) + REVOKED_SUFFIX)
+        except FileNotFoundError:
+            pass
+
+    def list_users(self):
+        return [
+            name[: -len(".json")]
+            for name in os.listdir(self.folder)
+            if name.endswith(".json")
+        ]
+
+    def iter_credentials(self):
+        """
+        逐一回傳 (user_id, 憑證 JSON dict, Credentials)
+
+        無法讀取或解析的檔案（例如缺少 refresh_token）記錄後略過，數量累計在 skipped
+        """
+        for user_id in self.list_users():
+            try:
+                with open(self.path(user_id), "r") as file:
+                    info = json.load(file)
+                creds = Credentials.from_authorized_user_info(info, self.scopes)
+            except (OSError, ValueError, KeyError) as e:
+                logger.warning(f"讀取憑證 {user_id} 失敗，略過: {e}")
+                self.skipped += 1
+                continue
+            yield user_id, info, creds
+
+    def list_expiring(self, within_seconds):
+        """列出 token 在 within_seconds 秒內到期的使用者（需逐檔讀取）"""
+        deadline = time.time() + within_seconds
+        user_ids = []
+        for user_id, _, creds in self.iter_credentials():
+            expiry = expiry_timestamp(creds)
+            if expiry is not None and expiry <= deadline:
+                user_ids.append(user_id)
+        return user_ids
+
+    def purge_revoked(self):
+        """刪除已失效的憑證，回傳刪除的數量"""
+        count = 0
+        for name in os.listdir(self.folder):
+            if name.endswith(".json" + REVOKED_SUFFIX):
+                os.remove(os.path.join(self.folder, name))
+                count += 1
+        return count
+
+    def _write_atomic(self, path, content):
+        fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+        try:
+            with os.fdopen(fd, "w") as file:
+                file.write(content)
+            os.replace(tmp_path, path)
+        except Exception:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+            raise
+
+
+class SQLiteCredentialStore:
+    """
+    所有使用者的憑證存在單一 SQLite 檔案
+
+    - user_id 為 primary key，寫入使用 upsert，version 每次寫入加 1
+    - expiry 有 index，可快速列出即將到期的 token
+    """
+
+    def __init__(self, db_path, scopes):
+        self.db_path = db_path
+        self.scopes = scopes
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS credentials (
+                user_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expiry REAL,
+                revoked INTEGER NOT NULL DEFAULT 0,
+                version INTEGER NOT NULL DEFAULT 1,
+                updated_at REAL NOT NULL
+            )
+            """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_credentials_expiry "
+            "ON credentials (revoked, expiry)"
+        )
+
+    def _connect(self):
+        # sqlite3 connection 不能跨 thread / fork 共用
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def load(self, user_id):
+        row = (
+            self._connect()
+            .execute(
+                "SELECT data FROM credentials WHERE user_id = ? AND revoked = 0",
+                (user_id,),
+            )
+            .fetchone()
+        )
+        if row is None:
+            return None
+
+        return Credentials.from_authorized_user_info(json.loads(row[0]), self.scopes)
+
+    def save(self, user_id, creds):
+        self.save_info(user_id, json.loads(creds.to_json()), expiry_timestamp(creds))
+
+    def save_info(self, user_id, info, expiry=None):
+        self._connect().execute(
+            "INSERT INTO credentials (user_id, data, expiry, revoked, version, updated_at) "
+            "VALUES (?, ?, ?, 0, 1, ?) "
+            "ON CONFLICT(user_id) DO UPDATE SET "
+            "data = excluded.data, expiry = excluded.expiry, revoked = 0, "
+            "version = credentials.version + 1, updated_at = excluded.updated_at",
+            (user_id, json.dumps(info), expiry, time.time()),
+        )
+
+    def version(self, user_id):
+        row = (
+            self._connect()
+            .execute(
+                "SELECT version FROM credentials WHERE user_id = ? AND revoked = 0",
+                (user_id,),
+            )
+            .fetchone()
+        )
+        return row[0] if row else None
+
+    def delete(self, user_id):
+        self._connect().execute("DELETE FROM credentials WHERE user_id = ?", (user_id,))
+
+    def mark_revoked(self, user_id):
+        self._connect().execute(
+            "UPDATE credentials SET revoked = 1, updated_at = ? WHERE user_id = ?",
+            (time.time(), user_id),
+        )
+
+    def list_users(self):
+        rows = self._connect().execute(
+            "SELECT user_id FROM credentials WHERE revoked = 0"
+        )
+        return [row[0] for row in rows]
+
+    def list_expiring(self, within_seconds):
+        rows = self._connect().execute(
+            "SELECT user_id FROM credentials "
+            "WHERE revoked = 0 AND expiry IS NOT NULL AND expiry <= ? "
+            "ORDER BY expiry",
+            (time.time() + within_seconds,),
+        )
+        return [row[0] for row in rows]
+
+    def purge_revoked(self):
+        cursor = self._connect().execute("DELETE FROM credentials WHERE revoked = 1")
+        return cursor.rowcount
+
+
+def create_credential_store(folder, scopes):
+    """依環境變數 CREDENTIAL_STORE 建立憑證儲存"""
+    if CREDENTIAL_STORE == "sqlite":
+        db_path = CREDENTIAL_DB_PATH or os.path.join(folder, "credentials.sqlite3")
+        return SQLiteCredentialStore(db_path, scopes)
+
+    return FileCredentialStore(folder, scopes)
+
+
+def migrate_folder_to_sqlite(folder, db_path, scopes=None):
+    """
+    把 {user_id}.json 資料夾格式的憑證匯入 SQLite，回傳 (匯入數量, 略過數量)
+
+    已存在的使用者會被覆寫；無法解析的檔案記錄後略過，不影響其他使用者；
+    原本的檔案不會刪除，確認無誤後再自行清除
+    """
+    source = FileCredentialStore(folder, scopes)
+    target = SQLiteCredentialStore(db_path, scopes)
+
+    count = 0
+    conn = target._connect()
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        for user_id, info, creds in source.iter_credentials():
+            target.save_info(user_id, info, expiry_timestamp(creds))
+            count += 1
+        conn.execute("COMMIT")
+    except Exception:
+        conn.execute("ROLLBACK")
+        raise
+
+    return count, source.skipped
+
+
+def main():
+    parser = argparse.ArgumentParser(description="把使用者憑證資料夾匯入 SQLite")
+    parser.add_argument("folder", help="存放 {user_id}.json 的資料夾")
+    parser.add_argument(
+        "--db", help="SQLite 檔案位置，預設為資料夾內的 credentials.sqlite3"
+    )
+    args = parser.parse_args()
+
+    db_path = args.db or os.path.join(args.folder, "credentials.sqlite3")
+    count, skipped = migrate_folder_to_sqlite(args.folder, db_path)
+    print(f"已匯入 {count} 位使用者的憑證到 {db_path}")
+    if skipped:
+        print(f"略過 {skipped} 個無法解析的憑證檔案")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,198 @@
+import os
+import time
+import threading
+
+import httplib2
+import requests
+import google_auth_httplib2
+from requests.adapters import HTTPAdapter
+from google.auth.transport.requests import Request
+
+# 每個 host 最多保留幾條 keep-alive 連線；全部使用中時，新的請求會等待空出的連線
+GOOGLE_HTTP_POOL_SIZE = int(os.getenv("GOOGLE_HTTP_POOL_SIZE", "20"))
+
+# 連線 / 讀取逾時秒數
+GOOGLE_HTTP_CONNECT_TIMEOUT = float(os.getenv("GOOGLE_HTTP_CONNECT_TIMEOUT", "5"))
+GOOGLE_HTTP_READ_TIMEOUT = float(os.getenv("GOOGLE_HTTP_READ_TIMEOUT", "30"))
+
+# requests 已解壓縮內容，這些 header 不能原樣交給 googleapiclient
+DROPPED_RESPONSE_HEADERS = ("content-encoding", "content-length", "transfer-encoding")
+
+
+class SharedSessionRequest(Request):
+    """google.auth 的 Request 被回收時會關閉 session，共用的連線池不能因此被清空"""
+
+    def __del__(self):
+        pass
+
+
+class PooledHttp:
+    """
+    httplib2.Http 相容的介面，實際透過共用的 requests.Session 送出
+
+    googleapiclient 與 google_auth_httplib2 只會呼叫 request()，
+    因此所有使用者的 Calendar service 都可共用同一個連線池
+    """
+
+    def __init__(self, transport):
+        self.transport = transport
+        self.timeout = transport.read_timeout
+        self.redirect_codes = set(httplib2.REDIRECT_CODES)
+
+    def request(
+        self,
+        uri,
+        method="GET",
+        body=None,
+        headers=None,
+        redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+        connection_type=None,
+    ):
+        if isinstance(body, str):
+            body = body.encode("utf-8")
+
+        response = self.transport.send(
+            method,
+            uri,
+            data=body,
+            headers=headers,
+            allow_redirects=redirections > 0,
+        )
+
+        info = {
+            key.lower(): value
+            for key, value in response.headers.items()
+            if key.lower() not in DROPPED_RESPONSE_HEADERS
+        }
+        info["status"] = str(response.status_code)
+
+        resp = httplib2.Response(info)
+        resp.reason = response.reason
+        return resp, response.content
+
+    def close(self):
+        pass
+
+
+class PooledTransport:
+    """
+    所有 Google API 呼叫共用的 keep-alive 連線池
+
+    - http()：給 googleapiclient 使用的 httplib2 相容物件
+    - authorized_http(credentials)：加上 OAuth 憑證的版本，token 過期時也透過同一個池更新
+    - auth_request()：給 credentials.refresh() 使用的 google.auth Request
+    - stats()：請求數、進行中的請求、連線池使用量
+    """
+
+    def __init__(
+        self,
+        pool_size=GOOGLE_HTTP_POOL_SIZE,
+        connect_timeout=GOOGLE_HTTP_CONNECT_TIMEOUT,
+        read_timeout=GOOGLE_HTTP_READ_TIMEOUT,
+    ):
+        self.pool_size = pool_size
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+
+        self._lock = threading.Lock()
+        self._session = None
+        self._adapter = None
+        self._pid = None
+        self._http = PooledHttp(self)
+
+        self._stats = {
+            "requests": 0,
+            "errors": 0,
+            "in_flight": 0,
+            "max_in_flight": 0,
+            "seconds_total": 0.0,
+        }
+
+    def session(self):
+        # gunicorn fork 後，子行程不能沿用父行程的 socket
+        with self._lock:
+            if self._session is None or self._pid != os.getpid():
+                self._adapter = HTTPAdapter(
+                    pool_connections=4,
+                    pool_maxsize=self.pool_size,
+                    pool_block=True,
+                    max_retries=0,
+                )
+                self._session = requests.Session()
+                self._session.mount("https://", self._adapter)
+                self._session.mount("http://", self._adapter)
+                self._pid = os.getpid()
+            return self._session
+
+    def send(self, method, url, **kwargs):
+        session = self.session()
+        kwargs.setdefault("timeout", (self.connect_timeout, self.read_timeout))
+
+        with self._lock:
+            self._stats["requests"] += 1
+            self._stats["in_flight"] += 1
+            self._stats["max_in_flight"] = max(
+                self._stats["max_in_flight"], self._stats["in_flight"]
+            )
+
+        start_time = time.perf_counter()
+        try:
+            return session.request(method, url, **kwargs)
+
+        # 轉成內建例外，googleapiclient 的 num_retries 才會重試
+        except requests.exceptions.Timeout as e:
+            self._record_error()
+            raise TimeoutError(str(e)) from e
+        except requests.exceptions.ConnectionError as e:
+            self._record_error()
+            raise ConnectionError(str(e)) from e
+        except Exception:
+            self._record_error()
+            raise
+
+        finally:
+            with self._lock:
+                self._stats["in_flight"] -= 1
+                self._stats["seconds_total"] += time.perf_counter() - start_time
+
+    def http(self):
+        return self._http
+
+    def authorized_http(self, credentials):
+        return google_auth_httplib2.AuthorizedHttp(credentials, http=self._http)
+
+    def auth_request(self):
+        return SharedSessionRequest(session=self.session())
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            adapter = self._adapter if self._pid == os.getpid() else None
+
+        pools = []
+        if adapter is not None:
+            # 設定了 HTTPS_PROXY 時，連線池在 proxy_manager 裡
+            managers = [adapter.poolmanager] + list(adapter.proxy_manager.values())
+            for manager in managers:
+                for key in list(manager.pools.keys()):
+                    pool = manager.pools.get(key)
+                    if pool is None:
+                        continue
+                    idle = sum(1 for conn in list(pool.pool.queue) if conn is not None)
+                    pools.append(
+                        {
+                            "host": pool.host,
+                            "connections_opened": pool.num_connections,
+                            "requests": pool.num_requests,
+                            "in_use": pool.pool.maxsize - pool.pool.qsize(),
+                            "idle": idle,
+                            "max_size": pool.pool.maxsize,
+                        }
+                    )
+
+        stats["pools"] = pools
+        return stats
+
+    def _record_error(self):
+        with self._lock:
+            self._stats["errors"] += 1
@@ -0,0 +1,73 @@
+"""
+建立 Google Calendar service 的效能測試
+
+比較每次上傳都呼叫 googleapiclient.discovery.build 與 CalendarServiceFactory
+（discovery document 只解析一次、依使用者重用 service）的耗時
+不會連線到 Google，只量測建立 service 物件的成本
+
+用法（在專案根目錄）：
+    python -m benchmark.bench_calendar_service [--repeat 200] [--users 20]
+"""
+
+import argparse
+import time
+
+from google.oauth2.credentials import Credentials
+from googleapiclient.discovery import build
+
+from auto_calendar.calendar_service import CalendarServiceFactory
+
+
+def measure(func, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        func(i)
+    return (time.perf_counter() - start) / repeat * 1000
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    parser.add_argument("--users", type=int, default=20)
+    args = parser.parse_args()
+
+    credentials = {
+        f"user{i}": Credentials(token=f"token{i}") for i in range(args.users)
+    }
+    user_ids = list(credentials)
+
+    def user_of(i):
+        return user_ids[i % len(user_ids)]
+
+    factory = CalendarServiceFactory(credentials.get)
+
+    first_start = time.perf_counter()
+    factory.build(credentials[user_ids[0]])
+    first_ms = (time.perf_counter() - first_start) * 1000
+
+    results = {
+        "build(static_discovery)": measure(
+            lambda i: build(
+                "calendar",
+                "v3",
+                credentials=credentials[user_of(i)],
+                static_discovery=True,
+                cache_discovery=False,
+            ),
+            args.repeat,
+        ),
+        "factory.build": measure(
+            lambda i: factory.build(credentials[user_of(i)]), args.repeat
+        ),
+        "factory.get (LRU)": measure(lambda i: factory.get(user_of(i)), args.repeat),
+    }
+
+    print(f"第一次解析 discovery document: {first_ms:.2f} ms")
+    baseline = results["build(static_discovery)"]
+    for name, ms in results.items():
+        print(f"{name:<26} {ms:8.3f} ms/次  ({baseline / ms:6.1f}x)")
+    print(factory.stats())
+
+
+if __name__ == "__main__":
+    main()
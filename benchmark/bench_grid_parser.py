@@ -0,0 +1,163 @@
+"""
+依座標解析班表格子（ocr/grid_parser.py）的驗證與效能測試
+
+對 ocr/ocr_result 的每個版面：
+- 比較依文字順序（text_to_calender_event_dict）與依座標（layout_to_calender_event_dict）
+  解析出的班表是否相同（僅供參考，文字解析本身可能錯位），以及解析耗時
+- 模擬 OCR 的常見問題，確認座標解析不會整段錯位：
+  drop    —— 刪掉中間某一格的班別（文字解析會讓之後的日期全部往前移）
+  shuffle —— 打亂每一行中 word 的順序、把一列拆成上下兩行（文字順序被打亂）
+
+任何一個版面驗證失敗時 exit code 為 1
+
+用法（在專案根目錄）：
+    python -m benchmark.bench_grid_parser [--repeat 50] [--seed 0]
+"""
+
+import os
+import sys
+import time
+import random
+import argparse
+
+# 解析改用文字順序時會寫 log，測量時只顯示警告
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+
+from benchmark.fake_vision import load_fixtures
+from ocr.process_text import (
+    layout_to_calender_event_dict,
+    lines_to_text,
+    text_to_calender_event_dict,
+)
+from ocr.shift_table import get_shift_table
+
+
+def summaries(calender_event_dict):
+    return {
+        date_key: event["summary"] for date_key, event in calender_event_dict.items()
+    }
+
+
+def shift_words(sorted_lines_dict, shift_table):
+    """「剩餘年假」之後所有班別 word 的位置 [(line_y, index)]"""
+    positions = []
+    anchor_passed = False
+    for y in sorted(sorted_lines_dict.keys()):
+        words = sorted_lines_dict[y]
+        if not anchor_passed:
+            anchor_passed = "剩餘年假" in "".join(w["text"] for w in words)
+            continue
+        for index, word in enumerate(words):
+            if shift_table.lexer.fullmatch(word["text"]):
+                positions.append((y, index))
+    return positions
+
+
+def drop_middle_shift(sorted_lines_dict, shift_table):
+    """刪掉中間的一個班別，回傳 (新版面, 被刪掉的 word)"""
+    positions = shift_words(sorted_lines_dict, shift_table)
+    y, index = positions[len(positions) // 2]
+    layout = {line_y: list(words) for line_y, words in sorted_lines_dict.items()}
+    dropped = layout[y].pop(index)
+    return layout, dropped
+
+
+def shuffle_layout(sorted_lines_dict, rng):
+    """
+    打亂班表格子內 word 的順序，並把每一行的後半部移到另一行（y + 1）
+    （標題的年月不動）
+    """
+    layout = {}
+    anchor_passed = False
+    for y in sorted(sorted_lines_dict.keys()):
+        words = list(sorted_lines_dict[y])
+        if not anchor_passed:
+            anchor_passed = "剩餘年假" in "".join(w["text"] for w in words)
+            layout[y] = words
+            continue
+
+        rng.shuffle(words)
+        half = len(words) // 2
+        layout.setdefault(y, []).extend(words[:half])
+        if words[half:]:
+            layout.setdefault(y + 1, []).extend(words[half:])
+    return layout
+
+
+def measure(func, argument, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(argument)
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=50)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    shift_table = get_shift_table()
+    failures = []
+
+    print(
+        f"{'fixture':<22}{'days':>5}{'same':>6}{'conf':>7}{'text ms':>9}{'grid ms':>9}"
+        f"{'drop text':>11}{'drop grid':>11}{'shuffle':>9}"
+    )
+
+    for name, sorted_lines_dict in load_fixtures().items():
+        text_ms, (_, _, text_events) = measure(
+            text_to_calender_event_dict, lines_to_text(sorted_lines_dict), args.repeat
+        )
+        grid_ms, (_, _, grid_events, grid) = measure(
+            layout_to_calender_event_dict, sorted_lines_dict, args.repeat
+        )
+        expected = summaries(grid_events)
+        same = summaries(text_events) == expected
+        confidence = grid.mean_confidence if grid is not None else 0.0
+
+        # drop：只應少掉被刪的那一天，其他日期不變
+        layout, dropped = drop_middle_shift(sorted_lines_dict, shift_table)
+        _, _, dropped_text = text_to_calender_event_dict(lines_to_text(layout))
+        _, _, dropped_grid, dropped_result = layout_to_calender_event_dict(layout)
+        text_wrong = sum(
+            1
+            for date_key, summary in summaries(dropped_text).items()
+            if expected.get(date_key) != summary
+        )
+        grid_wrong = sum(
+            1
+            for date_key, summary in summaries(dropped_grid).items()
+            if expected.get(date_key) != summary
+        )
+        missing = set(expected) - set(dropped_grid)
+        drop_ok = grid_wrong == 0 and len(missing) == 1
+
+        # shuffle：座標解析的結果應完全相同
+        _, _, shuffled_grid, _ = layout_to_calender_event_dict(
+            shuffle_layout(sorted_lines_dict, rng)
+        )
+        shuffle_ok = summaries(shuffled_grid) == expected
+
+        if grid is None or not drop_ok or not shuffle_ok:
+            failures.append(name)
+
+        print(
+            f"{name:<22}{len(expected):>5}{str(same):>6}{confidence:>7.2f}"
+            f"{text_ms:>9.3f}{grid_ms:>9.3f}"
+            f"{text_wrong:>8} bad{grid_wrong:>8} bad{'ok' if shuffle_ok else 'FAIL':>9}"
+        )
+        if dropped_result is not None and missing:
+            print(
+                f"{'':<22}刪除 {dropped['text']} → 未辨識日期 {dropped_result.unknown_dates}"
+            )
+
+    if failures:
+        print(f"驗證失敗: {', '.join(failures)}")
+        sys.exit(1)
+    print("所有版面驗證通過")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,225 @@
+"""
+啟動時間測試：量測 import line_bot_server 的耗時，以及各模組的 import 時間
+
+每次以全新的子行程執行 python -X importtime -c "import line_bot_server"，
+重複 --repeat 次取中位數，結果以 JSON 輸出：
+    import_ms    import 目標模組的耗時
+    process_ms   子行程總耗時（含 interpreter 啟動）
+    warm_up_ms   line_bot_server.warm_up() 的耗時（fork 後在背景載入的部分）
+    project      專案內各模組的 import 時間（含它們 import 的套件）
+    packages     第三方套件依最上層名稱合計的 import 時間（self），由大到小
+
+LAZY_MODULES（webhook 用不到、第一次處理圖片或寫入行事曆時才載入的 Vision / gRPC、
+OpenCV、googleapiclient、oauthlib）在 import 目標模組後出現在 sys.modules 時，exit code 為 1；
+這個檢查與機器快慢無關。耗時的預算只在指定 --budget-ms 時檢查（在同一台機器上比較）
+
+用法（在專案根目錄）：
+    python -m benchmark.bench_import [--repeat 5] [--output result.json]
+    python -m benchmark.bench_import --budget-ms 300    # 另外檢查 import 耗時
+    python -m benchmark.bench_import --module ocr.process_text --budget-ms 100
+"""
+
+import os
+import sys
+import json
+import time
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+
+# 獲取當前檔案的絕對路徑
+current_file_path = os.path.abspath(__file__)
+
+# 獲取當前檔案所在的目錄
+current_directory = os.path.dirname(current_file_path)
+
+PROJECT_ROOT = os.path.dirname(current_directory)
+
+PROJECT_PACKAGES = {
+    "line_bot_server",
+    "ocr",
+    "auto_calendar",
+    "jobs",
+    "storage",
+    "monitoring",
+}
+
+# 啟動時不應載入的模組
+LAZY_MODULES = [
+    "google.cloud.vision",
+    "grpc",
+    "cv2",
+    "googleapiclient",
+    "google_auth_oauthlib.flow",
+]
+
+WARM_UP_MARKER = "--bench-import-warm-up--"
+
+# 子行程執行的程式：import 目標模組，列出已載入的 LAZY_MODULES，再量測 warm_up
+CHILD_CODE = """
+import time
+started_at = time.perf_counter()
+import {module} as target
+import_ms = (time.perf_counter() - started_at) * 1000
+
+import sys, json
+loaded = [name for name in {lazy!r} if name in sys.modules]
+
+warm_up_ms = None
+if hasattr(target, "warm_up"):
+    sys.stderr.write({marker!r} + "\\n")
+    started_at = time.perf_counter()
+    target.warm_up()
+    warm_up_ms = (time.perf_counter() - started_at) * 1000
+
+print(json.dumps({{"import_ms": import_ms, "warm_up_ms": warm_up_ms, "loaded": loaded}}))
+"""
+
+
+def child_env(scratch):
+    """不需要真的 LINE / Google 設定；import 時建立的 SQLite 與資料夾放到暫存目錄"""
+    env = dict(os.environ)
+    defaults = {
+        "CHANNEL_SECRET": "bench",
+        "CHANNEL_ACCESS_TOKEN": "bench",
+        "LOG_LEVEL": "WARNING",
+        "JOB_QUEUE_DB_PATH": os.path.join(scratch, "job_queue.sqlite3"),
+        "PENDING_DB_PATH": os.path.join(scratch, "pending.sqlite3"),
+        "USER_CREDENTIAL_FOLDER": os.path.join(scratch, "user_credentials"),
+        "CALENDAR_MIRROR_FOLDER": os.path.join(scratch, "calendar_mirror"),
+        "OCR_CACHE_FOLDER": os.path.join(scratch, "ocr_cache"),
+        "OCR_ARTIFACT_FOLDER": os.path.join(scratch, "ocr_artifacts"),
+        "PROFILE_FOLDER": os.path.join(scratch, "profiles"),
+    }
+    for name, value in defaults.items():
+        env.setdefault(name, value)
+    # 各 worker 的 metrics 檔案與背景 flush 不列入量測
+    env.pop("METRICS_DIR", None)
+    return env
+
+
+def parse_importtime(stderr):
+    """
+    解析 -X importtime 的輸出，回傳 [(模組, self 微秒, cumulative 微秒)]
+    warm_up 之後的 import 不列入
+    """
+    modules = []
+    for line in stderr.splitlines():
+        if line.strip() == WARM_UP_MARKER:
+            break
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:") :].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue
+        modules.append((parts[2].strip(), int(parts[0]), int(parts[1])))
+    return modules
+
+
+def run_once(module, env):
+    code = CHILD_CODE.format(module=module, lazy=LAZY_MODULES, marker=WARM_UP_MARKER)
+
+    started_at = time.perf_counter()
+    completed = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", code],
+        cwd=PROJECT_ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+    )
+    process_ms = (time.perf_counter() - started_at) * 1000
+
+    if completed.returncode != 0:
+        raise RuntimeError(f"import {module} 失敗:\n{completed.stderr[-2000:]}")
+
+    result = json.loads(completed.stdout.strip().splitlines()[-1])
+    result["process_ms"] = process_ms
+    result["modules"] = parse_importtime(completed.stderr)
+    return result
+
+
+def summarize(runs, top):
+    project = {}
+    packages = {}
+    for run in runs:
+        run_packages = {}
+        for name, self_us, cumulative_us in run["modules"]:
+            root = name.split(".")[0]
+            if root in PROJECT_PACKAGES:
+                project.setdefault(name, []).append(cumulative_us / 1000)
+            else:
+                run_packages[root] = run_packages.get(root, 0) + self_us / 1000
+        for root, ms in run_packages.items():
+            packages.setdefault(root, []).append(ms)
+
+    def median(values):
+        return round(statistics.median(values), 2)
+
+    project = {name: median(values) for name, values in project.items()}
+    packages = {name: median(values) for name, values in packages.items()}
+    warm_up = [run["warm_up_ms"] for run in runs if run["warm_up_ms"] is not None]
+
+    return {
+        "import_ms": median([run["import_ms"] for run in runs]),
+        "process_ms": median([run["process_ms"] for run in runs]),
+        "warm_up_ms": median(warm_up) if warm_up else None,
+        "loaded_lazy_modules": sorted({name for run in runs for name in run["loaded"]}),
+        "project": dict(sorted(project.items(), key=lambda item: -item[1])),
+        "packages": dict(sorted(packages.items(), key=lambda item: -item[1])[:top]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--module", default="line_bot_server")
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument(
+        "--budget-ms",
+        type=float,
+        help="import 耗時超過此毫秒數時 exit code 為 1（未指定時不檢查耗時）",
+    )
+    parser.add_argument("--top", type=int, default=15, help="列出幾個第三方套件")
+    parser.add_argument("--output", help="結果 JSON 的輸出路徑（- 為 stdout）")
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory(prefix="bench_import_") as scratch:
+        env = child_env(scratch)
+        # 第一次執行會編譯 .pyc 並讀取磁碟，不列入結果
+        run_once(args.module, env)
+        runs = [run_once(args.module, env) for _ in range(args.repeat)]
+
+    result = {
+        "module": args.module,
+        "python": platform.python_version(),
+        "repeat": args.repeat,
+        "budget_ms": args.budget_ms,
+        **summarize(runs, args.top),
+    }
+
+    text = json.dumps(result, ensure_ascii=False, indent=2)
+    if args.output and args.output != "-":
+        with open(args.output, "w", encoding="utf-8") as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+
+    failures = []
+    if args.budget_ms is not None and result["import_ms"] > args.budget_ms:
+        failures.append(
+            f"import {args.module} 耗時 {result['import_ms']} ms，超過 {args.budget_ms} ms"
+        )
+    if result["loaded_lazy_modules"]:
+        failures.append(
+            f"啟動時載入了應延後載入的模組: {', '.join(result['loaded_lazy_modules'])}"
+        )
+
+    for failure in failures:
+        print(f"✗ {failure}", file=sys.stderr)
+    if failures:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,146 @@
+"""
+送 Vision 前影像前處理的效能測試
+
+比較「原始圖片」與「preprocess_image 處理後」送出的 bytes、前處理耗時，
+並驗證座標換算回原始圖片的誤差
+
+用法（在專案根目錄）：
+    python -m benchmark.bench_preprocess                 # 以 ocr/ocr_result 版面畫出模擬截圖
+    python -m benchmark.bench_preprocess --images a.jpg b.png
+    python -m benchmark.bench_preprocess --images a.jpg --vision
+        # 需設定 OCR_* 環境變數，實際呼叫 Vision 比較延遲與班表解析結果
+"""
+
+import argparse
+import time
+
+import numpy as np
+
+from benchmark.fake_vision import load_fixtures, render_fixture_image
+from ocr.ocr_utils import (
+    OCR_PREPROCESS_CONFIG,
+    preprocess_image,
+    map_boxes_to_original,
+    get_sorted_context,
+    vision_client_manager,
+)
+from ocr.process_text import text_to_calender_event_dict
+
+
+def load_images(args):
+    if args.images:
+        images = {}
+        for path in args.images:
+            with open(path, "rb") as file:
+                images[path] = file.read()
+        return images
+
+    # 模擬 1440 寬的高解析度手機截圖
+    return {
+        name: render_fixture_image(
+            {
+                y: [
+                    dict(
+                        w,
+                        vertices=[
+                            (vx * 4 // 3, vy * 4 // 3) for vx, vy in w["vertices"]
+                        ],
+                    )
+                    for w in words
+                ]
+                for y, words in sorted_lines_dict.items()
+            },
+            width=1440,
+        )
+        for name, sorted_lines_dict in load_fixtures().items()
+    }
+
+
+def round_trip_error(transform):
+    """任取幾個處理後的座標，換算回原圖再換算回來，回傳最大誤差（像素）"""
+    offset_x, offset_y, scale = transform
+    points = np.array([[[0, 0], [100, 50], [517, 733], [1000, 2000]]], dtype=np.int32)
+    original = map_boxes_to_original(points, transform)
+    back = np.rint((original - [offset_x, offset_y]) * scale)
+    return float(np.abs(back - points).max())
+
+
+def ocr(content, transform=None):
+    from google.cloud import vision
+
+    start = time.perf_counter()
+    response = vision_client_manager.document_text_detection(
+        vision.Image(content=content)
+    )
+    seconds = time.perf_counter() - start
+    sorted_lines_dict, sorted_text = get_sorted_context(response, transform)
+    return seconds, sorted_text
+
+
+def roster_accuracy(expected_text, actual_text):
+    """以原始圖片的解析結果為準，計算處理後圖片解析出相同班別的天數比例"""
+    try:
+        _, _, expected = text_to_calender_event_dict(expected_text)
+        _, _, actual = text_to_calender_event_dict(actual_text)
+    except Exception as e:
+        print(f"解析失敗: {e}")
+        return 0.0
+
+    if not expected:
+        return 1.0 if not actual else 0.0
+
+    same = sum(
+        1
+        for date_key, event in expected.items()
+        if actual.get(date_key, {}).get("summary") == event["summary"]
+    )
+    return same / len(expected)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--images", nargs="*")
+    parser.add_argument("--vision", action="store_true")
+    parser.add_argument("--repeat", type=int, default=10)
+    args = parser.parse_args()
+
+    print(f"前處理設定: {OCR_PREPROCESS_CONFIG}")
+    header = f"{'image':<24}{'orig KB':>9}{'sent KB':>9}{'ratio':>7}{'prep ms':>9}{'err px':>8}"
+    if args.vision:
+        header += f"{'orig s':>8}{'prep s':>8}{'acc':>6}"
+    print(header)
+
+    total_original = total_sent = 0
+    for name, image_bytes in load_images(args).items():
+        start = time.perf_counter()
+        for _ in range(args.repeat):
+            content, transform = preprocess_image(image_bytes)
+        prep_ms = (time.perf_counter() - start) / args.repeat * 1000
+
+        total_original += len(image_bytes)
+        total_sent += len(content)
+
+        line = (
+            f"{name[-24:]:<24}{len(image_bytes) / 1024:>9.1f}{len(content) / 1024:>9.1f}"
+            f"{len(content) / len(image_bytes):>7.2f}{prep_ms:>9.1f}"
+            f"{round_trip_error(transform):>8.1f}"
+        )
+
+        if args.vision:
+            original_seconds, original_text = ocr(bytes(image_bytes))
+            prep_seconds, prep_text = ocr(content, transform)
+            line += (
+                f"{original_seconds:>8.2f}{prep_seconds:>8.2f}"
+                f"{roster_accuracy(original_text, prep_text):>6.2f}"
+            )
+
+        print(line)
+
+    print(
+        f"總計：原始 {total_original / 1024:.1f} KB → 送出 {total_sent / 1024:.1f} KB"
+        f"（{total_sent / total_original:.2f}）"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,350 @@
+"""
+離線重播整個班表流程的效能測試
+
+把 ocr/ocr_result 的每個版面依序送過：
+    vision_response  假的 Vision response（fake_vision.build_fake_response）
+    sorted_context   get_sorted_context
+    parse_text       text_to_calender_event_dict（依文字順序）
+    parse_grid       layout_to_calender_event_dict（依座標，server 實際使用）
+    plan             create_events_in_calendar(dry_run=True)
+    sync             create_events_in_calendar（空的行事曆，全部新增）
+    resync           再同步一次相同的班表（應該沒有任何寫入）
+行事曆使用 benchmark/fake_calendar.py 的 FakeCalendar，計算每個階段的 API 請求數
+
+每個階段記錄耗時（中位數）、記憶體配置峰值（tracemalloc）與 API 請求數，
+每個版面另記錄解析出的班表，結果以 JSON 輸出；與 baseline 比較時，以下任一項即 exit code 1：
+- 任何階段的 API 請求數或寫入數與 baseline 不同
+- 任何版面解析出的班表（日期、班別、未辨識日期）與 baseline 不同
+- resync 有任何寫入
+- 加上 --check-timing 時：耗時或記憶體峰值比 baseline 多出 threshold 以上
+  （耗時另有 min_ms 的雜訊下限）；baseline 的耗時是建立它的機器上量到的，
+  只在同一台機器上比較才有意義，因此預設不比較
+
+用法（在專案根目錄）：
+    python -m benchmark.bench_replay [--repeat 20] [--output result.json]
+    python -m benchmark.bench_replay --baseline benchmark/replay_baseline.json
+    python -m benchmark.bench_replay --check-timing    # 同一台機器上另外比較耗時與記憶體
+    python -m benchmark.bench_replay --update-baseline # 更新 baseline
+"""
+
+import os
+import sys
+import copy
+import json
+import time
+import shutil
+import argparse
+import platform
+import tempfile
+import statistics
+import tracemalloc
+
+# 不需要真的 OAuth 設定；限速放寬，避免量到 token bucket 的等待時間
+os.environ.setdefault("CALENDAR_SCOPES", "[]")
+os.environ.setdefault("CALENDAR_REDIRECT_URIS", "[]")
+os.environ.setdefault("CALENDAR_USER_QPS", "1000000")
+os.environ.setdefault("CALENDAR_PROJECT_QPS", "1000000")
+# 流程中的 log 不混進結果
+os.environ.setdefault("LOG_LEVEL", "WARNING")
+os.environ.setdefault(
+    "USER_CREDENTIAL_FOLDER", os.path.join(tempfile.gettempdir(), "replay_credentials")
+)
+
+from benchmark.fake_vision import load_fixtures, build_fake_response
+from benchmark.fake_calendar import FakeCalendar
+from ocr.ocr_utils import get_sorted_context
+from ocr.process_text import layout_to_calender_event_dict, text_to_calender_event_dict
+from auto_calendar import calendar_utils
+from auto_calendar.calendar_utils import create_events_in_calendar
+
+# 獲取當前檔案的絕對路徑
+current_file_path = os.path.abspath(__file__)
+
+# 獲取當前檔案所在的目錄
+current_directory = os.path.dirname(current_file_path)
+
+DEFAULT_BASELINE = f"{current_directory}/replay_baseline.json"
+
+STAGES = (
+    "vision_response",
+    "sorted_context",
+    "parse_text",
+    "parse_grid",
+    "plan",
+    "sync",
+    "resync",
+)
+
+# 比較的 API 計數
+API_KEYS = ("http", "events.list", "batch", "writes")
+
+
+class ReplayRun:
+    """一次完整的流程重播；每個階段都是一個方法，回傳值交給下一個階段"""
+
+    def __init__(self, sorted_lines_dict, user_id):
+        self.sorted_lines_dict = sorted_lines_dict
+        self.user_id = user_id
+        self.calendar = FakeCalendar()
+        self.service = self.calendar.service()
+
+    def vision_response(self):
+        self.response = build_fake_response(self.sorted_lines_dict)
+
+    def sorted_context(self):
+        self.layout, self.texts = get_sorted_context(self.response)
+
+    def parse_text(self):
+        text_to_calender_event_dict(self.texts)
+
+    def parse_grid(self):
+        _, _, self.event_dict, grid = layout_to_calender_event_dict(self.layout)
+        self.keep_dates = grid.unknown_dates if grid is not None else []
+
+    def roster(self):
+        """解析結果：{"shifts": {date_key: 班別}, "unknown_dates": [...]}"""
+        return {
+            "shifts": {
+                date_key: event["summary"]
+                for date_key, event in sorted(self.event_dict.items())
+            },
+            "unknown_dates": list(self.keep_dates),
+        }
+
+    def plan(self):
+        create_events_in_calendar(
+            self.event_dict,
+            self.service,
+            user_id=self.user_id,
+            dry_run=True,
+            keep_dates=self.keep_dates,
+        )
+
+    def sync(self):
+        create_events_in_calendar(
+            copy.deepcopy(self.event_dict),
+            self.service,
+            user_id=self.user_id,
+            keep_dates=self.keep_dates,
+        )
+
+    def resync(self):
+        self.sync()
+
+    def api_counts(self):
+        counts = {key: self.calendar.counts.get(key, 0) for key in API_KEYS}
+        counts["writes"] = self.calendar.write_count()
+        self.calendar.reset_counts()
+        return counts
+
+
+def replay_fixture(name, sorted_lines_dict, repeat):
+    """回傳 ({stage: {"ms", "alloc_kib", "api"}}, 解析出的班表)"""
+    timings = {stage: [] for stage in STAGES}
+    api = {}
+    roster = None
+
+    for index in range(repeat):
+        run = ReplayRun(sorted_lines_dict, f"replay-{name}-{index}")
+        for stage in STAGES:
+            start = time.perf_counter()
+            getattr(run, stage)()
+            timings[stage].append((time.perf_counter() - start) * 1000)
+            counts = run.api_counts()
+            if index == 0:
+                api[stage] = counts
+        if index == 0:
+            roster = run.roster()
+
+    # 記憶體另外跑一次，tracemalloc 會拖慢執行，不與耗時一起量
+    allocations = {}
+    run = ReplayRun(sorted_lines_dict, f"replay-{name}-alloc")
+    tracemalloc.start()
+    try:
+        for stage in STAGES:
+            tracemalloc.reset_peak()
+            before = tracemalloc.get_traced_memory()[0]
+            getattr(run, stage)()
+            allocations[stage] = (tracemalloc.get_traced_memory()[1] - before) / 1024
+    finally:
+        tracemalloc.stop()
+
+    stages = {
+        stage: {
+            "ms": round(statistics.median(timings[stage]), 4),
+            "alloc_kib": round(allocations[stage], 1),
+            "api": api[stage],
+        }
+        for stage in STAGES
+    }
+    return stages, roster
+
+
+def summarize(fixtures):
+    """所有版面加總：耗時與 API 數相加，記憶體取最大值"""
+    totals = {}
+    for stage in STAGES:
+        results = [fixture[stage] for fixture in fixtures.values()]
+        totals[stage] = {
+            "ms": round(sum(result["ms"] for result in results), 4),
+            "alloc_kib": round(max(result["alloc_kib"] for result in results), 1),
+            "api": {
+                key: sum(result["api"][key] for result in results) for key in API_KEYS
+            },
+        }
+    return totals
+
+
+def compare(result, baseline, threshold, min_ms, check_timing=False):
+    """
+    回傳與 baseline 不符的項目 list
+
+    API 請求數與解析出的班表必須與 baseline 完全相同（不受機器影響）；
+    check_timing=True 時另外比較耗時與記憶體峰值
+    """
+    regressions = []
+
+    for stage in STAGES:
+        current = result["totals"][stage]
+        previous = baseline.get("totals", {}).get(stage)
+        if previous is None:
+            continue
+
+        for key in API_KEYS:
+            if current["api"][key] != previous["api"].get(key, 0):
+                regressions.append(
+                    f"{stage}: {key} {previous['api'].get(key, 0)} → {current['api'][key]}"
+                )
+
+        if not check_timing:
+            continue
+        if (
+            current["ms"] > previous["ms"] * (1 + threshold)
+            and current["ms"] - previous["ms"] > min_ms
+        ):
+            regressions.append(
+                f"{stage}: 耗時 {previous['ms']:.3f} → {current['ms']:.3f} ms"
+            )
+        if current["alloc_kib"] > previous["alloc_kib"] * (1 + threshold):
+            regressions.append(
+                f"{stage}: 記憶體峰值 {previous['alloc_kib']:.1f} → {current['alloc_kib']:.1f} KiB"
+            )
+
+    previous_rosters = baseline.get("rosters", {})
+    for name, roster in result["rosters"].items():
+        previous = previous_rosters.get(name)
+        if previous is None:
+            continue
+        changed = sorted(
+            date_key
+            for date_key in set(roster["shifts"]) | set(previous["shifts"])
+            if roster["shifts"].get(date_key) != previous["shifts"].get(date_key)
+        )
+        if changed:
+            regressions.append(
+                f"{name}: 解析結果與 baseline 不同的日期 {', '.join(changed)}"
+            )
+        if roster["unknown_dates"] != previous["unknown_dates"]:
+            regressions.append(
+                f"{name}: 未辨識日期 {previous['unknown_dates']} → {roster['unknown_dates']}"
+            )
+
+    for name, fixture in result["fixtures"].items():
+        if fixture["resync"]["api"]["writes"]:
+            regressions.append(
+                f"{name}: 重複同步相同班表寫入了 {fixture['resync']['api']['writes']} 次"
+            )
+
+    return regressions
+
+
+def print_table(result):
+    print(
+        f"{'stage':<16}{'total ms':>10}{'peak KiB':>10}"
+        + "".join(f"{key:>13}" for key in API_KEYS)
+    )
+    for stage, total in result["totals"].items():
+        print(
+            f"{stage:<16}{total['ms']:>10.3f}{total['alloc_kib']:>10.1f}"
+            + "".join(f"{total['api'][key]:>13}" for key in API_KEYS)
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=20)
+    parser.add_argument("--output", help="結果 JSON 的輸出路徑（- 為 stdout）")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--threshold", type=float, default=0.25)
+    parser.add_argument("--min-ms", type=float, default=0.5)
+    parser.add_argument(
+        "--check-timing",
+        action="store_true",
+        help="另外比較耗時與記憶體峰值（baseline 需在同一台機器上建立）",
+    )
+    parser.add_argument("--update-baseline", action="store_true")
+    args = parser.parse_args()
+
+    # 行事曆鏡像寫到暫存目錄，每次都從空的鏡像開始
+    mirror_folder = tempfile.mkdtemp(prefix="replay_mirror_")
+    calendar_utils.calendar_mirror.folder = mirror_folder
+
+    fixtures = {}
+    rosters = {}
+    try:
+        for name, sorted_lines_dict in load_fixtures().items():
+            fixtures[name], rosters[name] = replay_fixture(
+                name, sorted_lines_dict, args.repeat
+            )
+    finally:
+        shutil.rmtree(mirror_folder, ignore_errors=True)
+
+    result = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "repeat": args.repeat,
+            "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "totals": summarize(fixtures),
+        "fixtures": fixtures,
+        "rosters": rosters,
+    }
+
+    if args.output == "-":
+        json.dump(result, sys.stdout, ensure_ascii=False, indent=2)
+        print()
+    else:
+        print_table(result)
+        if args.output:
+            with open(args.output, "w", encoding="utf-8") as file:
+                json.dump(result, file, ensure_ascii=False, indent=2)
+
+    if args.update_baseline:
+        with open(args.baseline, "w", encoding="utf-8") as file:
+            json.dump(result, file, ensure_ascii=False, indent=2)
+            file.write("\n")
+        print(f"已更新 baseline: {args.baseline}", file=sys.stderr)
+        return
+
+    if not os.path.exists(args.baseline):
+        print(f"找不到 baseline {args.baseline}，略過比較", file=sys.stderr)
+        return
+
+    with open(args.baseline, "r", encoding="utf-8") as file:
+        baseline = json.load(file)
+
+    regressions = compare(
+        result, baseline, args.threshold, args.min_ms, check_timing=args.check_timing
+    )
+    if regressions:
+        print("與 baseline 不符：", file=sys.stderr)
+        for regression in regressions:
+            print(f"  {regression}", file=sys.stderr)
+        sys.exit(1)
+
+    print("與 baseline 比較沒有退步", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
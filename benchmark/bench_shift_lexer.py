@@ -0,0 +1,172 @@
+"""
+班別 lexer 吞吐量測試
+
+以 ocr/ocr_result 的版面組回 OCR 文字，比較舊版（寫死 CLASS_DICT、每次呼叫
+重新編譯 regex、每天拆三次 "HH:MM:SS"）與目前版本（ocr/shift_table.json 載入時
+編譯一次 lexer）解析整份班表的吞吐量，並確認兩者產生的事件相同
+
+用法（在專案根目錄）：
+    python -m benchmark.bench_shift_lexer [--repeat 500]
+"""
+
+import re
+import time
+import argparse
+import datetime
+
+from benchmark.fake_vision import load_fixtures
+from ocr.process_text import (
+    GRID_DAYS,
+    get_grid_start_date,
+    get_year_month,
+    lines_to_text,
+    text_to_calender_event_dict,
+)
+from ocr.shift_table import get_shift_table
+
+LEGACY_CLASS_DICT = {
+    "BC": {"start_hour": "08:00:00"},
+    "DB": {"start_hour": "10:00:00"},
+    "JB": {"start_hour": "16:00:00"},
+    "RA": {"start_hour": "23:50:00"},
+    "OFF": {"start_hour": "00:00:00"},
+    "11FBC": {"start_hour": "08:00:00"},
+    "11FDB": {"start_hour": "10:00:00"},
+    "11FJB": {"start_hour": "16:00:00"},
+    "11FRA": {"start_hour": "00:00:00"},
+}
+
+
+def legacy_get_all_class_list(texts):
+    """改寫前的 get_all_class_list，作為比較基準"""
+    all_class_list = []
+    text_list = texts.split("\n")
+
+    start_index = None
+    for i, item in enumerate(text_list):
+        if "剩餘年假" in item.replace(" ", ""):
+            start_index = i + 1
+            break
+
+    sorted_keywords = sorted(LEGACY_CLASS_DICT.keys(), key=len, reverse=True)
+    pattern = r"\b(?:" + "|".join(re.escape(k) for k in sorted_keywords) + r")\b"
+    regex = re.compile(pattern, re.IGNORECASE)
+
+    for line in text_list[start_index:]:
+        matches = regex.findall(line)
+        if matches:
+            all_class_list.extend([m.upper() for m in matches])
+
+    return all_class_list
+
+
+def legacy_create_calender_event_dict(start_date, current_class_list):
+    """改寫前的 create_calender_event_dict，作為比較基準"""
+    calender_event_dict = {}
+
+    for index, daily_class in enumerate(current_class_list):
+        current_date = start_date + datetime.timedelta(days=index)
+        event_dict = {
+            "summary": daily_class,
+            "start": {"timeZone": "Asia/Taipei"},
+            "end": {"timeZone": "Asia/Taipei"},
+        }
+
+        start_hour = int(LEGACY_CLASS_DICT[daily_class]["start_hour"].split(":")[0])
+        start_minute = int(LEGACY_CLASS_DICT[daily_class]["start_hour"].split(":")[1])
+        start_second = int(LEGACY_CLASS_DICT[daily_class]["start_hour"].split(":")[2])
+        start_dt = datetime.datetime(
+            current_date.year,
+            current_date.month,
+            current_date.day,
+            start_hour,
+            start_minute,
+            start_second,
+        )
+
+        if daily_class == "OFF":
+            end_dt = start_dt + datetime.timedelta(days=1)
+            event_dict["start"]["date"] = start_dt.strftime("%Y-%m-%d")
+            event_dict["end"]["date"] = end_dt.strftime("%Y-%m-%d")
+        else:
+            end_dt = start_dt + datetime.timedelta(hours=8)
+            event_dict["start"]["dateTime"] = start_dt.strftime("%Y-%m-%dT%H:%M:%S")
+            event_dict["end"]["dateTime"] = end_dt.strftime("%Y-%m-%dT%H:%M:%S")
+
+        calender_event_dict[start_dt.strftime("%Y-%m-%d")] = event_dict
+
+    return calender_event_dict
+
+
+def legacy_text_to_calender_event_dict(texts):
+    year, month = get_year_month(texts)
+    class_list = legacy_get_all_class_list(texts)[:GRID_DAYS]
+    return (
+        year,
+        month,
+        legacy_create_calender_event_dict(get_grid_start_date(year, month), class_list),
+    )
+
+
+def measure(func, texts, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        for text in texts:
+            result = func(text)
+    seconds = time.perf_counter() - start
+    return repeat * len(texts) / seconds, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=500)
+    args = parser.parse_args()
+
+    table = get_shift_table()
+    texts = {
+        name: lines_to_text(sorted_lines_dict)
+        for name, sorted_lines_dict in load_fixtures().items()
+    }
+
+    rows = []
+    for name, text in texts.items():
+        legacy_rate, legacy_result = measure(
+            legacy_text_to_calender_event_dict, [text], args.repeat
+        )
+        current_rate, current_result = measure(
+            text_to_calender_event_dict, [text], args.repeat
+        )
+        rows.append(
+            (
+                name,
+                len(current_result[2]),
+                legacy_rate,
+                current_rate,
+                legacy_result == current_result,
+            )
+        )
+
+    legacy_total, _ = measure(
+        legacy_text_to_calender_event_dict, list(texts.values()), args.repeat
+    )
+    current_total, _ = measure(
+        text_to_calender_event_dict, list(texts.values()), args.repeat
+    )
+
+    print(f"shift table version {table.version[:8]}，{len(table.shifts)} 種班別")
+    print(
+        f"{'fixture':<26}{'days':>6}{'legacy/s':>12}{'current/s':>12}{'speedup':>9}  same"
+    )
+    for name, days, legacy_rate, current_rate, same in rows:
+        print(
+            f"{name:<26}{days:>6}{legacy_rate:>12.0f}{current_rate:>12.0f}"
+            f"{current_rate / legacy_rate:>8.1f}x  {same}"
+        )
+    print(
+        f"{'all fixtures':<26}{'':>6}{legacy_total:>12.0f}{current_total:>12.0f}"
+        f"{current_total / legacy_total:>8.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,105 @@
+"""
+get_sorted_context 效能測試
+
+以 ocr/ocr_result 的版面還原 Vision response，比較舊版（逐字掃描所有行）與
+目前版本（NumPy 欄位陣列 + sort-and-sweep 分行）的執行時間
+
+用法（在專案根目錄）：
+    python -m benchmark.bench_sorted_context [--repeat 200]
+"""
+
+import argparse
+import time
+
+from benchmark.fake_vision import load_fixtures, build_fake_response
+from ocr.ocr_utils import get_sorted_context
+
+
+def legacy_get_sorted_context(response):
+    """改寫前的 get_sorted_context（不含逐行 print），作為比較基準"""
+    sorted_text = ""
+    words_with_coords = []
+
+    for page in response.full_text_annotation.pages:
+        for block in page.blocks:
+            for paragraph in block.paragraphs:
+                for word in paragraph.words:
+                    word_text = "".join([s.text for s in word.symbols])
+                    x = word.bounding_box.vertices[0].x
+                    y = word.bounding_box.vertices[0].y
+                    words_with_coords.append(
+                        {
+                            "text": word_text,
+                            "x": x,
+                            "y": y,
+                            "vertices": [
+                                (v.x, v.y) for v in word.bounding_box.vertices
+                            ],
+                        }
+                    )
+
+    sorted_lines_dict = {}
+    for w in words_with_coords:
+        y = w["y"]
+        found_line = None
+        for line_y in sorted_lines_dict.keys():
+            if abs(y - line_y) <= 5:
+                found_line = line_y
+                break
+        if found_line is None:
+            sorted_lines_dict[y] = [w]
+        else:
+            sorted_lines_dict[found_line].append(w)
+
+    for y, words_info in sorted_lines_dict.items():
+        sorted_lines_dict[y] = sorted(words_info, key=lambda w: w["x"])
+
+    for y in sorted(sorted_lines_dict.keys()):
+        sorted_text += " ".join([w["text"] for w in sorted_lines_dict[y]]) + "\n"
+
+    return sorted_lines_dict, sorted_text
+
+
+def measure(func, response, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = func(response)
+    return (time.perf_counter() - start) / repeat * 1000, result
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--repeat", type=int, default=200)
+    args = parser.parse_args()
+
+    print(
+        f"{'fixture':<22}{'words':>7}{'legacy ms':>12}{'current ms':>12}{'speedup':>9}  same"
+    )
+
+    total_legacy = total_current = 0.0
+    for name, sorted_lines_dict in load_fixtures().items():
+        response = build_fake_response(sorted_lines_dict)
+        words = sum(len(words) for words in sorted_lines_dict.values())
+
+        legacy_ms, (_, legacy_text) = measure(
+            legacy_get_sorted_context, response, args.repeat
+        )
+        current_ms, (_, current_text) = measure(
+            get_sorted_context, response, args.repeat
+        )
+        total_legacy += legacy_ms
+        total_current += current_ms
+
+        print(
+            f"{name:<22}{words:>7}{legacy_ms:>12.3f}{current_ms:>12.3f}"
+            f"{legacy_ms / current_ms:>8.1f}x  {legacy_text == current_text}"
+        )
+
+    print(
+        f"{'total':<22}{'':>7}{total_legacy:>12.3f}{total_current:>12.3f}"
+        f"{total_legacy / total_current:>8.1f}x"
+    )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,423 @@
+"""
+記憶體中的假 Google Calendar（只實作 events 資源）
+
+FakeCalendar 提供 httplib2 相容的 request()，直接交給 googleapiclient 當作 http，
+因此 list / insert / patch / update / delete / batch 都走與正式環境相同的
+googleapiclient 程式碼，不需要網路：
+
+    calendar = FakeCalendar()
+    service = calendar.service()
+    create_events_in_calendar(event_dict, service)
+    calendar.counts["events.insert"], calendar.write_count()
+
+支援 pageToken / maxResults、timeMin / timeMax、privateExtendedProperty、
+syncToken（expire_sync_tokens() 後回傳 410）、fields（partial response）與 batch
+"""
+
+import io
+import json
+import uuid
+import datetime
+import threading
+from collections import Counter
+from email.parser import FeedParser
+from urllib.parse import urlparse, parse_qs, unquote
+from zoneinfo import ZoneInfo
+
+import httplib2
+from googleapiclient.discovery import build_from_document
+
+from auto_calendar.calendar_service import DiscoveryDocument
+
+DEFAULT_TIME_ZONE = "Asia/Taipei"
+
+EVENTS_PREFIX = "/calendar/v3/calendars/"
+BATCH_PATH = "/batch/calendar/v3"
+
+
+def parse_fields(fields):
+    """把 "a,b(c,d/e)" 解析成 {"a": None, "b": {"c": None, "d": {"e": None}}}"""
+
+    def parse_item(i):
+        j = i
+        while j < len(fields) and fields[j] not in ",()/":
+            j += 1
+        name = fields[i:j].strip()
+        sub = None
+
+        if j < len(fields) and fields[j] == "(":
+            sub, j = parse_list(j + 1, ")")
+            j += 1
+        elif j < len(fields) and fields[j] == "/":
+            child, child_sub, j = parse_item(j + 1)
+            sub = {child: child_sub}
+
+        return name, sub, j
+
+    def parse_list(i, closing):
+        tree = {}
+        while i < len(fields) and fields[i] != closing:
+            name, sub, i = parse_item(i)
+            tree[name] = merge_trees(tree[name], sub) if name in tree else sub
+            if i < len(fields) and fields[i] == ",":
+                i += 1
+        return tree, i
+
+    return parse_list(0, None)[0]
+
+
+def merge_trees(a, b):
+    if a is None or b is None:
+        return None
+    merged = dict(a)
+    for key, value in b.items():
+        merged[key] = merge_trees(merged[key], value) if key in merged else value
+    return merged
+
+
+def apply_fields(value, tree):
+    if tree is None:
+        return value
+    if isinstance(value, list):
+        return [apply_fields(item, tree) for item in value]
+    if not isinstance(value, dict):
+        return value
+    return {
+        key: apply_fields(value[key], sub) for key, sub in tree.items() if key in value
+    }
+
+
+def merge_patch(target, patch):
+    # 與 Calendar API 相同，patch 中的 null 代表清除該欄位
+    for key, value in patch.items():
+        if value is None:
+            target.pop(key, None)
+        elif isinstance(value, dict) and isinstance(target.get(key), dict):
+            merge_patch(target[key], value)
+        else:
+            target[key] = value
+
+
+def event_start_utc(event):
+    start = event.get("start", {})
+    if "dateTime" in start:
+        value = datetime.datetime.fromisoformat(start["dateTime"])
+    elif "date" in start:
+        value = datetime.datetime.fromisoformat(start["date"])
+    else:
+        return None
+
+    if value.tzinfo is None:
+        value = value.replace(
+            tzinfo=ZoneInfo(start.get("timeZone") or DEFAULT_TIME_ZONE)
+        )
+    return value.astimezone(datetime.timezone.utc)
+
+
+def canonical_times(event):
+    """與 Google 相同：回傳的 dateTime 一律帶時區位移"""
+    for key in ("start", "end"):
+        time_value = event.get(key)
+        if not time_value or "dateTime" not in time_value:
+            continue
+        value = datetime.datetime.fromisoformat(time_value["dateTime"])
+        if value.tzinfo is None:
+            value = value.replace(
+                tzinfo=ZoneInfo(time_value.get("timeZone") or DEFAULT_TIME_ZONE)
+            )
+        time_value["dateTime"] = value.isoformat()
+
+
+class FakeCalendar:
+    def __init__(self, page_size=250):
+        self.page_size = page_size
+        # calendar_id -> {event_id: event}
+        self.calendars = {}
+        self.counts = Counter()
+        self.bytes_sent = 0
+
+        self._seq = 0
+        self._min_sync_seq = 0
+        self._lock = threading.RLock()
+
+    # ====== 給測試使用 ======
+    def service(self):
+        return build_from_document(DiscoveryDocument().get(), http=self)
+
+    def add_event(self, event, calendar_id="primary"):
+        """直接放入事件（不計入請求數），回傳含 id 的事件"""
+        with self._lock:
+            return self._insert(calendar_id, json.loads(json.dumps(event)))
+
+    def events(self, calendar_id="primary", include_cancelled=False):
+        with self._lock:
+            return [
+                self._public(event)
+                for event in self.calendars.get(calendar_id, {}).values()
+                if include_cancelled or event["status"] != "cancelled"
+            ]
+
+    def write_count(self):
+        """寫入請求數（batch 內的每個子請求各算一次）"""
+        return sum(
+            self.counts[name]
+            for name in (
+                "events.insert",
+                "events.patch",
+                "events.update",
+                "events.delete",
+            )
+        )
+
+    def reset_counts(self):
+        self.counts.clear()
+        self.bytes_sent = 0
+
+    def expire_sync_tokens(self):
+        """讓目前所有 syncToken 失效，下次增量同步會收到 410 Gone"""
+        with self._lock:
+            # 之後發出的 syncToken（sync-{seq}）仍然有效
+            self._seq += 1
+            self._min_sync_seq = self._seq
+
+    # ====== httplib2 相容介面 ======
+    def request(
+        self,
+        uri,
+        method="GET",
+        body=None,
+        headers=None,
+        redirections=httplib2.DEFAULT_MAX_REDIRECTS,
+        connection_type=None,
+    ):
+        headers = {key.lower(): value for key, value in (headers or {}).items()}
+        if isinstance(body, bytes):
+            body = body.decode("utf-8")
+
+        with self._lock:
+            self.counts["http"] += 1
+            parsed = urlparse(uri)
+
+            if parsed.path == BATCH_PATH:
+                content_type, content = self._handle_batch(headers, body)
+                status = 200
+            else:
+                status, payload = self._handle(method, parsed.path, parsed.query, body)
+                content_type = "application/json; charset=UTF-8"
+                content = json.dumps(payload) if payload is not None else ""
+
+        content = content.encode("utf-8")
+        self.bytes_sent += len(content)
+
+        resp = httplib2.Response({"status": str(status), "content-type": content_type})
+        resp.reason = "OK" if status < 300 else "Error"
+        return resp, content
+
+    # ====== 處理請求 ======
+    def _handle(self, method, path, query, body):
+        if not path.startswith(EVENTS_PREFIX):
+            return 404, self._error(404, "notFound", "Not Found")
+
+        parts = [unquote(part) for part in path[len(EVENTS_PREFIX) :].split("/")]
+        if len(parts) < 2 or parts[1] != "events":
+            return 404, self._error(404, "notFound", "Not Found")
+
+        calendar_id = parts[0]
+        event_id = parts[2] if len(parts) > 2 else None
+        params = {key: values[-1] for key, values in parse_qs(query).items()}
+        data = json.loads(body) if body else None
+
+        if event_id is None and method == "GET":
+            self.counts["events.list"] += 1
+            status, payload = self._list(calendar_id, params)
+        elif event_id is None and method == "POST":
+            self.counts["events.insert"] += 1
+            status, payload = 200, self._public(self._insert(calendar_id, data))
+        elif event_id is not None:
+            status, payload = self._handle_event(method, calendar_id, event_id, data)
+        else:
+            return 405, self._error(405, "methodNotAllowed", "Method Not Allowed")
+
+        if status == 200 and payload is not None and params.get("fields"):
+            payload = apply_fields(payload, parse_fields(params["fields"]))
+        return status, payload
+
+    def _handle_event(self, method, calendar_id, event_id, data):
+        event = self.calendars.get(calendar_id, {}).get(event_id)
+        name = {
+            "GET": "events.get",
+            "PATCH": "events.patch",
+            "PUT": "events.update",
+            "DELETE": "events.delete",
+        }.get(method)
+        if name is None:
+            return 405, self._error(405, "methodNotAllowed", "Method Not Allowed")
+        self.counts[name] += 1
+
+        if event is None:
+            return 404, self._error(404, "notFound", "Not Found")
+        if event["status"] == "cancelled":
+            return 410, self._error(410, "deleted", "Resource has been deleted")
+
+        if method == "GET":
+            return 200, self._public(event)
+
+        if method == "DELETE":
+            event["status"] = "cancelled"
+            self._touch(event)
+            return 204, None
+
+        if method == "PATCH":
+            merge_patch(event, data)
+        else:
+            keep = {key: event[key] for key in ("id", "iCalUID", "created")}
+            event.clear()
+            event.update(data)
+            event.update(keep)
+            event["status"] = "confirmed"
+
+        canonical_times(event)
+        self._touch(event)
+        return 200, self._public(event)
+
+    def _list(self, calendar_id, params):
+        events = list(self.calendars.get(calendar_id, {}).values())
+        sync_token = params.get("syncToken")
+
+        if sync_token is not None:
+            for forbidden in (
+                "timeMin",
+                "timeMax",
+                "privateExtendedProperty",
+                "orderBy",
+            ):
+                if forbidden in params:
+                    return 400, self._error(
+                        400, "invalid", f"{forbidden} 不能與 syncToken 同時使用"
+                    )
+            since = int(sync_token.split("-")[1])
+            if since < self._min_sync_seq:
+                return 410, self._error(
+                    410,
+                    "fullSyncRequired",
+                    "Sync token is no longer valid, a full sync is required.",
+                )
+            events = [event for event in events if event["_seq"] > since]
+        else:
+            if params.get("showDeleted") != "true":
+                events = [event for event in events if event["status"] != "cancelled"]
+
+            private = params.get("privateExtendedProperty")
+            if private:
+                key, value = private.split("=", 1)
+                events = [
+                    event
+                    for event in events
+                    if event.get("extendedProperties", {}).get("private", {}).get(key)
+                    == value
+                ]
+
+            time_min = params.get("timeMin")
+            time_max = params.get("timeMax")
+            if time_min or time_max:
+                low = datetime.datetime.fromisoformat(time_min) if time_min else None
+                high = datetime.datetime.fromisoformat(time_max) if time_max else None
+                events = [
+                    event
+                    for event in events
+                    if (low is None or event_start_utc(event) >= low)
+                    and (high is None or event_start_utc(event) < high)
+                ]
+
+            if params.get("orderBy") == "startTime":
+                events.sort(key=event_start_utc)
+
+        offset = int(params.get("pageToken") or 0)
+        page_size = int(params.get("maxResults") or self.page_size)
+        page = events[offset : offset + page_size]
+
+        payload = {
+            "kind": "calendar#events",
+            "summary": calendar_id,
+            "timeZone": DEFAULT_TIME_ZONE,
+            "items": [self._public(event) for event in page],
+        }
+        if offset + page_size < len(events):
+            payload["nextPageToken"] = str(offset + page_size)
+        else:
+            payload["nextSyncToken"] = f"sync-{self._seq}"
+        return 200, payload
+
+    def _handle_batch(self, headers, body):
+        self.counts["batch"] += 1
+
+        parser = FeedParser()
+        parser.feed(f"content-type: {headers['content-type']}\r\n\r\n{body}")
+        message = parser.close()
+
+        boundary = f"batch_{uuid.uuid4().hex}"
+        out = io.StringIO()
+
+        for part in message.get_payload():
+            content_id = part["Content-ID"]
+            request_text = part.get_payload()
+            request_line, rest = request_text.split("\n", 1)
+            method, target, _ = request_line.split(" ", 2)
+            sub_body = rest.split("\n\n", 1)[1] if "\n\n" in rest else ""
+
+            parsed = urlparse(target)
+            status, payload = self._handle(
+                method, parsed.path, parsed.query, sub_body or None
+            )
+            content = json.dumps(payload) if payload is not None else ""
+
+            out.write(f"--{boundary}\r\n")
+            out.write("Content-Type: application/http\r\n")
+            out.write(f"Content-ID: <response-{content_id[1:-1]}>\r\n\r\n")
+            out.write(f"HTTP/1.1 {status} {'OK' if status < 300 else 'Error'}\r\n")
+            out.write("Content-Type: application/json; charset=UTF-8\r\n\r\n")
+            out.write(f"{content}\r\n")
+
+        out.write(f"--{boundary}--\r\n")
+        return f"multipart/mixed; boundary={boundary}", out.getvalue()
+
+    # ====== 內部資料 ======
+    def _insert(self, calendar_id, data):
+        event = dict(data or {})
+        event_id = event.get("id") or uuid.uuid4().hex
+        now = datetime.datetime.now(datetime.timezone.utc).isoformat()
+        event.update(
+            {
+                "id": event_id,
+                "iCalUID": f"{event_id}@google.com",
+                "status": "confirmed",
+                "created": now,
+            }
+        )
+        canonical_times(event)
+        self._touch(event)
+        self.calendars.setdefault(calendar_id, {})[event_id] = event
+        return event
+
+    def _touch(self, event):
+        self._seq += 1
+        event["_seq"] = self._seq
+        event["etag"] = f'"{self._seq}"'
+        event["updated"] = datetime.datetime.now(datetime.timezone.utc).isoformat()
+
+    @staticmethod
+    def _public(event):
+        public = {key: value for key, value in event.items() if key != "_seq"}
+        if event["status"] == "cancelled":
+            return {"id": event["id"], "status": "cancelled"}
+        return json.loads(json.dumps(public))
+
+    @staticmethod
+    def _error(code, reason, message):
+        return {
+            "error": {
+                "code": code,
+                "message": message,
+                "errors": [{"domain": "global", "reason": reason, "message": message}],
+            }
+        }
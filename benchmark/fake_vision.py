@@ -0,0 +1,132 @@
+import os
+import glob
+import json
+
+from google.cloud import vision
+
+from ocr.ocr_utils import Y_THRESHOLD
+
+# 獲取當前檔案的絕對路徑
+current_file_path = os.path.abspath(__file__)
+
+# 獲取當前檔案所在的目錄
+current_directory = os.path.dirname(current_file_path)
+
+OCR_RESULT_FOLDER = os.path.join(
+    os.path.dirname(current_directory), "ocr", "ocr_result"
+)
+
+
+def load_fixtures(pattern="*.json"):
+    """讀取 ocr/ocr_result 裡的 OCR 版面，回傳 {檔名: sorted_lines_dict}"""
+    fixtures = {}
+    for path in sorted(glob.glob(os.path.join(OCR_RESULT_FOLDER, pattern))):
+        with open(path, "r", encoding="utf-8") as file:
+            data = json.load(file)
+        name = os.path.splitext(os.path.basename(path))[0]
+        fixtures[name] = {int(y): words for y, words in data.items()}
+
+    return fixtures
+
+
+def vision_line_order(sorted_lines_dict, y_threshold=Y_THRESHOLD):
+    """
+    排出各行送出的順序，讓 get_sorted_context 依 Vision 的回傳順序分行後，得到與儲存時相同的版面
+
+    版面中的每個字與所屬行的 y（錨點）相差不超過 y_threshold；若它與另一行的錨點也在範圍內，
+    所屬的行必須先出現（分行時取最早建立的一行）。依此排序，無法滿足時其餘的行依 y 排列
+    """
+    keys = sorted(sorted_lines_dict)
+    # 行 y -> 必須排在它之前的行
+    before = {key: set() for key in keys}
+    for key in keys:
+        for w in sorted_lines_dict[key]:
+            for other in keys:
+                if other != key and abs(w["y"] - other) <= y_threshold:
+                    before[other].add(key)
+
+    order = []
+    remaining = list(keys)
+    while remaining:
+        ready = [key for key in remaining if not before[key] - set(order)]
+        key = ready[0] if ready else remaining[0]
+        order.append(key)
+        remaining.remove(key)
+
+    return order
+
+
+def build_fake_response(sorted_lines_dict):
+    """
+    把儲存的 OCR 版面還原成 Google Vision 的 AnnotateImageResponse
+
+    每一行放在一個 block / paragraph 中（順序見 vision_line_order，行內先放錨點的字），
+    每個字元一個 symbol，讓 get_sorted_context 走與正式環境相同的 proto 結構
+    """
+    blocks = []
+    for y in vision_line_order(sorted_lines_dict):
+        words = []
+        line = list(sorted_lines_dict[y])
+        anchor = next((i for i, w in enumerate(line) if w["y"] == y), 0)
+        line.insert(0, line.pop(anchor))
+        for w in line:
+            words.append(
+                vision.Word(
+                    bounding_box=vision.BoundingPoly(
+                        vertices=[vision.Vertex(x=x, y=y) for x, y in w["vertices"]]
+                    ),
+                    symbols=[vision.Symbol(text=ch) for ch in w["text"]],
+                )
+            )
+        blocks.append(vision.Block(paragraphs=[vision.Paragraph(words=words)]))
+
+    return vision.AnnotateImageResponse(
+        full_text_annotation=vision.TextAnnotation(pages=[vision.Page(blocks=blocks)])
+    )
+
+
+def render_fixture_image(sorted_lines_dict, width=1080, encode=".jpg"):
+    """
+    依 OCR 版面畫出一張模擬的班表截圖（只有 ASCII 文字會正確顯示）
+
+    供沒有原始截圖時的前處理 / 除錯圖測試使用，回傳編碼後的圖片 bytes
+    """
+    import cv2
+    import numpy as np
+
+    max_x = max(
+        v[0]
+        for words in sorted_lines_dict.values()
+        for w in words
+        for v in w["vertices"]
+    )
+    max_y = max(
+        v[1]
+        for words in sorted_lines_dict.values()
+        for w in words
+        for v in w["vertices"]
+    )
+    width = max(width, max_x + 40)
+    height = max_y + 200
+
+    # 淡色底與輕微雜訊，模擬 app 截圖的色塊與 JPEG 壓縮前的細節
+    img = np.full((height, width, 3), 255, np.uint8)
+    for i, top in enumerate(range(0, height, 110)):
+        img[top : top + 110] = (245, 235, 225) if i % 2 else (230, 240, 250)
+    noise = np.random.default_rng(0).integers(0, 6, img.shape, dtype=np.uint8)
+    img = cv2.subtract(img, noise)
+    for words in sorted_lines_dict.values():
+        for w in words:
+            (x0, y0), _, (x2, y2), _ = w["vertices"][:4]
+            cv2.putText(
+                img,
+                w["text"],
+                (x0, y2),
+                cv2.FONT_HERSHEY_SIMPLEX,
+                max(0.4, (y2 - y0) / 30),
+                (40, 40, 40),
+                2,
+            )
+
+    ok, encoded = cv2.imencode(encode, img)
+    return encoded.tobytes()
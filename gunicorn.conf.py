@@ -0,0 +1,39 @@
+"""
+gunicorn 設定（docker/Dockerfile.prod 以 `gunicorn -c gunicorn.conf.py line_bot_server:app` 啟動）
+
+- GUNICORN_PRELOAD=1（預設）：master 先 import app 再 fork，唯讀的表格由 worker 以
+  copy-on-write 共用；背景 thread、SQLite / HTTP / gRPC 連線都依 pid 在 worker 中重新建立
+- GUNICORN_WARM_UP=1（預設）：worker 啟動後在背景載入 Vision / OpenCV 並建立連線，
+  webhook 不必等待；設為 0 則在第一次處理圖片時才載入
+"""
+
+import os
+import threading
+
+bind = f"0.0.0.0:{os.getenv('PORT', '8000')}"
+workers = int(os.getenv("GUNICORN_WORKERS", "2"))
+# app 依 worker 數分配每個 process 的 Calendar API quota（見 auto_calendar/calendar_scheduler.py）
+os.environ["GUNICORN_WORKERS"] = str(workers)
+timeout = int(os.getenv("GUNICORN_TIMEOUT", "30"))
+
+preload_app = os.getenv("GUNICORN_PRELOAD", "1") == "1"
+
+GUNICORN_WARM_UP = os.getenv("GUNICORN_WARM_UP", "1") == "1"
+
+
+def when_ready(server):
+    # master 已載入 app、尚未 fork worker
+    if preload_app:
+        import line_bot_server
+
+        line_bot_server.preload()
+
+
+def post_worker_init(worker):
+    # worker fork 並載入 app 之後；在背景執行，不延後 worker 開始接收請求
+    if GUNICORN_WARM_UP:
+        import line_bot_server
+
+        threading.Thread(
+            target=line_bot_server.warm_up, name="warm-up", daemon=True
+        ).start()
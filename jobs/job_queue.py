@@ -0,0 +1,522 @@
+import os
+import json
+import time
+import uuid
+import socket
+import sqlite3
+import threading
+from collections import deque
+
+from monitoring.logger import get_logger
+from monitoring.metrics import metrics_registry, trace
+
+logger = get_logger(__name__)
+
+job_wait_seconds = metrics_registry.histogram(
+    "job_wait_seconds", "工作在 queue 中等待的時間", ("kind",)
+)
+
+# 獲取當前檔案的絕對路徑
+current_file_path = os.path.abspath(__file__)
+
+# 獲取當前檔案所在的目錄
+current_directory = os.path.dirname(current_file_path)
+
+# broker 種類：sqlite（預設，持久化於本機檔案）或 memory（測試用）
+JOB_QUEUE_BROKER = os.getenv("JOB_QUEUE_BROKER", "sqlite")
+
+# 使用環境變數可覆寫 queue 檔案位置（方便掛載 persistent disk）
+JOB_QUEUE_DB_PATH = os.getenv(
+    "JOB_QUEUE_DB_PATH", f"{current_directory}/job_queue.sqlite3"
+)
+
+# 背景 worker 數量與 queue 最大長度
+JOB_QUEUE_WORKERS = int(os.getenv("JOB_QUEUE_WORKERS", "2"))
+JOB_QUEUE_MAX_SIZE = int(os.getenv("JOB_QUEUE_MAX_SIZE", "200"))
+
+# 執行中的工作由所屬 process 每隔 JOB_HEARTBEAT_SECONDS 更新 heartbeat；
+# 超過 JOB_STALE_SECONDS 沒有 heartbeat（或同一台機器上所屬 process 已結束）才重新排入 queue
+JOB_HEARTBEAT_SECONDS = float(os.getenv("JOB_HEARTBEAT_SECONDS", "30"))
+JOB_STALE_SECONDS = int(os.getenv("JOB_STALE_SECONDS", "300"))
+
+# 可重試的工作最多執行幾次（含第一次），以及失敗時延後多久重試（第 n 次重試延後 delay * 2^(n-1) 秒）
+JOB_MAX_ATTEMPTS = int(os.getenv("JOB_MAX_ATTEMPTS", "3"))
+JOB_RETRY_DELAY_SECONDS = float(os.getenv("JOB_RETRY_DELAY_SECONDS", "5"))
+
+# 沒有新工作時，worker 輪詢 broker 的間隔（其他 process 放入的工作靠輪詢取得）
+JOB_POLL_INTERVAL = 0.5
+
+
+def current_owner():
+    """執行工作的 process：「主機名稱:pid」"""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+def owner_is_alive(owner):
+    """同一台機器上的 process 以 pid 判斷是否還在；其他機器的 process 只能靠 heartbeat 判斷"""
+    host, _, pid = (owner or "").rpartition(":")
+    if host != socket.gethostname() or not pid.isdigit():
+        return True
+
+    try:
+        os.kill(int(pid), 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # process 存在，只是屬於其他使用者
+        return True
+    return True
+
+
+class JobQueueFull(Exception):
+    """queue 已滿，呼叫端應回覆使用者稍後再試"""
+
+
+class Job:
+    """
+    attempts: 已經失敗的次數
+    available_at: 重試的工作在此時間之前不會被取出
+    """
+
+    def __init__(
+        self,
+        kind,
+        payload,
+        job_id=None,
+        enqueued_at=None,
+        attempts=0,
+        available_at=None,
+    ):
+        self.id = job_id or uuid.uuid4().hex
+        self.kind = kind
+        self.payload = payload
+        self.enqueued_at = enqueued_at if enqueued_at is not None else time.time()
+        self.attempts = attempts
+        self.available_at = available_at
+
+
+class MemoryBroker:
+    """行程內的 broker，不落地，給測試或本機開發使用（行為與 SQLiteBroker 相同）"""
+
+    def __init__(self):
+        self._jobs = deque()
+        # job id -> [Job, owner, heartbeat_at]
+        self._running = {}
+        self._lock = threading.Lock()
+
+    def put(self, job):
+        with self._lock:
+            self._jobs.append(job)
+
+    def claim(self):
+        now = time.time()
+        with self._lock:
+            for job in self._jobs:
+                if job.available_at is None or job.available_at <= now:
+                    self._jobs.remove(job)
+                    self._running[job.id] = [job, current_owner(), now]
+                    return job
+            return None
+
+    def ack(self, job_id):
+        with self._lock:
+            self._running.pop(job_id, None)
+
+    def retry(self, job, delay):
+        with self._lock:
+            self._running.pop(job.id, None)
+            job.attempts += 1
+            job.available_at = time.time() + delay
+            self._jobs.append(job)
+
+    def depth(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def heartbeat(self, job_ids):
+        now = time.time()
+        with self._lock:
+            for job_id in job_ids:
+                if job_id in self._running:
+                    self._running[job_id][2] = now
+
+    def recover_stale(self, stale_seconds):
+        deadline = time.time() - stale_seconds
+        with self._lock:
+            stale = [
+                job
+                for job, owner, heartbeat_at in self._running.values()
+                if heartbeat_at < deadline or not owner_is_alive(owner)
+            ]
+            for job in stale:
+                del self._running[job.id]
+                self._jobs.appendleft(job)
+            return len(stale)
+
+
+class SQLiteBroker:
+    """以 SQLite 檔案保存工作，伺服器重啟或多個 gunicorn worker 都能共用同一個 queue"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute(
+            """
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                kind TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                status TEXT NOT NULL DEFAULT 'pending',
+                enqueued_at REAL NOT NULL,
+                claimed_at REAL
+            )
+            """
+        )
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_jobs_status ON jobs (status, enqueued_at)"
+        )
+        # 舊版的 queue 檔案沒有重試欄位
+        columns = {row[1] for row in conn.execute("PRAGMA table_info(jobs)")}
+        if "attempts" not in columns:
+            conn.execute(
+                "ALTER TABLE jobs ADD COLUMN attempts INTEGER NOT NULL DEFAULT 0"
+            )
+        if "available_at" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN available_at REAL")
+        # 舊版的 queue 檔案沒有記錄執行工作的 process
+        if "owner" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN owner TEXT")
+        if "heartbeat_at" not in columns:
+            conn.execute("ALTER TABLE jobs ADD COLUMN heartbeat_at REAL")
+        conn.commit()
+
+    def _connect(self):
+        # sqlite3 connection 不能跨 thread 共用，每個 thread 各自建立
+        # fork 後也要重新連線，所以 key 加上 pid
+        key = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != key:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = key
+        return conn
+
+    def put(self, job):
+        conn = self._connect()
+        conn.execute(
+            "INSERT INTO jobs (id, kind, payload, enqueued_at, attempts, available_at) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                job.id,
+                job.kind,
+                json.dumps(job.payload),
+                job.enqueued_at,
+                job.attempts,
+                job.available_at,
+            ),
+        )
+
+    def claim(self):
+        conn = self._connect()
+        # BEGIN IMMEDIATE 取得寫鎖，避免兩個 worker 拿到同一個工作
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT id, kind, payload, enqueued_at, attempts FROM jobs "
+                "WHERE status = 'pending' "
+                "AND (available_at IS NULL OR available_at <= ?) "
+                "ORDER BY enqueued_at LIMIT 1",
+                (now,),
+            ).fetchone()
+            if row is None:
+                conn.execute("COMMIT")
+                return None
+            conn.execute(
+                "UPDATE jobs SET status = 'running', claimed_at = ?, owner = ?, "
+                "heartbeat_at = ? WHERE id = ?",
+                (now, current_owner(), now, row[0]),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        job_id, kind, payload, enqueued_at, attempts = row
+        return Job(
+            kind,
+            json.loads(payload),
+            job_id=job_id,
+            enqueued_at=enqueued_at,
+            attempts=attempts,
+        )
+
+    def ack(self, job_id):
+        conn = self._connect()
+        conn.execute("DELETE FROM jobs WHERE id = ?", (job_id,))
+
+    def retry(self, job, delay):
+        conn = self._connect()
+        conn.execute(
+            "UPDATE jobs SET status = 'pending', claimed_at = NULL, "
+            "attempts = attempts + 1, available_at = ? WHERE id = ?",
+            (time.time() + delay, job.id),
+        )
+
+    def depth(self):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT COUNT(*) FROM jobs WHERE status = 'pending'"
+        ).fetchone()
+        return row[0]
+
+    def heartbeat(self, job_ids):
+        if not job_ids:
+            return
+        conn = self._connect()
+        conn.executemany(
+            "UPDATE jobs SET heartbeat_at = ? WHERE id = ? AND status = 'running'",
+            [(time.time(), job_id) for job_id in job_ids],
+        )
+
+    def recover_stale(self, stale_seconds):
+        conn = self._connect()
+        deadline = time.time() - stale_seconds
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            rows = conn.execute(
+                "SELECT id, owner, COALESCE(heartbeat_at, claimed_at) FROM jobs "
+                "WHERE status = 'running'"
+            ).fetchall()
+            stale = [
+                (job_id,)
+                for job_id, owner, heartbeat_at in rows
+                if heartbeat_at < deadline or not owner_is_alive(owner)
+            ]
+            conn.executemany(
+                "UPDATE jobs SET status = 'pending', claimed_at = NULL, owner = NULL, "
+                "heartbeat_at = NULL WHERE id = ?",
+                stale,
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+        return len(stale)
+
+
+class JobQueue:
+    """
+    背景工作 queue：webhook 只負責 enqueue，實際工作交給固定數量的 worker thread
+
+    handler 以 register(kind, func) 註冊，func(payload) 在 worker thread 中執行
+    func 丟出例外時，註冊時指定 max_attempts > 1 的工作會在 backoff 後重新排入 queue；
+    最後一次仍失敗時呼叫 on_failure(payload, error)（例如通知使用者），再從 queue 移除
+    worker 在第一次 enqueue 時才啟動，gunicorn fork 之後也會在子行程重新啟動
+
+    每個 process 另有一個 heartbeat thread，定期更新自己執行中工作的 heartbeat，
+    並把所屬 process 已結束、或太久沒有 heartbeat 的工作重新排入 queue
+    （仍在執行中的工作，例如 Calendar API backoff 中的同步，不會被其他 process 重複執行）
+    """
+
+    def __init__(
+        self,
+        broker,
+        workers=JOB_QUEUE_WORKERS,
+        max_size=JOB_QUEUE_MAX_SIZE,
+        retry_delay=JOB_RETRY_DELAY_SECONDS,
+    ):
+        self.broker = broker
+        self.workers = workers
+        self.max_size = max_size
+        self.retry_delay = retry_delay
+        self._handlers = {}
+        self._max_attempts = {}
+        self._on_failure = {}
+        # 目前 process 執行中的 job id，由 heartbeat thread 定期更新
+        self._running_ids = set()
+        self._wakeup = threading.Event()
+        self._start_lock = threading.Lock()
+        self._started_pid = None
+        self._stats_lock = threading.Lock()
+        self._stats = {
+            "enqueued": 0,
+            "rejected": 0,
+            "processed": 0,
+            "failed": 0,
+            "retried": 0,
+            "running": 0,
+            "wait_seconds_total": 0.0,
+            "wait_seconds_max": 0.0,
+            "run_seconds_total": 0.0,
+        }
+
+    def register(self, kind, func, max_attempts=1, on_failure=None):
+        self._handlers[kind] = func
+        self._max_attempts[kind] = max(1, max_attempts)
+        self._on_failure[kind] = on_failure
+
+    def enqueue(self, kind, payload):
+        if kind not in self._handlers:
+            raise ValueError(f"未註冊的工作類型: {kind}")
+
+        if self.broker.depth() >= self.max_size:
+            self._incr("rejected")
+            raise JobQueueFull(f"工作 queue 已滿（{self.max_size}）")
+
+        job = Job(kind, payload)
+        self.broker.put(job)
+        self._incr("enqueued")
+
+        self.ensure_started()
+        self._wakeup.set()
+
+        return job.id
+
+    def ensure_started(self):
+        """確保目前行程的 worker thread 已啟動（fork 後的子行程會重新啟動）"""
+        if self.workers <= 0 or self._started_pid == os.getpid():
+            return
+
+        with self._start_lock:
+            if self._started_pid == os.getpid():
+                return
+
+            self._wakeup = threading.Event()
+            self._running_ids = set()
+            self._recover_stale()
+
+            threading.Thread(
+                target=self._heartbeat_loop, name="job-heartbeat", daemon=True
+            ).start()
+            for i in range(self.workers):
+                thread = threading.Thread(
+                    target=self._worker_loop, name=f"job-worker-{i}", daemon=True
+                )
+                thread.start()
+            self._started_pid = os.getpid()
+
+    def drain(self):
+        """在目前 thread 同步執行所有待處理工作，測試模式使用，回傳處理數量"""
+        count = 0
+        while True:
+            job = self.broker.claim()
+            if job is None:
+                return count
+            self._run(job)
+            count += 1
+
+    def stats(self):
+        with self._stats_lock:
+            stats = dict(self._stats)
+
+        started = stats["processed"] + stats["failed"] + stats["retried"]
+        stats["depth"] = self.broker.depth()
+        stats["wait_seconds_avg"] = (
+            stats["wait_seconds_total"] / started if started else 0.0
+        )
+        stats["run_seconds_avg"] = (
+            stats["run_seconds_total"] / started if started else 0.0
+        )
+        return stats
+
+    def _worker_loop(self):
+        while True:
+            try:
+                job = self.broker.claim()
+            except Exception as e:
+                logger.warning(f"讀取工作 queue 失敗: {e}")
+                job = None
+
+            if job is None:
+                self._wakeup.wait(JOB_POLL_INTERVAL)
+                self._wakeup.clear()
+                continue
+
+            self._run(job)
+
+    def _heartbeat_loop(self):
+        while True:
+            time.sleep(JOB_HEARTBEAT_SECONDS)
+            try:
+                with self._stats_lock:
+                    job_ids = list(self._running_ids)
+                self.broker.heartbeat(job_ids)
+                self._recover_stale()
+            except Exception as e:
+                logger.warning(f"更新工作 heartbeat 失敗: {e}")
+
+    def _recover_stale(self):
+        recovered = self.broker.recover_stale(JOB_STALE_SECONDS)
+        if recovered:
+            logger.warning(f"重新排入 {recovered} 個所屬 process 已停止的工作")
+
+    def _run(self, job):
+        start_time = time.time()
+        wait_seconds = max(0.0, start_time - job.enqueued_at)
+
+        with self._stats_lock:
+            self._running_ids.add(job.id)
+            self._stats["running"] += 1
+            self._stats["wait_seconds_total"] += wait_seconds
+            self._stats["wait_seconds_max"] = max(
+                self._stats["wait_seconds_max"], wait_seconds
+            )
+        job_wait_seconds.observe(wait_seconds, kind=job.kind)
+
+        result = "failed"
+        try:
+            handler = self._handlers.get(job.kind)
+            if handler is None:
+                raise ValueError(f"未註冊的工作類型: {job.kind}")
+            with trace(job.kind):
+                handler(job.payload)
+            result = "processed"
+        except Exception as e:
+            if job.attempts + 1 < self._max_attempts.get(job.kind, 1):
+                result = "retried"
+                logger.warning(
+                    f"工作 {job.kind} ({job.id}) 第 {job.attempts + 1} 次執行失敗，"
+                    f"稍後重試: {e}"
+                )
+            else:
+                logger.exception(f"✗ 工作 {job.kind} ({job.id}) 執行失敗: {e}")
+                self._report_failure(job, e)
+        finally:
+            if result == "retried":
+                self.broker.retry(job, self.retry_delay * 2**job.attempts)
+            else:
+                # 失敗的工作也從 queue 移除，錯誤由 handler 自行通知使用者
+                self.broker.ack(job.id)
+            with self._stats_lock:
+                self._running_ids.discard(job.id)
+                self._stats["running"] -= 1
+                self._stats["run_seconds_total"] += time.time() - start_time
+                self._stats[result] += 1
+
+    def _report_failure(self, job, error):
+        on_failure = self._on_failure.get(job.kind)
+        if on_failure is None:
+            return
+        try:
+            on_failure(job.payload, error)
+        except Exception as e:
+            logger.exception(f"工作 {job.kind} ({job.id}) 的失敗通知執行失敗: {e}")
+
+    def _incr(self, key):
+        with self._stats_lock:
+            self._stats[key] += 1
+
+
+def create_job_queue():
+    """依環境變數建立 JobQueue，JOB_QUEUE_BROKER=memory 時使用行程內 broker"""
+    if JOB_QUEUE_BROKER == "memory":
+        broker = MemoryBroker()
+    else:
+        broker = SQLiteBroker(JOB_QUEUE_DB_PATH)
+
+    return JobQueue(broker)
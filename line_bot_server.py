@@ -1,7 +1,8 @@
-from flask import Flask, request, abort, url_for
+from flask import Flask, request, abort, url_for, g
 import os
+import hmac
+import time
 from linebot import LineBotApi, WebhookHandler
-from linebot.exceptions import InvalidSignatureError
 from linebot.models import (
     MessageEvent,
     TextMessage,
@@ -16,8 +17,6 @@ from linebot.models import (
 )
 from werkzeug.middleware.proxy_fix import ProxyFix
 
-from googleapiclient.discovery import build
-
 if os.path.exists(".env"):
     print(".env 檔案存在，使用.env 環境變數")
 
@@ -26,15 +25,29 @@ if os.path.exists(".env"):
     load_dotenv(".env")
 
 # ====== 自訂模組 ======
-from ocr.ocr_utils import image_to_text
-from ocr.process_text import text_to_calender_event_dict, roster_message
+from ocr.ocr_utils import image_to_lines, ocr_cache, duplicate_index
+from ocr.ocr_utils import warm_up as warm_up_ocr
+from ocr.artifact_writer import artifact_writer
+from ocr.image_ingest import read_image_content, ImageRejectedError, download_stats
+from ocr.process_text import layout_to_calender_event_dict, roster_message
+from ocr.shift_table import shift_table_loader
 from auto_calendar.calendar_utils import (
     create_events_in_calendar,
     OAuth_user_credential_is_valid,
-    load_OAuth_credentials,
     save_OAuth_credentials,
+    get_calendar_service,
+    calendar_service_factory,
     get_flow,
+    calendar_scheduler,
+    credential_cache,
+    google_transport,
 )
+from auto_calendar.calendar_scheduler import is_retryable_error
+from jobs.job_queue import create_job_queue, JobQueueFull, JOB_MAX_ATTEMPTS
+from storage.pending_store import create_pending_store
+from monitoring.logger import get_logger, SAMPLED
+from monitoring.metrics import metrics_registry, set_outcome, span, trace
+from monitoring.profiler import ProfilerController, ProfileBusyError, format_top
 
 # from linebot_config import CHANNEL_ACCESS_TOKEN, CHANNEL_SECRET
 
@@ -42,7 +55,12 @@ from auto_calendar.calendar_utils import (
 CHANNEL_ACCESS_TOKEN = os.getenv("CHANNEL_ACCESS_TOKEN")
 
 CHANNEL_SECRET = os.getenv("CHANNEL_SECRET")
+
+# /debug/profile 使用的管理者 token，未設定時關閉此路由
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN")
 # ====== 設定 ======
+logger = get_logger(__name__)
+
 app = Flask(__name__)
 
 # 信任來自 proxy 的 X-Forwarded-* headers
@@ -61,7 +79,16 @@ line_bot_api = LineBotApi(channel_access_token=CHANNEL_ACCESS_TOKEN)
 handler = WebhookHandler(CHANNEL_SECRET)
 
 # 儲存使用者上傳圖片後，待確認是否建立行事曆事件的暫存資料
-pending_ocr_dict = {}
+# 只存可序列化的班表資料，多個 gunicorn worker 透過 SQLite / Redis 共用
+pending_store = create_pending_store()
+
+# 背景工作 queue：圖片下載、OCR 與解析都在 worker 中執行，webhook 只負責 enqueue
+job_queue = create_job_queue()
+
+# 線上 worker 的 sampling profiler（/debug/profile），背景 queue 處理完工作才停止取樣
+request_profiler = ProfilerController(
+    is_idle=lambda: job_queue.broker.depth() == 0 and job_queue.stats()["running"] == 0
+)
 
 
 # ====== Webhook 路由 ======
@@ -71,10 +98,17 @@ def callback():
     signature = request.headers["X-Line-Signature"]
     body = request.get_data(as_text=True)
 
-    try:
-        handler.handle(body, signature)
-    except InvalidSignatureError:
-        abort(400)
+    # 伺服器重啟前留在 queue 的工作，也要有 worker 接手
+    job_queue.ensure_started()
+
+    with trace("webhook"):
+        # 簽章驗證單獨計時；handler.handle 會再驗證一次（HMAC 的成本可忽略）
+        with span("signature_check"):
+            if not handler.parser.signature_validator.validate(body, signature):
+                abort(400)
+
+        with span("webhook_dispatch"):
+            handler.handle(body, signature)
 
     return "OK", 200
 
@@ -85,8 +119,7 @@ def handle_image(event):
     user_id = event.source.user_id
     message_id = event.message.id
 
-    if user_id in pending_ocr_dict.keys():
-        del pending_ocr_dict[user_id]
+    pending_store.delete(user_id)
 
     try:
         if OAuth_user_credential_is_valid(user_id) == False:
@@ -117,31 +150,133 @@ def handle_image(event):
 
             return
 
-        # 建立 Google Calendar 服務
-        credentials = load_OAuth_credentials(user_id)
+        # 圖片處理交給背景 worker，webhook 立即回應 LINE
+        job_queue.enqueue("ocr_image", {"user_id": user_id, "message_id": message_id})
+
+        return
+
+    except JobQueueFull:
+        line_bot_api.reply_message(
+            event.reply_token,
+            TextSendMessage(text="目前處理的班表較多，請稍後再上傳圖片。"),
+        )
+
+    except Exception as e:
+        error_msg = f"❌ 處理失敗：{str(e)}"
+        logger.exception(f"處理圖片訊息失敗: {e}")
+        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=error_msg))
 
-        service = build("calendar", "v3", credentials=credentials)
-        # 下載圖片（不儲存到磁碟，直接用 bytes 處理）
-        message_content = line_bot_api.get_message_content(message_id)
-        content_bytes = b""
-        for chunk in message_content.iter_content():
-            content_bytes += chunk
 
-        # 呼叫OCR 處理流程（直接傳 bytes）
-        texts = image_to_text(content_bytes)
-        year, month, new_event_dict = text_to_calender_event_dict(texts)
+def is_transient_error(error):
+    """
+    背景工作中可以重試的錯誤：Calendar API 的 429 / 5xx、LINE API 的 429 / 5xx、
+    Vision 斷線或逾時、連線逾時，以及暫時無法更新的 OAuth token
+    """
+    if isinstance(error, (TimeoutError, ConnectionError)):
+        return True
+    if is_retryable_error(error):
+        return True
+    # google-auth 的 RefreshError 等例外以 retryable 標示暫時性錯誤
+    if getattr(error, "retryable", False):
+        return True
+
+    import requests
+    from linebot.exceptions import LineBotApiError
+    from ocr.vision_client import reconnect_errors
+
+    if isinstance(error, (requests.Timeout, requests.ConnectionError)):
+        return True
+    if isinstance(error, LineBotApiError):
+        return error.status_code == 429 or error.status_code >= 500
+    return isinstance(error, reconnect_errors())
+
+
+def process_image_job(payload):
+    """
+    背景 worker 執行：下載圖片 → OCR → 解析 → 以 push_message 回覆辨識結果
+    """
+    user_id = payload["user_id"]
+    message_id = payload["message_id"]
 
-        pending_ocr_dict[user_id] = {
-            "year": year,
-            "month": month,
-            "event_dict": new_event_dict,
-            "service": service,
-        }
+    # 解析結果連同 OCR 版面交給 artifact_writer 在背景記錄，方便追查解析錯誤的班表
+    image_view = None
+    sorted_lines_dict = None
+    artifact_meta = {"message_id": message_id}
 
-        reply_text = roster_message(year, month, new_event_dict)
+    try:
+        # 下載圖片（不儲存到磁碟，串流寫入預先配置的 buffer）
+        with span("image_download"):
+            message_content = line_bot_api.get_message_content(message_id)
+            image_view, download = read_image_content(message_content)
+        artifact_meta["download"] = download
+        logger.info(
+            f"下載圖片 {download['bytes']} bytes（{download['type']}）"
+            f"{download['seconds']:.3f}s",
+            extra=SAMPLED,
+        )
+
+        # 呼叫OCR 處理流程（直接傳 memoryview，不複製）
+        sorted_lines_dict = image_to_lines(image_view, user_id=user_id)
+        with span("parse"):
+            year, month, new_event_dict, grid = layout_to_calender_event_dict(
+                sorted_lines_dict
+            )
+        unknown_dates = grid.unknown_dates if grid is not None else []
+        artifact_meta.update(
+            {
+                "year": year,
+                "month": month,
+                "shifts": {
+                    date_key: event.get("summary")
+                    for date_key, event in new_event_dict.items()
+                },
+                "confidence": grid.confidence if grid is not None else None,
+                "unknown_dates": unknown_dates,
+            }
+        )
+
+        reply_text = roster_message(year, month, new_event_dict, grid)
+
+        # 先以 dry run 比對目前的行事曆，讓使用者確認實際會做的變更
+        plan_text = ""
+        try:
+            plan = create_events_in_calendar(
+                new_event_dict,
+                get_calendar_service(user_id),
+                user_id=user_id,
+                dry_run=True,
+                keep_dates=unknown_dates,
+            ).plan
+
+            if not plan.has_writes:
+                line_bot_api.push_message(
+                    to=user_id,
+                    messages=TextSendMessage(
+                        text=f"班表與您的 Google 行事曆相同，不需要變更。\n\n{reply_text}"
+                    ),
+                )
+                return
+
+            plan_text = f"\n\n{plan.describe()}"
+
+        except Exception as e:
+            # token 更新在這裡進行（webhook 不等待）；暫時失敗時重試工作，OCR 結果已快取
+            if is_transient_error(e):
+                raise
+            logger.warning(f"比對行事曆失敗，略過變更預覽: {e}")
+
+        pending_store.put(
+            user_id,
+            {
+                "year": year,
+                "month": month,
+                "event_dict": new_event_dict,
+                "unknown_dates": unknown_dates,
+            },
+        )
 
         reply_msg = TextSendMessage(
-            text=f"OCR 辨識結果如下，請問是否要將此班表新增至您的 Google 行事曆？\n\n{reply_text}",
+            text=f"OCR 辨識結果如下，請問是否要將此班表新增至您的 Google 行事曆？\n\n{reply_text}{plan_text}",
             quick_reply=QuickReply(
                 items=[
                     QuickReplyButton(
@@ -154,14 +289,41 @@ def handle_image(event):
             ),
         )
 
-        line_bot_api.reply_message(event.reply_token, reply_msg)
+        line_bot_api.push_message(to=user_id, messages=reply_msg)
 
-        return
+    except ImageRejectedError as e:
+        set_outcome("rejected")
+        line_bot_api.push_message(
+            to=user_id, messages=TextSendMessage(text=f"❌ 無法處理此圖片：{str(e)}")
+        )
 
     except Exception as e:
-        error_msg = f"❌ 處理失敗：{str(e)}"
-        print("Error:", e)
-        line_bot_api.reply_message(event.reply_token, TextSendMessage(text=error_msg))
+        artifact_meta["error"] = str(e)
+        if is_transient_error(e):
+            # 交給 job_queue 重試，最後一次仍失敗時由 report_image_job_failure 通知使用者
+            raise
+        logger.exception(f"處理班表圖片失敗: {e}")
+        set_outcome("error")
+        report_image_job_failure(payload, e)
+
+    finally:
+        # 不會阻塞：queue 滿了就丟棄；image_view 每次下載都是新的 buffer，不需複製
+        artifact_writer.submit(user_id, sorted_lines_dict, image_view, artifact_meta)
+
+
+def report_image_job_failure(payload, error):
+    line_bot_api.push_message(
+        to=payload["user_id"],
+        messages=TextSendMessage(text=f"❌ 處理失敗：{str(error)}"),
+    )
+
+
+job_queue.register(
+    "ocr_image",
+    process_image_job,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    on_failure=report_image_job_failure,
+)
 
 
 @app.route("/google/oauth/callback")
@@ -170,7 +332,7 @@ def google_oauth_callback():
     Google 授權完成後的回調路由
     """
     state = request.args.get("state")  # 這裡就是 LINE user_id
-    print(state)
+    logger.info(f"Google 授權回調: {state}")
     if not state:
         return "❌ 錯誤：無法識別使用者", 400
 
@@ -205,7 +367,7 @@ def google_oauth_callback():
         </html>
         """
     except Exception as e:
-        print("OAuth Error:", e)
+        logger.exception(f"OAuth Error: {e}")
         return f"❌ 授權失敗：{str(e)}", 500
 
 
@@ -215,40 +377,38 @@ def handle_text(event):
     user_id = event.source.user_id
     text = event.message.text
 
-    if text == "同意" and user_id in pending_ocr_dict.keys():
+    # 取出並刪除待確認資料，避免使用者重複按下同意；其他訊息也會讓待確認資料失效
+    pending = pending_store.pop(user_id)
+
+    if text == "同意" and pending is not None:
 
         try:
+            # 寫入行事曆交給持久化的工作 queue，伺服器重啟後仍會由 worker 接手
+            job_queue.enqueue("sync_calendar", {"user_id": user_id, "pending": pending})
+
             # 回覆成功訊息
             reply_text = "正在將班表新增至您的 Google 行事曆，請稍候..."
             line_bot_api.reply_message(
                 event.reply_token, TextSendMessage(text=reply_text)
             )
-            create_events_in_calendar(
-                pending_ocr_dict[user_id]["year"],
-                pending_ocr_dict[user_id]["month"],
-                pending_ocr_dict[user_id]["event_dict"],
-                pending_ocr_dict[user_id]["service"],
-            )
 
-            # 回覆成功訊息
-            success_text = "✅ 已成功將班表新增至您的 Google 行事曆！"
-            line_bot_api.push_message(
-                to=event.source.user_id, messages=TextSendMessage(text=success_text)
+        except JobQueueFull:
+            # 放回待確認資料，讓使用者稍後再按一次同意
+            pending_store.put(user_id, pending)
+            line_bot_api.reply_message(
+                event.reply_token,
+                TextSendMessage(text="目前處理的班表較多，請稍後再按一次「同意」。"),
             )
 
         except Exception as e:
             error_msg = f"❌ 建立行事曆事件失敗：{str(e)}"
-            print("Error:", e)
-            line_bot_api.reply_message(
-                event.reply_token, TextSendMessage(text=error_msg)
+            logger.exception(f"排入行事曆同步失敗: {e}")
+            line_bot_api.push_message(
+                to=user_id, messages=TextSendMessage(text=error_msg)
             )
-        finally:
-            # 刪除已處理的待確認資料
-            del pending_ocr_dict[user_id]
 
-    elif text == "不同意" and user_id in pending_ocr_dict.keys():
-        # 使用者不同意，刪除待確認資料
-        del pending_ocr_dict[user_id]
+    elif text == "不同意" and pending is not None:
+        # 使用者不同意，待確認資料已刪除
         line_bot_api.reply_message(
             event.reply_token,
             TextSendMessage(text="已取消班表新增。如需再次上傳圖片，請重新傳送。"),
@@ -259,9 +419,64 @@ def handle_text(event):
             TextSendMessage(text="請上傳一張包含行事曆的圖片，我會幫你自動建立事件！"),
         )
 
-    if user_id in pending_ocr_dict.keys():
 
-        del pending_ocr_dict[user_id]
+def sync_calendar_job(payload):
+    """
+    背景 worker 執行：寫入行事曆並以 push_message 回報結果
+    API 請求經過 calendar_scheduler 限速與重試；同一使用者的寫入依序執行
+    """
+    user_id = payload["user_id"]
+    pending = payload["pending"]
+
+    with calendar_scheduler.user_session(user_id):
+        write_calendar(user_id, pending)
+
+
+def write_calendar(user_id, pending):
+    try:
+        # 待確認資料不含 service 物件，在確認後才取得 Google Calendar 服務
+        service = get_calendar_service(user_id)
+
+        report = create_events_in_calendar(
+            pending["event_dict"],
+            service,
+            user_id=user_id,
+            keep_dates=pending.get("unknown_dates", []),
+        )
+
+        # 回覆成功訊息
+        if report.ok:
+            success_text = "✅ 已成功將班表新增至您的 Google 行事曆！"
+        else:
+            set_outcome("error")
+            success_text = "⚠️ 部分班表未能寫入 Google 行事曆，請稍後重新上傳。"
+        success_text += f"\n{report.summary()}"
+        line_bot_api.push_message(
+            to=user_id, messages=TextSendMessage(text=success_text)
+        )
+
+    except Exception as e:
+        if is_transient_error(e):
+            # 寫入以 diff 計畫執行，重試時只會補上尚未寫入的變更
+            raise
+        logger.exception(f"同步行事曆失敗: {e}")
+        set_outcome("error")
+        report_sync_failure({"user_id": user_id}, e)
+
+
+def report_sync_failure(payload, error):
+    line_bot_api.push_message(
+        to=payload["user_id"],
+        messages=TextSendMessage(text=f"❌ 建立行事曆事件失敗：{str(error)}"),
+    )
+
+
+job_queue.register(
+    "sync_calendar",
+    sync_calendar_job,
+    max_attempts=JOB_MAX_ATTEMPTS,
+    on_failure=report_sync_failure,
+)
 
 
 # monitoring route
@@ -270,7 +485,172 @@ def health_check():
     return "server is running", 200
 
 
+@app.route("/jobs/stats", methods=["GET"])
+def job_stats():
+    return {
+        "jobs": job_queue.stats(),
+        "calendar": calendar_scheduler.stats(),
+        "download": download_stats.stats(),
+        "credentials": credential_cache.stats(),
+        "calendar_services": calendar_service_factory.stats(),
+        "google_http": google_transport.stats(),
+        "shift_table": shift_table_loader.stats(),
+        "artifacts": artifact_writer.stats(),
+    }, 200
+
+
+# ====== Prometheus metrics ======
+def cache_lookups():
+    """各快取的命中 / 未命中次數：{(cache, result): 次數}"""
+    ocr = ocr_cache.stats()
+    duplicate = duplicate_index.stats()
+    credentials = credential_cache.stats()
+    services = calendar_service_factory.stats()
+
+    return {
+        ("ocr", "hit"): ocr["memory_hits"] + ocr["disk_hits"],
+        ("ocr", "miss"): ocr["misses"],
+        ("near_duplicate", "hit"): duplicate["matches"],
+        ("near_duplicate", "miss"): duplicate["lookups"] - duplicate["matches"],
+        ("credentials", "hit"): credentials["hits"],
+        ("credentials", "miss"): credentials["loads"] + credentials["reloads"],
+        ("calendar_service", "hit"): services["hits"],
+        ("calendar_service", "miss"): services["builds"],
+    }
+
+
+def cache_hit_ratio():
+    lookups = cache_lookups()
+    ratios = {}
+    for cache in {cache for cache, _ in lookups}:
+        total = lookups[(cache, "hit")] + lookups[(cache, "miss")]
+        ratios[(cache,)] = lookups[(cache, "hit")] / total if total else 0.0
+    return ratios
+
+
+metrics_registry.gauge(
+    "job_queue_depth", "等待處理的背景工作數", lambda: job_queue.broker.depth()
+)
+metrics_registry.gauge(
+    "jobs_running", "執行中的背景工作數", lambda: job_queue.stats()["running"]
+)
+metrics_registry.gauge(
+    "calendar_throttled_seconds",
+    "Calendar API 限速累計等待秒數",
+    lambda: calendar_scheduler.stats()["throttled_seconds"],
+)
+metrics_registry.gauge(
+    "cache_lookups", "快取查詢次數", cache_lookups, ("cache", "result")
+)
+metrics_registry.gauge("cache_hit_ratio", "快取命中率", cache_hit_ratio, ("cache",))
+metrics_registry.gauge(
+    "artifact_queue_depth", "等待寫入的 OCR 紀錄數", artifact_writer.depth
+)
+metrics_registry.gauge(
+    "artifacts_dropped",
+    "queue 已滿而丟棄的 OCR 紀錄數",
+    lambda: artifact_writer.stats()["dropped"],
+)
+
+
+@app.route("/metrics", methods=["GET"])
+def metrics():
+    return (
+        metrics_registry.render(),
+        200,
+        {"Content-Type": "text/plain; version=0.0.4; charset=utf-8"},
+    )
+
+
+# ====== Profiling ======
+@app.before_request
+def start_request_profile():
+    # 沒有 arm 時只讀一次旗標
+    if request_profiler.armed and request.endpoint == "callback":
+        g.profiled = request_profiler.request_started()
+
+
+@app.teardown_request
+def finish_request_profile(exception=None):
+    if g.get("profiled"):
+        request_profiler.request_finished()
+
+
+@app.route("/debug/profile", methods=["GET", "POST"])
+def debug_profile():
+    """
+    以 sampling profiler 分析目前的 worker（Authorization: Bearer <ADMIN_TOKEN>）
+
+    ?seconds=N   立即取樣 N 秒並回傳結果
+    ?requests=K  接下來進到此 worker 的 K 個 /callback（含背景工作）取樣，結果稍後以 GET 取得
+    其他         回傳最近一次的結果
+    format=json（預設）、collapsed（flamegraph.pl / speedscope）或 top
+    interval_ms=取樣間隔；idle=1 時包含閒置中的 thread
+    """
+    if not ADMIN_TOKEN:
+        abort(404)
+
+    token = request.headers.get("Authorization", "").removeprefix("Bearer ").strip()
+    if not hmac.compare_digest(token.encode(), ADMIN_TOKEN.encode()):
+        abort(403)
+
+    interval = request.args.get("interval_ms", type=float)
+    include_idle = request.args.get("idle") == "1"
+
+    try:
+        if "seconds" in request.args:
+            result = request_profiler.run_for(
+                request.args.get("seconds", 10, type=float), interval, include_idle
+            )
+        elif "requests" in request.args:
+            request_profiler.arm(
+                request.args.get("requests", 1, type=int), interval, include_idle
+            )
+            return {"pid": os.getpid(), **request_profiler.status()}, 202
+        else:
+            result = request_profiler.latest()
+            if result is None:
+                return {"pid": os.getpid(), **request_profiler.status()}, 404
+    except ProfileBusyError as e:
+        return {"error": str(e), **request_profiler.status()}, 409
+
+    output = request.args.get("format", "json")
+    if output == "collapsed":
+        return result["collapsed"], 200, {"Content-Type": "text/plain; charset=utf-8"}
+    if output == "top":
+        return format_top(result), 200, {"Content-Type": "text/plain; charset=utf-8"}
+    return result, 200
+
+
 # ====== 啟動伺服器 ======
+# ====== 啟動：gunicorn --preload 與 fork 後預熱（見 gunicorn.conf.py） ======
+def preload():
+    """
+    gunicorn --preload 時在 master fork worker 之前執行，先載入唯讀的表格
+    （班別 lexer、Calendar discovery document），各 worker 以 copy-on-write 共用
+
+    這裡不可建立 thread、連線或 gRPC channel，fork 之後無法沿用
+    """
+    shift_table_loader.get()
+    calendar_service_factory.document.get()
+
+
+def warm_up():
+    """
+    每個 worker fork 之後在背景執行：載入第一張班表才會用到的模組、Vision client
+    與背景 worker，冷啟動後的第一個請求不必等待
+    """
+    started_at = time.perf_counter()
+    try:
+        preload()
+        job_queue.ensure_started()
+        warm_up_ocr()
+    except Exception as e:
+        logger.warning(f"預熱失敗，改在第一次使用時載入: {e}")
+        return
+    logger.info(f"預熱完成（{time.perf_counter() - started_at:.2f} 秒）")
+
+
 if __name__ == "__main__":
     print("Starting Line Bot server on http://127.0.0.1:8000")
     app.run(host="127.0.0.1", port=8000, debug=True)
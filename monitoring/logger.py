@@ -0,0 +1,59 @@
+import os
+import sys
+import random
+import logging
+import threading
+
+# DEBUG / INFO / WARNING / ERROR
+LOG_LEVEL = os.getenv("LOG_LEVEL", "INFO").upper()
+
+# 每個請求都會出現的 log（extra=SAMPLED）只保留此比例；WARNING 以上一律保留
+LOG_SAMPLE_RATE = float(os.getenv("LOG_SAMPLE_RATE", "1"))
+
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s"
+
+# 所有模組的 logger 都在這個名稱底下，不影響 gunicorn / werkzeug 的 logger
+ROOT_LOGGER_NAME = "auto_roster"
+
+# 標記為可抽樣的 log：logger.info("...", extra=SAMPLED)
+SAMPLED = {"sampled": True}
+
+_configure_lock = threading.Lock()
+_configured = False
+
+
+class SampleFilter(logging.Filter):
+    """依 rate 抽樣標記為 sampled 的 DEBUG / INFO log"""
+
+    def __init__(self, rate=LOG_SAMPLE_RATE):
+        super().__init__()
+        self.rate = rate
+
+    def filter(self, record):
+        if record.levelno >= logging.WARNING or not getattr(record, "sampled", False):
+            return True
+        return self.rate >= 1 or random.random() < self.rate
+
+
+def configure_logging(level=LOG_LEVEL, sample_rate=LOG_SAMPLE_RATE):
+    global _configured
+
+    with _configure_lock:
+        if _configured:
+            return
+        _configured = True
+
+        handler = logging.StreamHandler(sys.stderr)
+        handler.setFormatter(logging.Formatter(LOG_FORMAT))
+        handler.addFilter(SampleFilter(sample_rate))
+
+        root = logging.getLogger(ROOT_LOGGER_NAME)
+        root.setLevel(level)
+        root.addHandler(handler)
+        root.propagate = False
+
+
+def get_logger(name):
+    """get_logger(__name__)，例如 auto_roster.ocr.ocr_utils"""
+    configure_logging()
+    return logging.getLogger(f"{ROOT_LOGGER_NAME}.{name}")
@@ -0,0 +1,411 @@
+import os
+import json
+import time
+import bisect
+import threading
+import contextlib
+import contextvars
+
+from monitoring.logger import get_logger, SAMPLED
+
+logger = get_logger(__name__)
+
+# 多個 gunicorn worker 時，每個 worker 定期把自己的 counter / histogram 寫到此目錄，
+# /metrics 合併所有 worker 的檔案（不設定時只回傳處理該請求的 worker）
+METRICS_DIR = os.getenv("METRICS_DIR", "")
+
+# 每隔幾秒把 metrics 寫到 METRICS_DIR
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+METRICS_PREFIX = "auto_roster_"
+
+# 延遲 histogram 的預設 bucket（秒）；Vision 與 Calendar 寫入可能到數秒
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30)
+
+
+def format_labels(label_names, label_values, extra=()):
+    pairs = list(zip(label_names, label_values)) + list(extra)
+    if not pairs:
+        return ""
+
+    def escape(value):
+        return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+    return "{" + ",".join(f'{name}="{escape(value)}"' for name, value in pairs) + "}"
+
+
+def format_value(value):
+    if value == float("inf"):
+        return "+Inf"
+    if float(value).is_integer():
+        return str(int(value))
+    return repr(float(value))
+
+
+class Metric:
+    """metric 的共用部分：名稱、說明與 label"""
+
+    kind = None
+
+    def __init__(self, name, help_text, label_names=()):
+        self.name = name
+        self.help_text = help_text
+        self.label_names = tuple(label_names)
+        self._lock = threading.Lock()
+        self._values = {}
+
+    def _key(self, labels):
+        if set(labels) != set(self.label_names):
+            raise ValueError(
+                f"{self.name} 需要 label {self.label_names}，收到 {tuple(labels)}"
+            )
+        return tuple(str(labels[name]) for name in self.label_names)
+
+    def snapshot(self):
+        """[(label 值, 值)]，寫入 METRICS_DIR 與合併時使用"""
+        with self._lock:
+            return [[list(key), value] for key, value in self._values.items()]
+
+    def header(self):
+        return [
+            f"# HELP {self.name} {self.help_text}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self, values):
+        lines = self.header()
+        for label_values, value in values:
+            lines.append(
+                f"{self.name}{format_labels(self.label_names, label_values)} "
+                f"{format_value(value)}"
+            )
+        return lines
+
+    @staticmethod
+    def merge(value, other):
+        return value + other
+
+
+class Histogram(Metric):
+    """
+    延遲分布；每組 label 的值為 [各 bucket 的次數（不累計）..., +Inf 的次數, sum]
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, label_names)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            counts = self._values.get(key)
+            if counts is None:
+                counts = self._values[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            counts[index] += 1
+            counts[-1] += value
+
+    def snapshot(self):
+        with self._lock:
+            return [[list(key), list(value)] for key, value in self._values.items()]
+
+    def render(self, values):
+        lines = self.header()
+        for label_values, counts in values:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts[:-1]):
+                cumulative += count
+                labels = format_labels(
+                    self.label_names, label_values, [("le", format_value(bound))]
+                )
+                lines.append(f"{self.name}_bucket{labels} {cumulative}")
+
+            labels = format_labels(self.label_names, label_values)
+            lines.append(f"{self.name}_sum{labels} {format_value(counts[-1])}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+    @staticmethod
+    def merge(value, other):
+        return [a + b for a, b in zip(value, other)]
+
+
+class Gauge(Metric):
+    """
+    目前的數值（queue 長度、快取命中數…），在輸出時才呼叫 function 取得
+
+    function 回傳數字（沒有 label 時），或 {label 值 tuple: 數字}
+    每個 worker 各自的數值以 pid label 區分
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help_text, function, label_names=()):
+        super().__init__(name, help_text, label_names)
+        self.function = function
+
+    def snapshot(self):
+        try:
+            result = self.function()
+        except Exception as e:
+            logger.warning(f"讀取 gauge {self.name} 失敗: {e}")
+            return []
+
+        if not isinstance(result, dict):
+            result = {(): result}
+
+        return [
+            [[str(value) for value in key] + [str(os.getpid())], float(number)]
+            for key, number in result.items()
+        ]
+
+    def render(self, values):
+        lines = self.header()
+        for label_values, value in values:
+            labels = format_labels(self.label_names + ("pid",), label_values)
+            lines.append(f"{self.name}{labels} {format_value(value)}")
+        return lines
+
+
+class MetricsRegistry:
+    """
+    每個 process 一份的 metrics，以 Prometheus text format 輸出
+
+    有設定 folder（METRICS_DIR）時，背景 thread 每隔 flush_seconds 把目前的值寫到
+    folder/metrics-<pid>.json，輸出時合併所有 worker：counter 與 histogram 相加
+    （已結束的 worker 也保留，數值不會倒退），gauge 只取仍在執行的 worker
+    """
+
+    def __init__(self, folder=METRICS_DIR, flush_seconds=METRICS_FLUSH_SECONDS):
+        self.folder = folder
+        self.flush_seconds = flush_seconds
+        self._lock = threading.Lock()
+        self._metrics = {}
+        self._flusher_pid = None
+
+        if self.folder:
+            os.makedirs(self.folder, exist_ok=True)
+
+        # fork 出的 worker 從 0 開始計算，否則 fork 前的數值合併時會被重複計算
+        os.register_at_fork(after_in_child=self._reset_after_fork)
+
+    def _register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing
+            self._metrics[metric.name] = metric
+            return metric
+
+    def counter(self, name, help_text, label_names=()):
+        return self._register(Counter(METRICS_PREFIX + name, help_text, label_names))
+
+    def histogram(self, name, help_text, label_names=(), buckets=DEFAULT_BUCKETS):
+        return self._register(
+            Histogram(METRICS_PREFIX + name, help_text, label_names, buckets)
+        )
+
+    def gauge(self, name, help_text, function, label_names=()):
+        return self._register(
+            Gauge(METRICS_PREFIX + name, help_text, function, label_names)
+        )
+
+    def snapshot(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        return {metric.name: metric.snapshot() for metric in metrics}
+
+    def render(self):
+        """Prometheus text exposition format"""
+        self.ensure_flusher()
+
+        if self.folder:
+            self.flush()
+            snapshots = self._read_all()
+        else:
+            snapshots = [(os.getpid(), self.snapshot())]
+
+        with self._lock:
+            metrics = list(self._metrics.values())
+
+        lines = []
+        for metric in metrics:
+            merged = {}
+            for pid, snapshot in snapshots:
+                if isinstance(metric, Gauge) and not process_alive(pid):
+                    continue
+                for label_values, value in snapshot.get(metric.name, []):
+                    key = tuple(label_values)
+                    if key in merged and not isinstance(metric, Gauge):
+                        merged[key] = metric.merge(merged[key], value)
+                    else:
+                        merged[key] = value
+            lines.extend(metric.render(sorted(merged.items())))
+
+        return "\n".join(lines) + "\n"
+
+    def flush(self):
+        if not self.folder:
+            return
+
+        path = os.path.join(self.folder, f"metrics-{os.getpid()}.json")
+        tmp_path = f"{path}.tmp"
+        try:
+            with open(tmp_path, "w", encoding="utf-8") as file:
+                json.dump(self.snapshot(), file)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logger.warning(f"寫入 metrics 失敗: {e}")
+
+    def ensure_flusher(self):
+        # gunicorn fork 後，子行程要啟動自己的背景 thread
+        if not self.folder or self._flusher_pid == os.getpid():
+            return
+
+        with self._lock:
+            if self._flusher_pid == os.getpid():
+                return
+            self._flusher_pid = os.getpid()
+
+        thread = threading.Thread(
+            target=self._flush_loop, name="metrics-flusher", daemon=True
+        )
+        thread.start()
+
+    def _reset_after_fork(self):
+        self._lock = threading.Lock()
+        for metric in self._metrics.values():
+            metric._lock = threading.Lock()
+            metric._values = {}
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.flush_seconds)
+            self.flush()
+
+    def _read_all(self):
+        snapshots = []
+        for file_name in os.listdir(self.folder):
+            if not (file_name.startswith("metrics-") and file_name.endswith(".json")):
+                continue
+            try:
+                pid = int(file_name[len("metrics-") : -len(".json")])
+                with open(os.path.join(self.folder, file_name), encoding="utf-8") as f:
+                    snapshots.append((pid, json.load(f)))
+            except (OSError, ValueError) as e:
+                logger.warning(f"讀取 metrics 檔案 {file_name} 失敗，略過: {e}")
+        return snapshots
+
+
+def process_alive(pid):
+    if pid == os.getpid():
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+# 每個 process 共用的 registry
+metrics_registry = MetricsRegistry()
+
+# ====== 各階段耗時 ======
+stage_duration = metrics_registry.histogram(
+    "stage_duration_seconds", "各處理階段的耗時", ("stage",)
+)
+stage_errors = metrics_registry.counter(
+    "stage_errors_total", "各處理階段發生例外的次數", ("stage",)
+)
+request_duration = metrics_registry.histogram(
+    "request_duration_seconds", "整個請求（webhook、背景工作）的耗時", ("kind",)
+)
+requests_total = metrics_registry.counter(
+    "requests_total", "請求（webhook、背景工作）數", ("kind", "outcome")
+)
+
+
+class Trace:
+    """
+    一個請求（webhook、背景工作）中各階段的耗時，結束時寫一行摘要 log
+
+    outcome: 沒有例外時記錄的結果，預設 "ok"；自行處理錯誤的 handler 以 set_outcome 標記
+    """
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.spans = []
+        self.outcome = "ok"
+
+    def summary(self):
+        return " ".join(f"{stage}={seconds:.3f}s" for stage, seconds in self.spans)
+
+
+_current_trace = contextvars.ContextVar("current_trace", default=None)
+
+
+@contextlib.contextmanager
+def trace(kind):
+    """
+    請求範圍：底下所有 span 都記到這個 trace，結束時記錄整個請求的耗時
+
+    同一個 thread（或 contextvars context）中才會收到 span
+    """
+    current = Trace(kind)
+    token = _current_trace.set(current)
+    start = time.perf_counter()
+    outcome = None
+    try:
+        yield current
+    except BaseException:
+        outcome = "error"
+        raise
+    finally:
+        outcome = outcome or current.outcome
+        seconds = time.perf_counter() - start
+        _current_trace.reset(token)
+        request_duration.observe(seconds, kind=kind)
+        requests_total.inc(kind=kind, outcome=outcome)
+        logger.info(
+            f"{kind} {outcome} {seconds:.3f}s {current.summary()}", extra=SAMPLED
+        )
+
+
+def set_outcome(outcome):
+    """
+    標記目前 trace 的結果（例如 handler 捕捉了例外並通知使用者時標記為 "error"），
+    不在 trace 中時不做任何事
+    """
+    current = _current_trace.get()
+    if current is not None:
+        current.outcome = outcome
+
+
+@contextlib.contextmanager
+def span(stage):
+    """記錄一個階段的耗時到 stage_duration_seconds，例外時另外計數"""
+    start = time.perf_counter()
+    try:
+        yield
+    except BaseException:
+        stage_errors.inc(stage=stage)
+        raise
+    finally:
+        seconds = time.perf_counter() - start
+        stage_duration.observe(seconds, stage=stage)
+        current = _current_trace.get()
+        if current is not None:
+            current.spans.append((stage, seconds))
@@ -0,0 +1,350 @@
+import os
+import sys
+import json
+import time
+import tempfile
+import threading
+from collections import Counter
+
+from monitoring.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 取樣間隔（毫秒）
+PROFILE_INTERVAL_MS = float(os.getenv("PROFILE_INTERVAL_MS", "5"))
+
+# 單次 profiling 最多幾秒（包含「接下來 K 個請求」模式）
+# 依秒數 profiling 時請求會等待結果，需小於 gunicorn 的 timeout（預設 30 秒）
+PROFILE_MAX_SECONDS = float(os.getenv("PROFILE_MAX_SECONDS", "25"))
+
+# 「接下來 K 個請求」模式最多幾個請求
+PROFILE_MAX_REQUESTS = int(os.getenv("PROFILE_MAX_REQUESTS", "50"))
+
+# 結果寫到此目錄，任何一個 worker 都可以取得最近一次的結果
+PROFILE_FOLDER = os.getenv(
+    "PROFILE_FOLDER", os.path.join(tempfile.gettempdir(), "auto_roster_profiles")
+)
+
+# 專案根目錄，frame 名稱以相對路徑顯示
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 最內層 frame 為這些函式時視為閒置（worker 等待工作、gunicorn 等待連線），預設不計入
+IDLE_FRAMES = {
+    ("threading.py", "wait"),
+    ("selectors.py", "select"),
+    ("sync.py", "wait"),
+    ("queue.py", "get"),
+}
+
+
+class ProfileBusyError(Exception):
+    """此 worker 已有進行中的 profiling"""
+
+
+def frame_label(code, cache):
+    label = cache.get(code)
+    if label is None:
+        path = code.co_filename
+        if path.startswith(PROJECT_ROOT):
+            path = os.path.relpath(path, PROJECT_ROOT)
+        else:
+            # site-packages 等外部套件只保留最後兩層
+            path = "/".join(path.replace("\\", "/").split("/")[-2:])
+        label = cache[code] = f"{path}:{code.co_name}"
+    return label
+
+
+def is_idle(frame):
+    return (
+        os.path.basename(frame.f_code.co_filename),
+        frame.f_code.co_name,
+    ) in IDLE_FRAMES
+
+
+class SamplingProfiler:
+    """
+    以背景 thread 每隔 interval 秒讀取所有 thread 的 stack（sys._current_frames），
+    累計成 collapsed stack：「thread 名稱;外層函式;...;內層函式」-> 取樣次數
+
+    不使用 sys.setprofile，被取樣的 thread 沒有額外負擔；沒有在 profiling 時不會有任何 thread
+    """
+
+    def __init__(self, interval=PROFILE_INTERVAL_MS / 1000, include_idle=False):
+        self.interval = interval
+        self.include_idle = include_idle
+        self.stacks = Counter()
+        self.samples = 0
+        self.started_at = None
+        self.stopped_at = None
+
+        self._exclude = set()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def exclude_thread(self, ident):
+        """不取樣的 thread（例如等待 profiling 結果的請求）"""
+        self._exclude.add(ident)
+
+    def start(self):
+        self.started_at = time.monotonic()
+        self._thread = threading.Thread(
+            target=self._run, name="sampling-profiler", daemon=True
+        )
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join()
+        if self.stopped_at is None:
+            self.stopped_at = time.monotonic()
+
+    @property
+    def seconds(self):
+        if self.started_at is None:
+            return 0.0
+        return (self.stopped_at or time.monotonic()) - self.started_at
+
+    def _run(self):
+        own = threading.get_ident()
+        labels = {}
+
+        while not self._stop.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+
+            for ident, frame in sys._current_frames().items():
+                if ident == own or ident in self._exclude:
+                    continue
+                if not self.include_idle and is_idle(frame):
+                    continue
+
+                stack = []
+                while frame is not None:
+                    stack.append(frame_label(frame.f_code, labels))
+                    frame = frame.f_back
+                stack.append(names.get(ident, f"thread-{ident}"))
+                self.stacks[";".join(reversed(stack))] += 1
+
+            self.samples += 1
+            self._stop.wait(self.interval)
+
+    def collapsed(self):
+        """flamegraph.pl / speedscope 可直接讀取的 collapsed stack"""
+        return "".join(
+            f"{stack} {count}\n" for stack, count in sorted(self.stacks.items())
+        )
+
+    def top(self, limit=30):
+        """
+        依 self（函式本身在最內層）取樣數排序的函式列表
+        total 為函式出現在 stack 中的取樣數（同一個 stack 只算一次）
+        """
+        self_counts = Counter()
+        total_counts = Counter()
+        stack_samples = 0
+
+        for stack, count in self.stacks.items():
+            frames = stack.split(";")[1:]
+            if not frames:
+                continue
+            stack_samples += count
+            self_counts[frames[-1]] += count
+            for function in set(frames):
+                total_counts[function] += count
+
+        functions = sorted(
+            total_counts, key=lambda f: (self_counts[f], total_counts[f]), reverse=True
+        )
+        return [
+            {
+                "function": function,
+                "self": self_counts[function],
+                "total": total_counts[function],
+                "self_pct": round(100 * self_counts[function] / stack_samples, 1),
+                "total_pct": round(100 * total_counts[function] / stack_samples, 1),
+            }
+            for function in functions[:limit]
+        ]
+
+    def result(self, **extra):
+        result = {
+            "seconds": round(self.seconds, 3),
+            "interval_ms": self.interval * 1000,
+            "samples": self.samples,
+            "top": self.top(),
+            "collapsed": self.collapsed(),
+        }
+        result.update(extra)
+        return result
+
+
+def format_top(result):
+    """top list 的純文字表格"""
+    lines = [
+        f"{result.get('mode', '')} {result['seconds']}s，"
+        f"{result['samples']} 次取樣（每 {result['interval_ms']:g} ms）",
+        f"{'self%':>7}{'total%':>8}{'self':>7}{'total':>7}  function",
+    ]
+    for row in result["top"]:
+        lines.append(
+            f"{row['self_pct']:>7}{row['total_pct']:>8}{row['self']:>7}"
+            f"{row['total']:>7}  {row['function']}"
+        )
+    return "\n".join(lines) + "\n"
+
+
+class ProfilerController:
+    """
+    每個 worker 一份，同時只允許一個 profiling
+
+    - run_for(seconds)：立即 profiling 這個 worker seconds 秒並回傳結果
+    - arm(requests)：接下來 requests 個被追蹤的請求（/callback）進來時開始取樣，
+      這些請求結束、且 is_idle()（例如背景 queue 已處理完它們放入的工作）後停止，
+      結果以 latest() 取得；最長 max_seconds 秒
+    - 結果寫到 folder，latest() 回傳所有 worker 中最近一次的結果
+
+    未啟用時，請求只會讀一次 armed 屬性
+    """
+
+    def __init__(
+        self, max_seconds=PROFILE_MAX_SECONDS, is_idle=None, folder=PROFILE_FOLDER
+    ):
+        self.max_seconds = max_seconds
+        self.is_idle = is_idle
+        self.folder = folder
+
+        # 請求進來時檢查的旗標；只有 arm 之後才為 True
+        self.armed = False
+
+        self._lock = threading.Lock()
+        self._profiler = None
+        self._options = None
+
+    def run_for(self, seconds, interval=None, include_idle=False):
+        seconds = min(float(seconds), self.max_seconds)
+        profiler = self._claim(interval, include_idle)
+        profiler.exclude_thread(threading.get_ident())
+
+        try:
+            profiler.start()
+            time.sleep(seconds)
+        finally:
+            profiler.stop()
+            with self._lock:
+                self._profiler = None
+
+        result = profiler.result(mode="seconds", pid=os.getpid())
+        self._save(result)
+        return result
+
+    def arm(self, requests, interval=None, include_idle=False):
+        requests = max(1, min(int(requests), PROFILE_MAX_REQUESTS))
+        profiler = self._claim(interval, include_idle)
+
+        with self._lock:
+            self._options = {
+                "requests": requests,
+                "started": 0,
+                "finished": 0,
+                "armed_at": time.time(),
+            }
+            self.armed = True
+        logger.info(f"profiling 接下來 {requests} 個請求")
+        return profiler
+
+    def request_started(self):
+        """被追蹤的請求開始；回傳這個請求是否列入 profiling"""
+        with self._lock:
+            options = self._options
+            if not self.armed or options is None:
+                return False
+            if options["started"] >= options["requests"]:
+                return False
+
+            options["started"] += 1
+            if options["started"] == 1:
+                self._profiler.start()
+                threading.Thread(
+                    target=self._watch, name="profile-watcher", daemon=True
+                ).start()
+            if options["started"] >= options["requests"]:
+                self.armed = False
+            return True
+
+    def request_finished(self):
+        with self._lock:
+            if self._options is not None:
+                self._options["finished"] += 1
+
+    def status(self):
+        with self._lock:
+            return {
+                "armed": self.armed,
+                "running": self._profiler is not None,
+                "requests": dict(self._options) if self._options else None,
+            }
+
+    def latest(self):
+        """所有 worker 中最近一次完成的結果，沒有時回傳 None"""
+        try:
+            paths = [
+                os.path.join(self.folder, name)
+                for name in os.listdir(self.folder)
+                if name.startswith("profile-") and name.endswith(".json")
+            ]
+            if not paths:
+                return None
+            with open(max(paths, key=os.path.getmtime), encoding="utf-8") as file:
+                return json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取 profiling 結果失敗: {e}")
+            return None
+
+    def _save(self, result):
+        path = os.path.join(self.folder, f"profile-{os.getpid()}.json")
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            with open(f"{path}.tmp", "w", encoding="utf-8") as file:
+                json.dump(result, file, ensure_ascii=False)
+            os.replace(f"{path}.tmp", path)
+        except OSError as e:
+            logger.warning(f"寫入 profiling 結果失敗: {e}")
+
+    def _claim(self, interval, include_idle):
+        with self._lock:
+            if self._profiler is not None:
+                # 已 arm 但還沒有請求進來時，可以直接取代
+                if not (self.armed and self._options["started"] == 0):
+                    raise ProfileBusyError("此 worker 已有進行中的 profiling")
+                self.armed = False
+                self._options = None
+            self._profiler = SamplingProfiler(
+                interval=(interval or PROFILE_INTERVAL_MS) / 1000,
+                include_idle=include_idle,
+            )
+            return self._profiler
+
+    def _watch(self):
+        """等待請求結束（以及背景工作處理完）後停止取樣"""
+        profiler = self._profiler
+        profiler.exclude_thread(threading.get_ident())
+        deadline = time.monotonic() + self.max_seconds
+
+        while time.monotonic() < deadline:
+            with self._lock:
+                options = self._options
+                done = options["finished"] >= options["requests"]
+            if done and (self.is_idle is None or self.is_idle()):
+                break
+            time.sleep(0.05)
+
+        profiler.stop()
+        with self._lock:
+            result = profiler.result(
+                mode="requests", requests=dict(self._options), pid=os.getpid()
+            )
+            self._profiler = None
+            self._options = None
+            self.armed = False
+        self._save(result)
+        logger.info(f"profiling 完成：{result['samples']} 次取樣")
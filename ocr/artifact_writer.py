@@ -0,0 +1,284 @@
+import os
+import re
+import gzip
+import json
+import time
+import queue
+import hashlib
+import tempfile
+import threading
+
+import numpy as np
+
+from monitoring.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 獲取當前檔案的絕對路徑
+current_file_path = os.path.abspath(__file__)
+
+# 獲取當前檔案所在的目錄
+current_directory = os.path.dirname(current_file_path)
+
+# 是否記錄每張班表的 OCR 版面（gzip 壓縮的 JSON），用來追查解析錯誤的班表
+OCR_ARTIFACTS = os.getenv("OCR_ARTIFACTS", "1") == "1"
+
+# 是否另外輸出畫上 word 框的除錯圖（需保留圖片 bytes 到寫入為止，預設關閉）
+OCR_ARTIFACT_OVERLAY = os.getenv("OCR_ARTIFACT_OVERLAY", "0") == "1"
+
+OCR_ARTIFACT_FOLDER = os.getenv(
+    "OCR_ARTIFACT_FOLDER", f"{current_directory}/ocr_artifacts"
+)
+
+# 背景 queue 上限；滿了就丟棄，不讓 OCR 工作等待磁碟
+OCR_ARTIFACT_QUEUE_SIZE = int(os.getenv("OCR_ARTIFACT_QUEUE_SIZE", "32"))
+
+# 每位使用者最多保留幾份，以及總大小上限（超過時由最舊的開始刪除）
+OCR_ARTIFACT_MAX_PER_USER = int(os.getenv("OCR_ARTIFACT_MAX_PER_USER", "20"))
+OCR_ARTIFACT_MAX_USER_BYTES = int(
+    os.getenv("OCR_ARTIFACT_MAX_USER_BYTES", str(20 * 1024 * 1024))
+)
+
+# 除錯圖寬度超過此值時縮小，JPEG 品質
+OCR_ARTIFACT_OVERLAY_WIDTH = int(os.getenv("OCR_ARTIFACT_OVERLAY_WIDTH", "1080"))
+OCR_ARTIFACT_JPEG_QUALITY = int(os.getenv("OCR_ARTIFACT_JPEG_QUALITY", "80"))
+
+LAYOUT_SUFFIX = ".layout.json.gz"
+OVERLAY_SUFFIX = ".overlay.jpg"
+
+
+def render_overlay(
+    image_bytes,
+    sorted_lines_dict,
+    max_width=OCR_ARTIFACT_OVERLAY_WIDTH,
+    quality=OCR_ARTIFACT_JPEG_QUALITY,
+):
+    """
+    在記憶體中的圖片上畫出所有 word 的框，回傳 JPEG bytes；圖片無法解碼時回傳 None
+
+    所有框先組成 (N, 4, 2) 陣列，以一次 cv2.polylines 畫完
+    """
+    import cv2
+
+    img = cv2.imdecode(np.frombuffer(image_bytes, dtype=np.uint8), cv2.IMREAD_COLOR)
+    if img is None:
+        return None
+
+    boxes = np.array(
+        [w["vertices"] for words in sorted_lines_dict.values() for w in words],
+        dtype=np.float32,
+    ).reshape(-1, 4, 2)
+
+    scale = max_width / img.shape[1]
+    if scale < 1.0:
+        img = cv2.resize(img, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+        boxes *= scale
+
+    if len(boxes):
+        cv2.polylines(img, np.rint(boxes).astype(np.int32), True, (0, 255, 0), 1)
+
+    ok, encoded = cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])
+    return encoded.tobytes() if ok else None
+
+
+def load_artifact(path):
+    """讀取版面檔，layout 轉回 get_sorted_context 使用的 int y 座標，可直接重新解析"""
+    with gzip.open(path, "rt", encoding="utf-8") as file:
+        record = json.load(file)
+    record["layout"] = {int(y): words for y, words in record["layout"].items()}
+    return record
+
+
+class ArtifactWriter:
+    """
+    OCR 版面 / 除錯圖的背景寫入
+
+    submit 只把資料放進有上限的 queue（queue 滿了就丟棄並計數，不會阻塞），
+    由背景 thread 壓縮、畫圖、寫檔，並依每位使用者的份數與大小上限刪除最舊的檔案
+
+    每位使用者一個資料夾，每份為 <時間>-<id>.layout.json.gz（與 .overlay.jpg）
+    """
+
+    def __init__(
+        self,
+        folder=OCR_ARTIFACT_FOLDER,
+        queue_size=OCR_ARTIFACT_QUEUE_SIZE,
+        max_per_user=OCR_ARTIFACT_MAX_PER_USER,
+        max_user_bytes=OCR_ARTIFACT_MAX_USER_BYTES,
+        enabled=OCR_ARTIFACTS,
+        overlay=OCR_ARTIFACT_OVERLAY,
+    ):
+        self.folder = folder
+        self.queue_size = queue_size
+        self.max_per_user = max_per_user
+        self.max_user_bytes = max_user_bytes
+        self.enabled = enabled
+        self.overlay = overlay
+
+        self._lock = threading.Lock()
+        self._queue = None
+        self._worker_pid = None
+        self._sequence = 0
+
+        self._stats = {
+            "submitted": 0,
+            "written": 0,
+            "dropped": 0,
+            "failed": 0,
+            "evicted": 0,
+            "bytes_written": 0,
+        }
+
+    def submit(self, user_id, sorted_lines_dict, image_bytes=None, meta=None):
+        """
+        放入背景 queue，回傳是否有放入
+
+        image_bytes 只在開啟 overlay 時保留；傳入的 bytes / memoryview 在寫入前不可被修改
+        """
+        if not self.enabled or not sorted_lines_dict:
+            return False
+
+        item = (
+            user_id,
+            time.time(),
+            sorted_lines_dict,
+            image_bytes if self.overlay else None,
+            meta or {},
+        )
+
+        with self._lock:
+            work_queue = self._ensure_worker_locked()
+            try:
+                work_queue.put_nowait(item)
+            except queue.Full:
+                self._stats["dropped"] += 1
+                return False
+            self._stats["submitted"] += 1
+            return True
+
+    def depth(self):
+        with self._lock:
+            return self._queue.qsize() if self._queue is not None else 0
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["queue_depth"] = self._queue.qsize() if self._queue is not None else 0
+        return stats
+
+    def _ensure_worker_locked(self):
+        # fork 之後父 process 的 thread 不存在，queue 的 lock 也可能停在被持有的狀態
+        if self._worker_pid != os.getpid():
+            self._queue = queue.Queue(maxsize=self.queue_size)
+            self._worker_pid = os.getpid()
+            threading.Thread(
+                target=self._run,
+                args=(self._queue,),
+                name="artifact-writer",
+                daemon=True,
+            ).start()
+        return self._queue
+
+    def _run(self, work_queue):
+        while True:
+            item = work_queue.get()
+            try:
+                self._write(*item)
+            except Exception as e:
+                logger.warning(f"寫入 OCR 紀錄失敗: {e}")
+                with self._lock:
+                    self._stats["failed"] += 1
+            finally:
+                work_queue.task_done()
+
+    def _write(self, user_id, created_at, sorted_lines_dict, image_bytes, meta):
+        folder = self._user_folder(user_id)
+        with self._lock:
+            self._sequence = (self._sequence + 1) % 10000
+            sequence = self._sequence
+        name = (
+            time.strftime("%Y%m%d-%H%M%S", time.localtime(created_at))
+            + f"-{os.getpid()}-{sequence:04d}"
+        )
+
+        record = {
+            "user_id": user_id,
+            "created_at": created_at,
+            "meta": meta,
+            "layout": sorted_lines_dict,
+        }
+        data = gzip.compress(
+            json.dumps(record, ensure_ascii=False, default=str).encode("utf-8"),
+            compresslevel=6,
+        )
+
+        os.makedirs(folder, exist_ok=True)
+        written = self._write_file(folder, name + LAYOUT_SUFFIX, data)
+
+        if image_bytes is not None:
+            overlay = render_overlay(image_bytes, sorted_lines_dict)
+            if overlay is not None:
+                written += self._write_file(folder, name + OVERLAY_SUFFIX, overlay)
+
+        with self._lock:
+            self._stats["written"] += 1
+            self._stats["bytes_written"] += written
+
+        self._enforce_retention(folder)
+
+    def _write_file(self, folder, file_name, data):
+        # 先寫暫存檔再 rename，避免讀到寫一半的檔案
+        fd, tmp_path = tempfile.mkstemp(dir=folder, suffix=".tmp")
+        with os.fdopen(fd, "wb") as file:
+            file.write(data)
+        os.replace(tmp_path, os.path.join(folder, file_name))
+        return len(data)
+
+    def _user_folder(self, user_id):
+        # LINE user id 只有英數字；其他字元（或沒有 user id）改用 hash，避免路徑跳脫
+        user_id = str(user_id or "anonymous")
+        if not re.fullmatch(r"[A-Za-z0-9_-]{1,64}", user_id):
+            user_id = hashlib.sha256(user_id.encode("utf-8")).hexdigest()[:32]
+        return os.path.join(self.folder, user_id)
+
+    def _enforce_retention(self, folder):
+        # 版面檔與除錯圖以相同名稱為一份，依份數與總大小由最舊的開始刪除
+        artifacts = {}
+        for entry in os.scandir(folder):
+            if entry.name.endswith(".tmp"):
+                continue
+            try:
+                size = entry.stat().st_size
+            except FileNotFoundError:
+                continue
+            name = entry.name.split(".", 1)[0]
+            artifacts.setdefault(name, []).append((entry.path, size))
+
+        names = sorted(artifacts)
+        total = sum(size for files in artifacts.values() for _, size in files)
+        evicted = 0
+
+        for name in names:
+            if (
+                len(names) - evicted <= self.max_per_user
+                and total <= self.max_user_bytes
+            ):
+                break
+            # 最新的一份即使超過大小上限也保留
+            if len(names) - evicted == 1:
+                break
+            for path, size in artifacts[name]:
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+                total -= size
+            evicted += 1
+
+        if evicted:
+            with self._lock:
+                self._stats["evicted"] += evicted
+
+
+# 每個 worker process 一份，背景 thread 在第一次 submit 時啟動
+artifact_writer = ArtifactWriter()
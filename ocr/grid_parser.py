@@ -0,0 +1,319 @@
+import re
+import datetime
+
+import numpy as np
+
+from ocr.shift_table import normalize_token
+
+# 班表 App 每頁顯示 6 週、每週 7 天的格子
+GRID_WEEKS = 6
+GRID_COLUMNS = 7
+
+# 一列至少要有幾個日期數字才視為格子的一列（OCR 偶爾會漏掉幾個）
+MIN_ROW_NUMBERS = 4
+
+# 格子信心值：日期數字辨識錯誤、沒辨識到，或同一格有多個班別時降低
+CONFIDENCE_DAY_MISMATCH = 0.5
+CONFIDENCE_DAY_MISSING = 0.85
+CONFIDENCE_AMBIGUOUS = 0.7
+
+# 低於此信心值的日期會在 LINE 訊息中請使用者確認
+LOW_CONFIDENCE = 0.75
+
+DAY_NUMBER_PATTERN = re.compile(r"^\d{1,2}$")
+
+ANCHOR_KEYWORD = "剩餘年假"
+WEEKDAY_KEYWORD = "週"
+
+
+class GridParseError(ValueError):
+    """版面中找不到班表格子"""
+
+
+class GridParseResult:
+    """
+    依座標解析班表格子的結果
+
+    shifts: {date_key: 班別代碼}
+    confidence: {date_key: 0~1 的信心值}
+    unknown_dates: 第一天與最後一天之間、格子中沒有辨識到班別的日期
+    """
+
+    def __init__(self, start_date, shifts, confidence):
+        self.start_date = start_date
+        self.shifts = shifts
+        self.confidence = confidence
+
+        self.unknown_dates = []
+        if shifts:
+            sorted_dates = sorted(shifts)
+            current = datetime.date.fromisoformat(sorted_dates[0])
+            last = datetime.date.fromisoformat(sorted_dates[-1])
+            while current <= last:
+                if current.isoformat() not in shifts:
+                    self.unknown_dates.append(current.isoformat())
+                current += datetime.timedelta(days=1)
+
+    @property
+    def mean_confidence(self):
+        if not self.confidence:
+            return 0.0
+        return float(np.mean(list(self.confidence.values())))
+
+    def low_confidence_dates(self, threshold=LOW_CONFIDENCE):
+        return sorted(
+            date_key
+            for date_key, confidence in self.confidence.items()
+            if confidence < threshold
+        )
+
+
+def flatten_layout(sorted_lines_dict):
+    """
+    把 sorted_lines_dict 攤平成 word 陣列
+
+    回傳 (words, line_ids, bounds)：bounds 為 (N, 4) 的 [left, top, right, bottom]
+    （Vision 偶爾回傳順序顛倒的頂點，因此取最小 / 最大值）
+    """
+    words = []
+    line_ids = []
+    for line_id, y in enumerate(sorted(sorted_lines_dict.keys())):
+        for word in sorted_lines_dict[y]:
+            words.append(word)
+            line_ids.append(line_id)
+
+    if not words:
+        return words, np.zeros(0, dtype=np.int64), np.zeros((0, 4))
+
+    vertices = np.array([word["vertices"] for word in words], dtype=np.float64)
+    bounds = np.stack(
+        [
+            vertices[:, :, 0].min(axis=1),
+            vertices[:, :, 1].min(axis=1),
+            vertices[:, :, 0].max(axis=1),
+            vertices[:, :, 1].max(axis=1),
+        ],
+        axis=1,
+    )
+    return words, np.array(line_ids, dtype=np.int64), bounds
+
+
+def split_by_gaps(values, gap):
+    """把排序後相鄰差距超過 gap 的位置切開，回傳每群在排序後的 (start, end)"""
+    if len(values) == 0:
+        return []
+    breaks = np.nonzero(np.diff(values) > gap)[0] + 1
+    edges = np.concatenate(([0], breaks, [len(values)]))
+    return list(zip(edges[:-1].tolist(), edges[1:].tolist()))
+
+
+def find_anchor_bottom(words, line_ids, bounds):
+    """「剩餘年假」那一行的下緣；格子在它下面。找不到時回傳 -inf"""
+    line_texts = {}
+    for word, line_id in zip(words, line_ids.tolist()):
+        line_texts[line_id] = line_texts.get(line_id, "") + word["text"]
+
+    for line_id, text in line_texts.items():
+        if ANCHOR_KEYWORD in text.replace(" ", ""):
+            return float(bounds[line_ids == line_id, 3].max())
+
+    return float("-inf")
+
+
+def find_header_top(words, line_ids, bounds, below):
+    """星期標題列（週一 ~ 週日）的上緣；找不到時回傳 None"""
+    is_weekday = np.array([WEEKDAY_KEYWORD in word["text"] for word in words])
+    is_weekday &= bounds[:, 1] > below
+    if not is_weekday.any():
+        return None
+
+    # 出現最多「週」的那一行
+    header_lines, counts = np.unique(line_ids[is_weekday], return_counts=True)
+    if counts.max() < 3:
+        return None
+    header_line = header_lines[np.argmax(counts)]
+    return float(bounds[line_ids == header_line, 1].min())
+
+
+def find_shift_tokens(words, line_ids, bounds, shift_table):
+    """
+    逐行以班別 lexer 找出班別（別名可能橫跨多個 word，例如 "11F BC"）
+
+    回傳 (codes, token_bounds)
+    """
+    codes = []
+    token_bounds = []
+
+    order = np.argsort(line_ids, kind="stable")
+    for start, end in split_by_gaps(line_ids[order], 0):
+        indices = order[start:end]
+
+        # 以空白接起整行，記錄每個 word 在字串中的起點
+        offsets = []
+        parts = []
+        position = 0
+        for index in indices.tolist():
+            offsets.append(position)
+            parts.append(words[index]["text"])
+            position += len(words[index]["text"]) + 1
+        offsets = np.array(offsets)
+        line = " ".join(parts)
+
+        for match in shift_table.lexer.finditer(line):
+            first = np.searchsorted(offsets, match.start(), side="right") - 1
+            last = np.searchsorted(offsets, match.end() - 1, side="right") - 1
+            covered = bounds[indices[first : last + 1]]
+            codes.append(shift_table.aliases[normalize_token(match.group())])
+            token_bounds.append(
+                [
+                    covered[:, 0].min(),
+                    covered[:, 1].min(),
+                    covered[:, 2].max(),
+                    covered[:, 3].max(),
+                ]
+            )
+
+    return codes, np.array(token_bounds, dtype=np.float64).reshape(-1, 4)
+
+
+def parse_roster_grid(sorted_lines_dict, grid_start_date, shift_table):
+    """
+    依 word 座標解析班表格子
+
+    1. 「剩餘年假」下方、1~31 的數字是各格的日期；依 y 分列、依左緣 x 分成 7 欄
+    2. 以星期標題列（或第一列）為第 0 列，列距取各列間距的中位數
+    3. 每個班別放進它所在的格子（左緣、上緣在日期數字附近），同一格多個班別時取最靠近日期的
+    4. 第 r 列第 c 欄的日期 = grid_start_date + 7r + c，並與 OCR 的日期數字比對得出信心值
+
+    找不到格子時 raise GridParseError
+    """
+    words, line_ids, bounds = flatten_layout(sorted_lines_dict)
+    if not words:
+        raise GridParseError("沒有任何文字")
+
+    anchor_bottom = find_anchor_bottom(words, line_ids, bounds)
+
+    # ---- 日期數字 ----
+    values = np.array(
+        [
+            int(word["text"]) if DAY_NUMBER_PATTERN.match(word["text"]) else 0
+            for word in words
+        ]
+    )
+    is_day = (values >= 1) & (values <= 31) & (bounds[:, 1] > anchor_bottom)
+    day_values = values[is_day]
+    day_bounds = bounds[is_day]
+    if len(day_values) < MIN_ROW_NUMBERS * 2:
+        raise GridParseError("日期數字太少")
+
+    heights = day_bounds[:, 3] - day_bounds[:, 1]
+    row_gap = float(np.median(heights))
+
+    # 依上緣 y 分列，只保留數字夠多的列
+    order = np.argsort(day_bounds[:, 1], kind="stable")
+    row_of_day = np.full(len(day_values), -1)
+    row_tops = []
+    for start, end in split_by_gaps(day_bounds[order, 1], row_gap):
+        if end - start >= MIN_ROW_NUMBERS:
+            row_of_day[order[start:end]] = len(row_tops)
+            row_tops.append(float(np.median(day_bounds[order[start:end], 1])))
+    if len(row_tops) < 2:
+        raise GridParseError("找不到班表格子的列")
+
+    in_rows = row_of_day >= 0
+    day_values = day_values[in_rows]
+    day_bounds = day_bounds[in_rows]
+    row_of_day = row_of_day[in_rows]
+
+    # 依左緣 x 分欄
+    lefts = day_bounds[:, 0]
+    order = np.argsort(lefts, kind="stable")
+    column_gap = max(row_gap * 2, float(np.ptp(lefts)) / (GRID_COLUMNS * 2))
+    column_lefts = [
+        float(np.median(lefts[order[start:end]]))
+        for start, end in split_by_gaps(lefts[order], column_gap)
+        if end - start >= 2
+    ]
+    if len(column_lefts) != GRID_COLUMNS:
+        raise GridParseError(f"班表格子應有 7 欄，找到 {len(column_lefts)} 欄")
+    column_lefts = np.array(column_lefts)
+    column_pitch = float(np.median(np.diff(column_lefts)))
+
+    row_pitch = float(np.median(np.diff(row_tops)))
+    header_top = find_header_top(words, line_ids, bounds, anchor_bottom)
+    first_row_top = header_top if header_top is not None else row_tops[0]
+
+    # ---- 各格的日期數字與預期日期 ----
+    cell_dates = [
+        grid_start_date + datetime.timedelta(days=index)
+        for index in range(GRID_WEEKS * GRID_COLUMNS)
+    ]
+    expected_days = np.array([date.day for date in cell_dates]).reshape(
+        GRID_WEEKS, GRID_COLUMNS
+    )
+
+    margin_x = column_pitch * 0.15
+    margin_y = row_pitch * 0.15
+
+    day_rows = np.rint((day_bounds[:, 1] - first_row_top) / row_pitch).astype(int)
+    day_columns = np.searchsorted(column_lefts - margin_x, day_bounds[:, 0], "right")
+    day_columns -= 1
+
+    # 每格的日期數字：0 = 沒辨識到，1 = 相符，-1 = 不符
+    day_check = np.zeros((GRID_WEEKS, GRID_COLUMNS), dtype=int)
+    valid = (
+        (day_rows >= 0)
+        & (day_rows < GRID_WEEKS)
+        & (day_columns >= 0)
+        & (day_columns < GRID_COLUMNS)
+    )
+    for row, column, value in zip(
+        day_rows[valid].tolist(), day_columns[valid].tolist(), day_values[valid]
+    ):
+        if value == expected_days[row, column]:
+            day_check[row, column] = 1
+        elif day_check[row, column] == 0:
+            day_check[row, column] = -1
+
+    # ---- 班別放入格子 ----
+    codes, token_bounds = find_shift_tokens(words, line_ids, bounds, shift_table)
+    shifts = {}
+    confidence = {}
+    if not codes:
+        return GridParseResult(grid_start_date, shifts, confidence)
+
+    keep = token_bounds[:, 1] > anchor_bottom
+    token_rows = np.searchsorted(
+        first_row_top + np.arange(GRID_WEEKS) * row_pitch - margin_y,
+        token_bounds[:, 1],
+        "right",
+    )
+    token_rows -= 1
+    token_centers = (token_bounds[:, 0] + token_bounds[:, 2]) / 2
+    token_columns = np.searchsorted(column_lefts - margin_x, token_centers, "right")
+    token_columns -= 1
+    # 與日期數字的距離（班別在日期下方）
+    token_offsets = token_bounds[:, 1] - (first_row_top + token_rows * row_pitch)
+    keep &= (token_rows >= 0) & (token_rows < GRID_WEEKS) & (token_columns >= 0)
+    keep &= token_offsets < row_pitch
+
+    cells = {}
+    for index in np.nonzero(keep)[0].tolist():
+        cells.setdefault((token_rows[index], token_columns[index]), []).append(index)
+
+    for (row, column), indices in cells.items():
+        best = min(indices, key=lambda index: token_offsets[index])
+        date_key = cell_dates[row * GRID_COLUMNS + column].isoformat()
+
+        score = 1.0
+        if day_check[row, column] == -1:
+            score *= CONFIDENCE_DAY_MISMATCH
+        elif day_check[row, column] == 0:
+            score *= CONFIDENCE_DAY_MISSING
+        if len({codes[index] for index in indices}) > 1:
+            score *= CONFIDENCE_AMBIGUOUS
+
+        shifts[date_key] = codes[best]
+        confidence[date_key] = round(score, 3)
+
+    return GridParseResult(grid_start_date, shifts, confidence)
@@ -0,0 +1,351 @@
+import os
+import json
+import time
+import base64
+import tempfile
+import threading
+
+import numpy as np
+
+from ocr.ocr_cache import OCR_CACHE_FOLDER
+from monitoring.logger import get_logger, SAMPLED
+
+logger = get_logger(__name__)
+
+# 截圖上方狀態列（時間、訊號、電量）所佔的高度比例，計算指紋前先裁掉
+STATUS_BAR_RATIO = float(os.getenv("DUPLICATE_STATUS_BAR_RATIO", "0.05"))
+
+# 指紋大小：裁掉狀態列後縮成 HASH_WIDTH x HASH_HEIGHT，每個像素 1 bit（是否為文字筆畫）
+HASH_WIDTH = 128
+HASH_HEIGHT = 256
+
+# 比對時把指紋切成 HASH_BLOCK x HASH_BLOCK 的區塊，逐區塊計算 Hamming 距離
+# 班表只改一格班別時，差異集中在單一區塊；重新壓縮造成的雜訊則分散在整張圖
+HASH_BLOCK = 16
+
+# 任一區塊相差超過此 bit 數，就不算同一張班表
+# 只用來找出候選：改一格班別（BC / JB / DB）常常只差 1~2 bits，與 JPEG 重新壓縮的雜訊（1~4 bits）
+# 分不開，候選必須再通過 layout_signature 的逐字比對才會沿用
+DUPLICATE_MAX_BLOCK_BITS = int(os.getenv("DUPLICATE_MAX_BLOCK_BITS", "8"))
+
+# 逐字比對：依快取版面中每個字的框，把框內像素縮成 WORD_SIG_WIDTH x WORD_SIG_HEIGHT 的筆畫 bit
+# 每一行另外把整個橫條縮成 LINE_SIG_WIDTH x LINE_SIG_HEIGHT，找出原本空白處新增的文字
+WORD_SIG_WIDTH = 32
+WORD_SIG_HEIGHT = 12
+LINE_SIG_WIDTH = 512
+LINE_SIG_HEIGHT = 8
+
+# 比背景亮度差超過此值的像素才算筆畫（重新壓縮的雜訊遠小於文字與底色的差距）
+INK_CONTRAST = 60
+
+# 任一個字 / 任一行相差超過此 bit 數，就不沿用快取的版面
+# 以 ocr/ocr_result 的版面量測：JPEG 重新壓縮（品質 60~95）單字最多差 14 bits、單行 18 bits；
+# 改一格班別至少差 38 bits，空白處新增一格至少差 37 bits
+DUPLICATE_MAX_WORD_BITS = int(os.getenv("DUPLICATE_MAX_WORD_BITS", "24"))
+DUPLICATE_MAX_LINE_BITS = int(os.getenv("DUPLICATE_MAX_LINE_BITS", "28"))
+
+# 每位使用者保留最近幾張圖片的指紋，以及保留多久
+DUPLICATE_INDEX_PER_USER = int(os.getenv("DUPLICATE_INDEX_PER_USER", "5"))
+DUPLICATE_INDEX_TTL_SECONDS = int(
+    os.getenv("DUPLICATE_INDEX_TTL_SECONDS", str(3 * 24 * 3600))
+)
+
+DUPLICATE_INDEX_FOLDER = os.getenv(
+    "DUPLICATE_INDEX_FOLDER", os.path.join(OCR_CACHE_FOLDER, "fingerprints")
+)
+
+
+def image_fingerprint(image_bytes, status_bar_ratio=STATUS_BAR_RATIO):
+    """
+    計算截圖的感知指紋
+
+    先裁掉上方狀態列，轉灰階並縮成 HASH_WIDTH x HASH_HEIGHT，
+    比周圍區域平均亮度明顯較暗的像素記為 1（文字筆畫），其餘為 0
+    回傳 np.uint8 陣列（np.packbits 後的結果），圖片無法解碼時回傳 None
+    """
+    import cv2
+
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    img = cv2.imdecode(buffer, cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        return None
+
+    return fingerprint_from_gray(img, status_bar_ratio)
+
+
+def fingerprint_from_gray(img, status_bar_ratio=STATUS_BAR_RATIO):
+    """與 image_fingerprint 相同，但直接使用已解碼的灰階圖片，避免重複解碼"""
+    import cv2
+
+    top = int(img.shape[0] * status_bar_ratio)
+    img = img[top:, :]
+
+    resized = cv2.resize(
+        img, (HASH_WIDTH, HASH_HEIGHT), interpolation=cv2.INTER_AREA
+    ).astype(np.int16)
+    # 與局部平均比較，班表格子有底色時也能分辨出文字
+    local_mean = cv2.blur(resized, (9, 9))
+    ink = resized < local_mean - 10
+
+    return np.packbits(ink.reshape(-1))
+
+
+def ink_bits(crop, width, height):
+    """把一塊灰階區域縮成 width x height，比背景明顯較暗（深色模式為較亮）的像素記為 1"""
+    import cv2
+
+    resized = cv2.resize(crop, (width, height), interpolation=cv2.INTER_AREA).astype(
+        np.int16
+    )
+    if np.median(resized) >= 128:
+        ink = resized < np.percentile(resized, 90) - INK_CONTRAST
+    else:
+        ink = resized > np.percentile(resized, 10) + INK_CONTRAST
+
+    return np.packbits(ink.reshape(-1))
+
+
+def layout_signature(img, sorted_lines_dict, status_bar_ratio=STATUS_BAR_RATIO):
+    """
+    依 OCR 版面計算灰階圖片的逐字簽章，用來確認近似重複的候選真的是同一張班表
+
+    回傳 {"shape": (高, 寬), "words": (字數, bytes), "lines": (行數, bytes)}；
+    狀態列內的文字（時間、電量）每次截圖都不同，不列入
+    """
+    height, width = img.shape[:2]
+    top = int(height * status_bar_ratio)
+
+    words, lines = [], []
+    for y in sorted(sorted_lines_dict):
+        boxes = np.array(
+            [w["vertices"] for w in sorted_lines_dict[y]], dtype=np.int64
+        ).reshape(-1, 4, 2)
+        if not len(boxes):
+            continue
+        boxes[..., 0] = boxes[..., 0].clip(0, width - 1)
+        boxes[..., 1] = boxes[..., 1].clip(0, height - 1)
+        if boxes[..., 1].max() < top:
+            continue
+
+        for box in boxes:
+            (x0, y0), (x1, y1) = box.min(axis=0), box.max(axis=0)
+            words.append(
+                ink_bits(img[y0 : y1 + 1, x0 : x1 + 1], WORD_SIG_WIDTH, WORD_SIG_HEIGHT)
+            )
+
+        line_top, line_bottom = boxes[..., 1].min(), boxes[..., 1].max()
+        lines.append(
+            ink_bits(
+                img[line_top : line_bottom + 1, :], LINE_SIG_WIDTH, LINE_SIG_HEIGHT
+            )
+        )
+
+    return {
+        "shape": (height, width),
+        "words": np.array(words, dtype=np.uint8).reshape(
+            -1, WORD_SIG_WIDTH * WORD_SIG_HEIGHT // 8
+        ),
+        "lines": np.array(lines, dtype=np.uint8).reshape(
+            -1, LINE_SIG_WIDTH * LINE_SIG_HEIGHT // 8
+        ),
+    }
+
+
+def signature_distance(a, b):
+    """兩個 layout_signature 在差異最大的字與行上的 bit 數；版面不同時回傳 None"""
+    if (
+        tuple(a["shape"]) != tuple(b["shape"])
+        or a["words"].shape != b["words"].shape
+        or a["lines"].shape != b["lines"].shape
+    ):
+        return None
+
+    def max_bits(x, y):
+        if not len(x):
+            return 0
+        return int(np.unpackbits(np.bitwise_xor(x, y), axis=1).sum(axis=1).max())
+
+    return max_bits(a["words"], b["words"]), max_bits(a["lines"], b["lines"])
+
+
+def block_hamming_distance(fingerprints, fingerprint):
+    """
+    fingerprints 為 (N, bytes) 陣列，一次算出每一列與 fingerprint 在
+    「差異最大的區塊」上的 Hamming 距離
+    """
+    diff = np.unpackbits(np.bitwise_xor(fingerprints, fingerprint), axis=1)
+    diff = diff.reshape(
+        len(fingerprints),
+        HASH_HEIGHT // HASH_BLOCK,
+        HASH_BLOCK,
+        HASH_WIDTH // HASH_BLOCK,
+        HASH_BLOCK,
+    )
+    return diff.sum(axis=(2, 4)).max(axis=(1, 2))
+
+
+def encode_bits(bits):
+    return base64.b64encode(bits.tobytes()).decode("ascii")
+
+
+def decode_bits(encoded, width=None):
+    bits = np.frombuffer(base64.b64decode(encoded), dtype=np.uint8)
+    return bits if width is None else bits.reshape(-1, width)
+
+
+def encode_signature(signature):
+    if signature is None:
+        return None
+    return {
+        "shape": list(signature["shape"]),
+        "words": encode_bits(signature["words"]),
+        "lines": encode_bits(signature["lines"]),
+    }
+
+
+def decode_signature(data):
+    if data is None:
+        return None
+    return {
+        "shape": tuple(data["shape"]),
+        "words": decode_bits(data["words"], WORD_SIG_WIDTH * WORD_SIG_HEIGHT // 8),
+        "lines": decode_bits(data["lines"], LINE_SIG_WIDTH * LINE_SIG_HEIGHT // 8),
+    }
+
+
+class NearDuplicateIndex:
+    """
+    每位使用者最近上傳圖片的指紋索引，用來找出「同一張班表重新截圖」的情況
+
+    每位使用者一個 JSON 檔，記錄 (指紋, OCR 快取 key, 時間, 版面簽章)
+    lookup 找到夠接近的指紋時，回傳對應的 OCR 快取 key 作為候選；
+    呼叫端取出快取的版面後，須以 verify 逐字確認，通過才可沿用
+    """
+
+    def __init__(
+        self,
+        folder=DUPLICATE_INDEX_FOLDER,
+        per_user=DUPLICATE_INDEX_PER_USER,
+        ttl_seconds=DUPLICATE_INDEX_TTL_SECONDS,
+        max_block_bits=DUPLICATE_MAX_BLOCK_BITS,
+        max_word_bits=DUPLICATE_MAX_WORD_BITS,
+        max_line_bits=DUPLICATE_MAX_LINE_BITS,
+    ):
+        self.folder = folder
+        self.per_user = per_user
+        self.ttl_seconds = ttl_seconds
+        self.max_block_bits = max_block_bits
+        self.max_word_bits = max_word_bits
+        self.max_line_bits = max_line_bits
+
+        self._lock = threading.Lock()
+        self._stats = {"lookups": 0, "candidates": 0, "matches": 0, "rejected": 0}
+
+    def lookup(self, user_id, fingerprint):
+        entries = self._load(user_id)
+
+        with self._lock:
+            self._stats["lookups"] += 1
+
+        entries = [entry for entry in entries if len(entry[0]) == len(fingerprint)]
+        if not entries:
+            return None
+
+        distances = block_hamming_distance(
+            np.stack([entry[0] for entry in entries]), fingerprint
+        )
+        best = int(np.argmin(distances))
+
+        if distances[best] > self.max_block_bits:
+            return None
+
+        with self._lock:
+            self._stats["candidates"] += 1
+
+        return entries[best][1]
+
+    def verify(self, user_id, cache_key, img, sorted_lines_dict):
+        """
+        確認 lookup 找到的候選：以候選的版面對新圖片計算 layout_signature，
+        與加入索引時記錄的簽章逐字、逐行比較；沒有簽章或版面對不上時一律不沿用
+        """
+        signature = None
+        for _, key, _, entry_signature in self._load(user_id):
+            if key == cache_key:
+                signature = entry_signature
+
+        distance = None
+        if signature is not None:
+            distance = signature_distance(
+                signature, layout_signature(img, sorted_lines_dict)
+            )
+
+        matched = (
+            distance is not None
+            and distance[0] <= self.max_word_bits
+            and distance[1] <= self.max_line_bits
+        )
+
+        with self._lock:
+            self._stats["matches" if matched else "rejected"] += 1
+
+        if matched:
+            logger.info(
+                f"偵測到重複上傳的班表（單字最大差異 {distance[0]} bits、"
+                f"單行 {distance[1]} bits）",
+                extra=SAMPLED,
+            )
+        else:
+            logger.info(f"近似的班表內容不同，不沿用（差異 {distance}）", extra=SAMPLED)
+        return matched
+
+    def add(self, user_id, fingerprint, cache_key, signature=None):
+        """signature 為 layout_signature 的結果；沒有簽章的項目永遠不會通過 verify"""
+        entries = [entry for entry in self._load(user_id) if entry[1] != cache_key]
+        entries.append((fingerprint, cache_key, time.time(), signature))
+        self._save(user_id, entries[-self.per_user :])
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+    def _path(self, user_id):
+        return os.path.join(self.folder, f"{user_id}.json")
+
+    def _load(self, user_id):
+        try:
+            with open(self._path(user_id), "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except FileNotFoundError:
+            return []
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取指紋索引失敗，忽略: {e}")
+            return []
+
+        now = time.time()
+        return [
+            (
+                decode_bits(encoded),
+                key,
+                created_at,
+                decode_signature(signature[0]) if signature else None,
+            )
+            for encoded, key, created_at, *signature in data
+            if now - created_at <= self.ttl_seconds
+        ]
+
+    def _save(self, user_id, entries):
+        data = [
+            [encode_bits(fingerprint), key, created_at, encode_signature(signature)]
+            for fingerprint, key, created_at, signature in entries
+        ]
+
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            # 先寫暫存檔再 rename，避免其他 worker 讀到寫一半的檔案
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+            with os.fdopen(fd, "w", encoding="utf-8") as file:
+                json.dump(data, file)
+            os.replace(tmp_path, self._path(user_id))
+        except OSError as e:
+            logger.warning(f"寫入指紋索引失敗: {e}")
@@ -0,0 +1,118 @@
+import os
+import time
+import threading
+
+# 允許的圖片大小上限（bytes），預設 10 MB
+IMAGE_MAX_BYTES = int(os.getenv("IMAGE_MAX_BYTES", str(10 * 1024 * 1024)))
+
+# 每次從 LINE 讀取的大小
+IMAGE_CHUNK_SIZE = 64 * 1024
+
+# 判斷圖片格式至少需要的 bytes 數
+SNIFF_BYTES = 12
+
+
+class ImageRejectedError(ValueError):
+    """上傳的內容不是圖片或超過大小上限"""
+
+
+def sniff_image_type(header):
+    """由檔頭判斷圖片格式，回傳 "jpeg" / "png" / "gif" / "webp"，無法辨識時回傳 None"""
+    header = bytes(header[:SNIFF_BYTES])
+
+    if header.startswith(b"\xff\xd8\xff"):
+        return "jpeg"
+    if header.startswith(b"\x89PNG\r\n\x1a\n"):
+        return "png"
+    if header.startswith((b"GIF87a", b"GIF89a")):
+        return "gif"
+    if header.startswith(b"RIFF") and header[8:12] == b"WEBP":
+        return "webp"
+
+    return None
+
+
+class DownloadStats:
+    """累計圖片下載的次數、bytes 與耗時"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._stats = {
+            "downloads": 0,
+            "rejected": 0,
+            "bytes_total": 0,
+            "seconds_total": 0.0,
+            "seconds_max": 0.0,
+        }
+
+    def record(self, size, seconds):
+        with self._lock:
+            self._stats["downloads"] += 1
+            self._stats["bytes_total"] += size
+            self._stats["seconds_total"] += seconds
+            self._stats["seconds_max"] = max(self._stats["seconds_max"], seconds)
+
+    def record_rejected(self):
+        with self._lock:
+            self._stats["rejected"] += 1
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats)
+
+
+download_stats = DownloadStats()
+
+
+def read_image_content(message_content, max_bytes=IMAGE_MAX_BYTES):
+    """
+    從 LINE 的 message content 串流讀取圖片
+
+    - 依 Content-Length 預先配置 buffer，逐塊寫入，不重複串接 bytes
+    - 超過 max_bytes 或檔頭不是圖片時，立即停止下載並丟出 ImageRejectedError
+    回傳 (memoryview, 下載資訊 dict)，memoryview 可直接交給 image_to_text，不需再複製
+    """
+    start_time = time.perf_counter()
+
+    headers = getattr(getattr(message_content, "response", None), "headers", {}) or {}
+    content_length = headers.get("content-length")
+    expected_size = int(content_length) if content_length else None
+
+    if expected_size is not None and expected_size > max_bytes:
+        download_stats.record_rejected()
+        raise ImageRejectedError(
+            f"圖片太大（{expected_size} bytes），上限為 {max_bytes} bytes"
+        )
+
+    buffer = bytearray(expected_size or IMAGE_CHUNK_SIZE)
+    size = 0
+    image_type = None
+
+    for chunk in message_content.iter_content(IMAGE_CHUNK_SIZE):
+        chunk_size = len(chunk)
+        if size + chunk_size > max_bytes:
+            download_stats.record_rejected()
+            raise ImageRejectedError(f"圖片超過大小上限 {max_bytes} bytes")
+
+        if size + chunk_size > len(buffer):
+            # 沒有 Content-Length 或長度不符時，以倍數擴充 buffer
+            buffer.extend(bytes(max(len(buffer), chunk_size)))
+
+        buffer[size : size + chunk_size] = chunk
+        size += chunk_size
+
+        if image_type is None and size >= SNIFF_BYTES:
+            image_type = sniff_image_type(buffer)
+            if image_type is None:
+                download_stats.record_rejected()
+                raise ImageRejectedError("上傳的檔案不是支援的圖片格式")
+
+    if image_type is None:
+        download_stats.record_rejected()
+        raise ImageRejectedError("上傳的檔案不是支援的圖片格式")
+
+    seconds = time.perf_counter() - start_time
+    download_stats.record(size, seconds)
+
+    info = {"bytes": size, "seconds": seconds, "type": image_type}
+    return memoryview(buffer)[:size], info
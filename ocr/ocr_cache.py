@@ -0,0 +1,241 @@
+import os
+import json
+import time
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+from monitoring.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 獲取當前檔案的絕對路徑
+current_file_path = os.path.abspath(__file__)
+
+# 獲取當前檔案所在的目錄
+current_directory = os.path.dirname(current_file_path)
+
+# 使用環境變數可覆寫快取位置（方便掛載 persistent disk）
+OCR_CACHE_FOLDER = os.getenv("OCR_CACHE_FOLDER", f"{current_directory}/ocr_cache")
+
+# 記憶體層最多保留的筆數與總大小
+OCR_CACHE_MEMORY_ITEMS = int(os.getenv("OCR_CACHE_MEMORY_ITEMS", "128"))
+OCR_CACHE_MEMORY_MAX_BYTES = int(
+    os.getenv("OCR_CACHE_MEMORY_MAX_BYTES", str(16 * 1024 * 1024))
+)
+
+# 磁碟層總大小上限
+OCR_CACHE_MAX_BYTES = int(os.getenv("OCR_CACHE_MAX_BYTES", str(200 * 1024 * 1024)))
+
+# 快取有效時間（秒），預設 7 天
+OCR_CACHE_TTL_SECONDS = int(os.getenv("OCR_CACHE_TTL_SECONDS", str(7 * 24 * 3600)))
+
+
+def image_cache_key(image_bytes):
+    """以圖片內容的 sha256 作為快取 key，內容相同的圖片得到相同 key"""
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class OcrResultCache:
+    """
+    OCR 結果快取：key 為圖片 hash，value 為 get_sorted_context 產生的 sorted_lines_dict
+
+    - 記憶體層：LRU，依筆數與大小淘汰
+    - 磁碟層：一筆一個 JSON，格式與 ocr/ocr_result/*.json 相同，依總大小淘汰最舊的檔案
+    - 兩層都以 ttl_seconds 判斷過期
+    """
+
+    def __init__(
+        self,
+        folder=OCR_CACHE_FOLDER,
+        memory_items=OCR_CACHE_MEMORY_ITEMS,
+        memory_max_bytes=OCR_CACHE_MEMORY_MAX_BYTES,
+        max_bytes=OCR_CACHE_MAX_BYTES,
+        ttl_seconds=OCR_CACHE_TTL_SECONDS,
+    ):
+        self.folder = folder
+        self.memory_items = memory_items
+        self.memory_max_bytes = memory_max_bytes
+        self.max_bytes = max_bytes
+        self.ttl_seconds = ttl_seconds
+
+        self._lock = threading.Lock()
+        # key -> (寫入時間, 大小, sorted_lines_dict)
+        self._memory = OrderedDict()
+        self._memory_bytes = 0
+        self._disk_bytes = None
+
+        self._stats = {
+            "memory_hits": 0,
+            "disk_hits": 0,
+            "misses": 0,
+            "expired": 0,
+            "evictions": 0,
+            "puts": 0,
+        }
+
+    def get(self, key):
+        now = time.time()
+
+        with self._lock:
+            item = self._memory.get(key)
+            if item is not None:
+                created_at, size, sorted_lines_dict = item
+                if now - created_at <= self.ttl_seconds:
+                    self._memory.move_to_end(key)
+                    self._stats["memory_hits"] += 1
+                    return sorted_lines_dict
+
+                self._drop_memory_locked(key)
+                self._stats["expired"] += 1
+
+        sorted_lines_dict, created_at, size = self._read_disk(key, now)
+
+        with self._lock:
+            if sorted_lines_dict is None:
+                self._stats["misses"] += 1
+                return None
+
+            self._stats["disk_hits"] += 1
+            self._put_memory_locked(key, created_at, size, sorted_lines_dict)
+
+        return sorted_lines_dict
+
+    def put(self, key, sorted_lines_dict):
+        data = json.dumps(sorted_lines_dict, ensure_ascii=False, indent=2).encode(
+            "utf-8"
+        )
+        now = time.time()
+
+        with self._lock:
+            self._stats["puts"] += 1
+            self._put_memory_locked(key, now, len(data), sorted_lines_dict)
+
+        self._write_disk(key, data)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_items"] = len(self._memory)
+            stats["memory_bytes"] = self._memory_bytes
+            stats["disk_bytes"] = self._disk_bytes
+
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (
+            (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else 0.0
+        )
+        return stats
+
+    # ====== 記憶體層 ======
+    def _put_memory_locked(self, key, created_at, size, sorted_lines_dict):
+        if key in self._memory:
+            self._drop_memory_locked(key)
+
+        if size > self.memory_max_bytes:
+            return
+
+        self._memory[key] = (created_at, size, sorted_lines_dict)
+        self._memory_bytes += size
+
+        while len(self._memory) > self.memory_items or (
+            self._memory_bytes > self.memory_max_bytes
+        ):
+            oldest_key = next(iter(self._memory))
+            self._drop_memory_locked(oldest_key)
+            self._stats["evictions"] += 1
+
+    def _drop_memory_locked(self, key):
+        _, size, _ = self._memory.pop(key)
+        self._memory_bytes -= size
+
+    # ====== 磁碟層 ======
+    def _path(self, key):
+        return os.path.join(self.folder, f"{key}.json")
+
+    def _read_disk(self, key, now):
+        path = self._path(key)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            return None, None, None
+
+        if now - stat.st_mtime > self.ttl_seconds:
+            self._remove_file(path, stat.st_size)
+            with self._lock:
+                self._stats["expired"] += 1
+            return None, None, None
+
+        try:
+            with open(path, "r", encoding="utf-8") as file:
+                data = json.load(file)
+        except (OSError, ValueError) as e:
+            logger.warning(f"讀取 OCR 快取失敗，忽略此筆: {e}")
+            return None, None, None
+
+        # JSON 的 key 只能是字串，轉回 get_sorted_context 使用的 int y 座標
+        sorted_lines_dict = {int(y): words for y, words in data.items()}
+        return sorted_lines_dict, stat.st_mtime, stat.st_size
+
+    def _write_disk(self, key, data):
+        try:
+            os.makedirs(self.folder, exist_ok=True)
+            # 先寫暫存檔再 rename，避免其他 worker 讀到寫一半的檔案
+            fd, tmp_path = tempfile.mkstemp(dir=self.folder, suffix=".tmp")
+            with os.fdopen(fd, "wb") as file:
+                file.write(data)
+            os.replace(tmp_path, self._path(key))
+        except OSError as e:
+            logger.warning(f"寫入 OCR 快取失敗: {e}")
+            return
+
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes += len(data)
+
+        self._evict_disk()
+
+    def _evict_disk(self):
+        with self._lock:
+            disk_bytes = self._disk_bytes
+
+        if disk_bytes is not None and disk_bytes <= self.max_bytes:
+            return
+
+        # 重新掃描資料夾（其他 worker 也可能寫入），由最舊的開始刪除
+        entries = []
+        total = 0
+        now = time.time()
+        for entry in os.scandir(self.folder):
+            if not entry.name.endswith(".json"):
+                continue
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if now - stat.st_mtime > self.ttl_seconds:
+                self._remove_file(entry.path, 0)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+            total += stat.st_size
+
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove_file(path, 0)
+            total -= size
+            with self._lock:
+                self._stats["evictions"] += 1
+
+        with self._lock:
+            self._disk_bytes = total
+
+    def _remove_file(self, path, size):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            return
+        with self._lock:
+            if self._disk_bytes is not None:
+                self._disk_bytes -= size
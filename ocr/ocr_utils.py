@@ -1,8 +1,21 @@
-from google.cloud import vision
 import os
-import cv2
+import bisect
+import importlib
 import numpy as np
 
+from ocr.vision_client import VisionClientManager
+from ocr.ocr_cache import OcrResultCache, image_cache_key
+from ocr.process_text import lines_to_text
+from ocr.image_hash import (
+    NearDuplicateIndex,
+    fingerprint_from_gray,
+    layout_signature,
+)
+from monitoring.logger import get_logger, SAMPLED
+from monitoring.metrics import span
+
+logger = get_logger(__name__)
+
 # 獲取當前檔案的絕對路徑
 current_file_path = os.path.abspath(__file__)
 
@@ -25,112 +38,366 @@ OCR_CREDENTIAL_DICT = {
     "universe_domain": os.getenv("OCR_UNIVERSE_DOMAIN"),
 }
 
+# google.cloud.vision（gRPC）與 cv2 載入很慢，webhook 用不到，第一次處理圖片時才 import
+# gunicorn 啟動後由 warm_up 在背景先載入（見 gunicorn.conf.py）
+
+# 每個 worker process 共用一組 Vision client，避免每張圖片都重建 gRPC channel
+vision_client_manager = VisionClientManager(OCR_CREDENTIAL_DICT)
+
+# 相同圖片重複上傳時，直接使用快取的 OCR 結果，不再呼叫 Vision
+ocr_cache = OcrResultCache()
+
+# 同一張班表重新截圖（只差狀態列時間、訊號）時，沿用先前的 OCR 版面
+duplicate_index = NearDuplicateIndex()
+
+# ====== 送 Vision 前的影像前處理 ======
+# 裁掉狀態列與四周空白、轉灰階、縮小到 target_width 後重新編碼，減少上傳量與 Vision 延遲
+OCR_PREPROCESS = os.getenv("OCR_PREPROCESS", "1") == "1"
+
+OCR_PREPROCESS_CONFIG = {
+    # 上方狀態列、下方導覽列 / 廣告所佔的高度比例
+    "crop_top_ratio": float(os.getenv("OCR_CROP_TOP_RATIO", "0.04")),
+    "crop_bottom_ratio": float(os.getenv("OCR_CROP_BOTTOM_RATIO", "0")),
+    # 去掉四周顏色一致的邊界，只留下班表內容
+    "trim_margin": os.getenv("OCR_TRIM_MARGIN", "1") == "1",
+    "grayscale": os.getenv("OCR_GRAYSCALE", "1") == "1",
+    # 寬度超過此值才縮小（不放大）
+    "target_width": int(os.getenv("OCR_TARGET_WIDTH", "1080")),
+    # jpg 或 png；LINE 傳來的圖片已是 JPEG，重新存成 png 反而會變大
+    "encode_format": os.getenv("OCR_ENCODE_FORMAT", "jpg"),
+    "jpeg_quality": int(os.getenv("OCR_JPEG_QUALITY", "90")),
+}
+
+
+def warm_up():
+    """
+    先載入 OCR 用到的模組並建立 Vision client，第一張圖片不必等待
+    需在 fork 之後執行（gRPC channel 不能跨 fork 沿用）；沒有設定金鑰時只載入模組
+    """
+    # 只為了載入模組，不使用回傳值
+    importlib.import_module("cv2")
+    importlib.import_module("google.cloud.vision")
+
+    if OCR_CREDENTIAL_DICT["private_key"]:
+        vision_client_manager.get_client()
 
-def image_to_text(image_bytes: bytes):
+
+def image_to_text(image_bytes: bytes, user_id=None):
     """Detects text in the given image bytes.
 
-    `image_bytes` must be raw bytes (bytes or bytearray). Provide an optional
-    `filename` to use when saving the OCR JSON (defaults to a timestamp-based name).
+    `image_bytes` must be raw bytes (bytes, bytearray or memoryview). Provide an
+    optional `user_id` to reuse the OCR layout of that user's near-duplicate uploads.
     """
+    return lines_to_text(image_to_lines(image_bytes, user_id=user_id))
+
 
-    if not isinstance(image_bytes, (bytes, bytearray)):
-        raise TypeError("image_to_text requires image bytes (bytes or bytearray)")
+def image_to_lines(image_bytes: bytes, user_id=None):
+    """Detects text in the given image bytes and returns the word layout.
+
+    Returns `sorted_lines_dict` ({line y: [{"text", "x", "y", "vertices"}, ...]}),
+    the same layout `get_sorted_context` builds and the OCR cache stores.
+    """
+
+    if not isinstance(image_bytes, (bytes, bytearray, memoryview)):
+        raise TypeError(
+            "image_to_text requires image bytes (bytes, bytearray or memoryview)"
+        )
+
+    cache_key = image_cache_key(image_bytes)
+    sorted_lines_dict = ocr_cache.get(cache_key)
+    if sorted_lines_dict is not None:
+        logger.info("使用快取的 OCR 結果", extra=SAMPLED)
+        return sorted_lines_dict
+
+    # 指紋與前處理共用同一次解碼
+    gray_image = None
+    if user_id is not None or (OCR_PREPROCESS and OCR_PREPROCESS_CONFIG["grayscale"]):
+        gray_image = decode_image(image_bytes, grayscale=True)
+
+    fingerprint = None
+    if user_id is not None and gray_image is not None:
+        try:
+            fingerprint = fingerprint_from_gray(gray_image)
+        except Exception as e:
+            logger.warning(f"計算圖片指紋失敗: {e}")
+
+    if fingerprint is not None:
+        duplicate_key = duplicate_index.lookup(user_id, fingerprint)
+        if duplicate_key is not None:
+            # 指紋相近只是候選，改過一格班別的班表也可能落在門檻內，須逐字確認
+            sorted_lines_dict = ocr_cache.get(duplicate_key)
+            if sorted_lines_dict is not None and duplicate_index.verify(
+                user_id, duplicate_key, gray_image, sorted_lines_dict
+            ):
+                ocr_cache.put(cache_key, sorted_lines_dict)
+                return sorted_lines_dict
 
     # client = vision.ImageAnnotatorClient.from_service_account_json(KEY_PATH)
     try:
-        client = vision.ImageAnnotatorClient.from_service_account_info(
-            OCR_CREDENTIAL_DICT
-        )
+        vision_client_manager.get_client()
     except Exception as e:
         raise Exception(f"無法建立 Google Vision 客戶端: {e}")
 
-    content = bytes(image_bytes)
+    content, transform = None, None
+    if OCR_PREPROCESS:
+        try:
+            with span("preprocess"):
+                content, transform = preprocess_image(
+                    image_bytes,
+                    image=gray_image if OCR_PREPROCESS_CONFIG["grayscale"] else None,
+                )
+        except Exception as e:
+            logger.warning(f"影像前處理失敗，改用原始圖片: {e}")
+            content, transform = None, None
+
+    if content is None:
+        # protobuf 的 bytes 欄位只接受 bytes，這是整個流程中唯一一次複製圖片
+        content = bytes(image_bytes)
+
+    from google.cloud import vision
 
     image = vision.Image(content=content)
 
-    response = client.document_text_detection(image=image)
+    with span("vision_call"):
+        response = vision_client_manager.document_text_detection(image)
 
-    # plot_predict_result(response, image_file_path)
+    if getattr(response, "error", None) and getattr(response.error, "message", None):
+        raise Exception(
+            "{}\nFor more info on error messages, check: "
+            "https://cloud.google.com/apis/design/errors".format(response.error.message)
+        )
 
-    sorted_lines_dict, sorted_text = get_sorted_context(response)
+    # 座標換算回原始圖片，快取與除錯圖都以原始圖片為準
+    with span("layout_sort"):
+        sorted_lines_dict, _ = get_sorted_context(response, transform)
 
-    # plot_sorted_result(sorted_lines_dict, image_file_path)
+    # 版面與除錯圖由 ocr.artifact_writer 在背景記錄（plot_* 會同步讀寫磁碟，只供本機使用）
 
     if sorted_lines_dict == {}:
 
-        print("沒有偵測到文字")
+        logger.info("沒有偵測到文字")
 
-    if getattr(response, "error", None) and getattr(response.error, "message", None):
-        raise Exception(
-            "{}\nFor more info on error messages, check: "
-            "https://cloud.google.com/apis/design/errors".format(response.error.message)
+    else:
+        ocr_cache.put(cache_key, sorted_lines_dict)
+        if fingerprint is not None:
+            try:
+                signature = layout_signature(gray_image, sorted_lines_dict)
+            except Exception as e:
+                logger.warning(f"計算版面簽章失敗: {e}")
+                signature = None
+            duplicate_index.add(user_id, fingerprint, cache_key, signature)
+
+    return sorted_lines_dict
+
+
+def decode_image(image_bytes, grayscale=True):
+    """從記憶體解碼圖片，無法解碼時回傳 None"""
+    import cv2
+
+    buffer = np.frombuffer(image_bytes, dtype=np.uint8)
+    flag = cv2.IMREAD_GRAYSCALE if grayscale else cv2.IMREAD_COLOR
+    return cv2.imdecode(buffer, flag)
+
+
+def find_content_region(gray, threshold=8, padding=8):
+    """
+    找出去掉四周空白後的內容範圍
+
+    整列（或整欄）最亮與最暗的差距小於 threshold 視為空白
+    回傳 (top, bottom, left, right)，找不到內容時回傳整張圖片
+    """
+    height, width = gray.shape[:2]
+    rows = np.nonzero(np.ptp(gray, axis=1) > threshold)[0]
+    cols = np.nonzero(np.ptp(gray, axis=0) > threshold)[0]
+    if len(rows) == 0 or len(cols) == 0:
+        return 0, height, 0, width
+
+    top = max(0, int(rows[0]) - padding)
+    bottom = min(height, int(rows[-1]) + 1 + padding)
+    left = max(0, int(cols[0]) - padding)
+    right = min(width, int(cols[-1]) + 1 + padding)
+    return top, bottom, left, right
+
+
+def preprocess_image(image_bytes, config=OCR_PREPROCESS_CONFIG, image=None):
+    """
+    送 Vision 前的影像前處理：裁切 → 灰階 → 縮小 → 重新編碼
+
+    image 可傳入已解碼的圖片，避免重複解碼
+    回傳 (處理後的圖片 bytes, transform)，transform = (offset_x, offset_y, scale)
+    原始座標 = 處理後座標 / scale + offset；無法解碼時回傳 (None, None)
+    """
+    import cv2
+
+    if image is None:
+        image = decode_image(image_bytes, grayscale=config["grayscale"])
+    if image is None:
+        return None, None
+
+    height = image.shape[0]
+    top = int(height * config["crop_top_ratio"])
+    bottom = height - int(height * config["crop_bottom_ratio"])
+    image = image[top:bottom]
+    offset_x, offset_y = 0, top
+
+    if config["trim_margin"]:
+        gray = image if image.ndim == 2 else cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        region_top, region_bottom, region_left, region_right = find_content_region(gray)
+        image = image[region_top:region_bottom, region_left:region_right]
+        offset_x += region_left
+        offset_y += region_top
+
+    if config["grayscale"] and image.ndim == 3:
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+
+    scale = min(1.0, config["target_width"] / image.shape[1])
+    if scale < 1.0:
+        image = cv2.resize(
+            image, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA
         )
 
-    return sorted_text
+    if config["encode_format"] == "jpg":
+        ok, encoded = cv2.imencode(
+            ".jpg", image, [cv2.IMWRITE_JPEG_QUALITY, config["jpeg_quality"]]
+        )
+    else:
+        ok, encoded = cv2.imencode(".png", image, [cv2.IMWRITE_PNG_COMPRESSION, 6])
 
+    if not ok:
+        return None, None
 
-def get_sorted_context(response):
-    sorted_text = ""
-    # 收集所有 word + 座標 + 文字
-    words_with_coords = []
+    return encoded.tobytes(), (offset_x, offset_y, scale)
 
-    for page in response.full_text_annotation.pages:
+
+def map_boxes_to_original(boxes, transform):
+    """把前處理後圖片上的座標換算回原始圖片座標"""
+    offset_x, offset_y, scale = transform
+    mapped = np.rint(boxes / scale).astype(np.int32)
+    mapped[..., 0] += offset_x
+    mapped[..., 1] += offset_y
+    return mapped
+
+
+# 同一行 y 差異小於等於 threshold 視為同行
+Y_THRESHOLD = 5
+
+
+def extract_word_boxes(response):
+    """
+    一次取出所有 word 的文字與 bounding box
+
+    回傳 (texts, boxes)：texts 為 list[str]，boxes 為 (N, 4, 2) 的 np.int32 陣列
+    直接走底層 protobuf，避免 proto-plus 每存取一個欄位就包一層 wrapper
+    """
+    annotation = response.full_text_annotation
+    pb_class = getattr(type(annotation), "pb", None)
+    if pb_class is not None:
+        annotation = pb_class(annotation)
+
+    texts = []
+    coords = []
+    for page in annotation.pages:
         for block in page.blocks:
             for paragraph in block.paragraphs:
                 for word in paragraph.words:
-                    word_text = "".join([s.text for s in word.symbols])
-                    # 取 bounding box 左上角作為排序基準
-                    x = word.bounding_box.vertices[0].x
-                    y = word.bounding_box.vertices[0].y
-                    words_with_coords.append(
-                        {
-                            "text": word_text,
-                            "x": x,
-                            "y": y,
-                            "vertices": [
-                                (v.x, v.y) for v in word.bounding_box.vertices
-                            ],
-                        }
-                    )
+                    texts.append("".join([s.text for s in word.symbols]))
+                    vertices = word.bounding_box.vertices
+                    # Vision 偶爾回傳少於 4 個頂點，以最後一個頂點補齊
+                    for i in range(4):
+                        v = vertices[min(i, len(vertices) - 1)] if vertices else None
+                        coords.append(v.x if v is not None else 0)
+                        coords.append(v.y if v is not None else 0)
 
-    # 排序：先按 y（行），再按 x（列）→ 由上到下，由左到右
-    # 設定容忍誤差（同一行 y 差異小於 threshold 視為同行）
-    Y_THRESHOLD = 5
+    boxes = np.array(coords, dtype=np.int32).reshape(-1, 4, 2)
+    return texts, boxes
 
-    # 分群：把相近 y 的字歸為同一「行」
-    sorted_lines_dict = {}
-    for w in words_with_coords:
-        y = w["y"]
-        # 找到最接近的行（y 在 ±threshold 內）
-        found_line = None
-        for line_y in sorted_lines_dict.keys():
-            if abs(y - line_y) <= Y_THRESHOLD:
-                found_line = line_y
-                break
-        if found_line is None:
-            sorted_lines_dict[y] = []
+
+def cluster_lines(boxes, y_threshold=Y_THRESHOLD):
+    """
+    依左上角 y 座標把 word 分行，結果與改寫前逐行比對的版本完全相同
+
+    依 Vision 回傳的順序處理每個字：與某一行第一個字（錨點）的 y 相差不超過 y_threshold
+    就加入該行（符合多行時取最早建立的一行），否則以自己的 y 建立新的一行
+    每一行以錨點比較、不與上一個字比較，相鄰的行不會因為 y 逐漸遞增而串成一行
+    錨點保存在排序好的 list 中以二分搜尋找出候選（O(n log n)）
+
+    回傳 [(行的 y, 該行 word index 陣列（已依 x 排序）)]，依行的 y 由上到下排列
+    """
+    if len(boxes) == 0:
+        return []
+
+    xs = boxes[:, 0, 0]
+    ys = boxes[:, 0, 1].tolist()
+
+    # 排序好的錨點 y，以及錨點 y -> 行的建立順序
+    anchors = []
+    anchor_lines = {}
+    members = []
+
+    for index, y in enumerate(ys):
+        line = None
+        pos = bisect.bisect_left(anchors, y - y_threshold)
+        while pos < len(anchors) and anchors[pos] <= y + y_threshold:
+            candidate = anchor_lines[anchors[pos]]
+            if line is None or candidate < line:
+                line = candidate
+            pos += 1
+
+        if line is None:
+            bisect.insort(anchors, y)
+            anchor_lines[y] = len(members)
+            members.append([index])
         else:
-            # 歸到已存在的行（使用該行的 key）
-            sorted_lines_dict[found_line].append(w)
-            continue
-        sorted_lines_dict[y].append(w)
+            members[line].append(index)
 
-    # 每行內按 x 排序
-    for y, words_info in sorted_lines_dict.items():
-        sorted_lines_dict[y] = sorted(words_info, key=lambda w: w["x"])
+    lines = []
+    for anchor in anchors:
+        indices = np.array(members[anchor_lines[anchor]])
+        indices = indices[np.argsort(xs[indices], kind="stable")]
+        lines.append((anchor, indices))
 
-    # 輸出最終排序文字
-    # print("=== 由上到下、由左到右的文字順序 ===")
-    for i, y in enumerate(sorted(sorted_lines_dict.keys())):
-        word_info_list = sorted_lines_dict[y]
-        line_text = " ".join([w["text"] for w in word_info_list])
-        sorted_text += line_text + "\n"
-        print(f"第 {i+1} 行: {line_text}")
+    return lines
+
+
+def get_sorted_context(response, transform=None):
+    """
+    把 OCR 結果依由上到下、由左到右排序
+
+    transform 為 preprocess_image 回傳的座標轉換，有傳入時先把座標換算回原始圖片
+
+    回傳 (sorted_lines_dict, sorted_text)
+    sorted_lines_dict: {行的 y: [{"text", "x", "y", "vertices"}, ...]}（行內依 x 排序）
+    """
+    texts, boxes = extract_word_boxes(response)
+    if transform is not None:
+        boxes = map_boxes_to_original(boxes, transform)
+
+    sorted_lines_dict = {}
+    line_texts = []
+    box_list = boxes.tolist()
+    for line_y, indices in cluster_lines(boxes):
+        words_info = []
+        for index in indices.tolist():
+            vertices = box_list[index]
+            words_info.append(
+                {
+                    "text": texts[index],
+                    "x": vertices[0][0],
+                    "y": vertices[0][1],
+                    "vertices": [tuple(v) for v in vertices],
+                }
+            )
+        sorted_lines_dict[line_y] = words_info
+        line_texts.append(" ".join([w["text"] for w in words_info]))
+
+    sorted_text = "".join([line_text + "\n" for line_text in line_texts])
 
     return sorted_lines_dict, sorted_text
 
 
 def plot_predict_result(response, image_file_path):
+    import cv2
+
     OCR_PATH = f"{current_directory}/ocr_result"
     # 載入原始圖片
     img = cv2.imread(image_file_path)
@@ -185,6 +452,8 @@ def plot_predict_result(response, image_file_path):
 
 
 def plot_sorted_result(sorted_lines_dict, image_file_path):
+    import cv2
+
     OCR_PATH = f"{current_directory}/ocr_result"
     img = cv2.imread(image_file_path)
     for i, y in enumerate(sorted(sorted_lines_dict.keys())):
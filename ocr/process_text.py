@@ -1,18 +1,25 @@
 import re
 import datetime
-import calendar
 
-CLASS_DICT = {
-    "BC": {"start_hour": "08:00:00"},
-    "DB": {"start_hour": "10:00:00"},
-    "JB": {"start_hour": "16:00:00"},
-    "RA": {"start_hour": "23:50:00"},
-    "OFF": {"start_hour": "00:00:00"},
-    "11FBC": {"start_hour": "08:00:00"},
-    "11FDB": {"start_hour": "10:00:00"},
-    "11FJB": {"start_hour": "16:00:00"},
-    "11FRA": {"start_hour": "00:00:00"},
-}
+from ocr.shift_table import get_shift_table
+from ocr.grid_parser import parse_roster_grid, GridParseError
+from monitoring.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 班表 App 每頁顯示 6 週的格子
+GRID_WEEKS = 6
+GRID_DAYS = GRID_WEEKS * 7
+
+
+def lines_to_text(sorted_lines_dict):
+    """把 sorted_lines_dict 依行由上到下組回文字（與 get_sorted_context 的 sorted_text 相同）"""
+    sorted_text = ""
+    for y in sorted(sorted_lines_dict.keys()):
+        line_text = " ".join([w["text"] for w in sorted_lines_dict[y]])
+        sorted_text += line_text + "\n"
+
+    return sorted_text
 
 
 def load_json():
@@ -28,6 +35,10 @@ def load_json():
 def text_to_calender_event_dict(texts):
     """
     ocr 後，處理文字轉換為日曆事件列表提供google calender api 使用
+
+    回傳 (year, month, calender_event_dict)，year / month 為班表標題的月份；
+    calender_event_dict 以 YYYY-MM-DD 為 key，包含格子中所有看得到的日期
+    （例如 8 月班表第一列的 7/28 ~ 7/31 與最後一列的 9/1 ~ 9/7）
     data = {
         "description1": "11:05\n7Я, 2025 ✓\n+\nIll 4G 964\n=\nBC 7\nJB 1\nOff 8\nDB 3\n11FBC 12\n剩餘年假 0\n30 週一 1週二 2週三 3 週四\n11FBC 11FBC| 11FBC |11FBC\n4週五\n5週六\n6 週日\nOff\n炎上\n11FBC 11FBC\n計價盤點\n7\n8\n9\n11FBC 11FBC |11FBC\n|小暑\n14\nBC\n15\n11FBC\n16\nBC\n11FBC\n10\n11\nOff\n「烏紗 12:3\n17\n18\n11FBC\nOff\nBLS14:3\n12\nOff\n13\nDB\n19\nOff\n20\n11FBC\n21\nBC\n22\nDB\n|大暑\n23\nBC\n24\nBC\n25\nOff\n26\nDB\n27\nBC\n28\nJB\n29\nOff\n30\nOff\n31\n4\nOff\n圓山\n5\nOff\n6\n00\nBC\n1\nBC\n2\nBC\n張有事\n3\nBC\n7\nBC\n8\n9\nDB\nBC\n立秋 父親節\n88\n10\nBC\nDB",
         "description2": "11:05 1\n8Я, 2025\n+\nIll 4G 974\n=\nBC 9\nJB 4\nOff 4\nDB 3\n剩餘年假 0\n28 週一\n29 週二\n30 週三\n31 週四\n1週五\n2週六\n3 週日\nJB\nOff\nOff\nBC\nBC\nBC\nBC\n張有事\n4\nOff\n圓山\n5\nOff\n6\nBC\n7\nBC\n8\nDB\n9\nBC\n立秋\n父親節\n10\nDB\n11\nOff\n12\nBC\n13\nJB\n14\nJB\n15\nJB\n16\nJB\n17\nOff\n展覽\n18\nDB\n19\nBC\n20\nBC\n25\n26\n24\n21\n22\n23\n24\n12\n27\n28\n29\n1\n2\n3\n4\n「軍人節\n處暑\n30\n30\nLO\n5\n6\n7\n祖父母節\n31\n中元節\n囍宴 14:3~\nAD\nP Unlock exclusive features.\n00",
@@ -38,25 +49,62 @@ def text_to_calender_event_dict(texts):
 
     year, month = get_year_month(texts)
 
-    # 該月1號
-    weekday_number = get_weekday_of_first_day(year, month)
+    # 同一次解析都使用同一版班別表
+    shift_table = get_shift_table()
 
-    # 該月的天數
-    num_days = calendar.monthrange(year, month)[1]
+    # 班表格子第一格（該月1號所在那週的週一）
+    grid_start_date = get_grid_start_date(year, month)
 
-    all_class_list = get_all_class_list(texts)
+    all_class_list = get_all_class_list(texts, shift_table)
 
-    current_class_list = all_class_list[weekday_number : weekday_number + num_days]
+    if len(all_class_list) > GRID_DAYS:
 
-    if len(current_class_list) > num_days:
+        logger.warning("警告: 班別數量大於班表格子數!")
 
-        print("警告: 班別數量大於該月天數!")
+    current_class_list = all_class_list[:GRID_DAYS]
 
-    calender_event_dict = create_calender_event_dict(year, month, current_class_list)
+    calender_event_dict = create_calender_event_dict(
+        grid_start_date, current_class_list, shift_table
+    )
 
     return year, month, calender_event_dict
 
 
+def layout_to_calender_event_dict(sorted_lines_dict):
+    """
+    由 OCR 版面（get_sorted_context 的 sorted_lines_dict）解析班表
+
+    先依 word 座標把班別放進日期格子（不受 OCR 文字順序影響），
+    找不到格子時改用 text_to_calender_event_dict 依文字順序解析
+
+    回傳 (year, month, calender_event_dict, grid)
+    grid 為 GridParseResult（含每天的信心值與沒辨識到班別的日期），改用文字解析時為 None
+    """
+    texts = lines_to_text(sorted_lines_dict)
+
+    year, month = get_year_month(texts)
+
+    shift_table = get_shift_table()
+    grid_start_date = get_grid_start_date(year, month)
+
+    try:
+        grid = parse_roster_grid(sorted_lines_dict, grid_start_date, shift_table)
+    except GridParseError as e:
+        logger.info(f"無法依座標解析班表格子，改用文字順序解析: {e}")
+        return text_to_calender_event_dict(texts) + (None,)
+
+    if not grid.shifts:
+        logger.info("班表格子中沒有辨識到班別，改用文字順序解析")
+        return text_to_calender_event_dict(texts) + (None,)
+
+    calender_event_dict = {
+        date_key: shift_table.event(code, datetime.date.fromisoformat(date_key))
+        for date_key, code in sorted(grid.shifts.items())
+    }
+
+    return year, month, calender_event_dict, grid
+
+
 def get_year_month(string):
 
     string = string.replace(" ", "")
@@ -67,7 +115,7 @@ def get_year_month(string):
     if match:
         month = int(match.group(1))
         year = int(match.group(2))
-        print(f"班表年份和月份: {year}年{month}月")
+        logger.debug(f"班表年份和月份: {year}年{month}月")
 
         return year, month
 
@@ -77,23 +125,29 @@ def get_year_month(string):
 
         month = int(match.group(1))
         year = int(match.group(2))
-        print(f"班表年份和月份: {year}年{month}月")
+        logger.debug(f"班表年份和月份: {year}年{month}月")
 
         return year, month
 
     raise ValueError("無法從字串中解析出年份和月份")
 
 
-def get_weekday_of_first_day(year, month):
-    # 建立該月1號的日期物件
+def get_grid_start_date(year, month):
+    """班表 App 每頁顯示 6 週，從該月1號所在那週的週一開始"""
     first_day = datetime.date(year, month, 1)
-    # weekday() 回傳 0=星期一, 1=星期二, ..., 6=星期日
-    weekday_num = first_day.weekday()
 
-    return weekday_num
+    return first_day - datetime.timedelta(days=first_day.weekday())
+
 
+def get_all_class_list(texts, shift_table=None):
+    """
+    依序找出「剩餘年假」之後每一行的班別代碼
 
-def get_all_class_list(texts):
+    班別與 OCR 別名來自 shift_table（預設為 ocr/shift_table.json），
+    lexer 在載入班別表時已編譯好
+    """
+    if shift_table is None:
+        shift_table = get_shift_table()
 
     all_class_list = []
 
@@ -110,104 +164,83 @@ def get_all_class_list(texts):
 
     filter_text_list = text_list[start_index:]
 
-    keywords = list(CLASS_DICT.keys())
-
-    # 建立 regex pattern：匹配任一 keyword（支援大小寫）
-    # 使用 re.escape 避免特殊字符問題，並按長度排序（避免短 keyword 先匹配）
-    sorted_keywords = sorted(
-        keywords, key=len, reverse=True
-    )  # 長的先匹配，避免 BC 先於 11FBC匹配
-    # 使用詞邊界，並對每個關鍵字進行轉義
-    pattern = r"\b(?:" + "|".join(re.escape(k) for k in sorted_keywords) + r")\b"
-    regex = re.compile(pattern, re.IGNORECASE)
-
-    for i, line in enumerate(filter_text_list):
-        matches = regex.findall(line)  # 找出所有匹配的 keyword
-        if matches:
-            # 轉成大寫或原樣保留都可以
-            matches = [m.upper() for m in matches]  # 統一格式
-
-            all_class_list.extend(matches)
+    for line in filter_text_list:
+        # 別名（例如 Off、0ff、11F BC）統一轉成班別代碼
+        all_class_list.extend(shift_table.find_all(line))
 
     return all_class_list
 
 
-def create_calender_event_dict(year, month, current_class_list):
+def create_calender_event_dict(start_date, current_class_list, shift_table=None):
+    """current_class_list 依序為 start_date 起每一天的班別"""
+    if shift_table is None:
+        shift_table = get_shift_table()
+
     calender_event_dict = {}
 
     for index, daily_class in enumerate(current_class_list):
 
-        event_dict = {
-            "summary": daily_class,
-            "start": {"timeZone": "Asia/Taipei"},
-            "end": {"timeZone": "Asia/Taipei"},
-        }
-
-        start_date = index + 1
-
-        start_hour = int(CLASS_DICT[daily_class]["start_hour"].split(":")[0])
-
-        start_minute = int(CLASS_DICT[daily_class]["start_hour"].split(":")[1])
-
-        start_second = int(CLASS_DICT[daily_class]["start_hour"].split(":")[2])
+        current_date = start_date + datetime.timedelta(days=index)
 
-        start_dt = datetime.datetime(
-            year, month, start_date, start_hour, start_minute, start_second
+        # 上班時間、時數與是否全天都由班別表決定
+        calender_event_dict[current_date.isoformat()] = shift_table.event(
+            daily_class, current_date
         )
 
-        if daily_class == "OFF":
-
-            formatted_start_dt = start_dt.strftime("%Y-%m-%d")
-
-            end_dt = start_dt + datetime.timedelta(days=1)
-
-            formatted_end_dt = end_dt.strftime("%Y-%m-%d")
-
-            event_dict["start"]["date"] = formatted_start_dt
-
-            event_dict["end"]["date"] = formatted_end_dt
-
-        else:
-
-            formatted_start_dt = start_dt.strftime("%Y-%m-%d %H:%M:%S")
-
-            end_dt = start_dt + datetime.timedelta(hours=8)
-
-            formatted_end_dt = end_dt.strftime("%Y-%m-%d %H:%M:%S")
+    return calender_event_dict
 
-            event_dict["start"]["dateTime"] = formatted_start_dt.replace(" ", "T")
 
-            event_dict["end"]["dateTime"] = formatted_end_dt.replace(" ", "T")
+def date_label(date_key):
+    """YYYY-MM-DD -> m/d"""
+    _, month, day = date_key.split("-")
 
-        date_key = start_dt.strftime("%Y-%m-%d")
+    return f"{int(month)}/{int(day)}"
 
-        calender_event_dict[date_key] = event_dict
 
-    return calender_event_dict
+def roster_message(year, month, calender_event_dict, grid=None):
+    """
+    grid: layout_to_calender_event_dict 回傳的 GridParseResult，
+    有傳入時列出沒辨識到班別（？）與信心值較低（需確認）的日期
+    """
+    unknown_dates = grid.unknown_dates if grid is not None else []
+    low_confidence_dates = grid.low_confidence_dates() if grid is not None else []
 
+    sorted_dates = sorted(set(calender_event_dict.keys()) | set(unknown_dates))
 
-def roster_message(year, month, calender_event_dict):
+    title = f"📅 {year}年{month}月 班表如下："
+    # 包含前後月份的日期時，標出實際涵蓋的範圍
+    if sorted_dates and len({date_key[:7] for date_key in sorted_dates}) > 1:
+        title = (
+            f"📅 {year}年{month}月 班表如下"
+            f"（{date_label(sorted_dates[0])} ~ {date_label(sorted_dates[-1])}）："
+        )
 
-    reply_lines = [f"📅 {year}年{month}月 班表如下："]
+    reply_lines = [title]
 
-    sorted_dates = sorted(calender_event_dict.keys())
+    def day_text(date_key):
+        if date_key not in calender_event_dict:
+            return f"{date_label(date_key)}: ？"
+        daily_class = calender_event_dict[date_key].get("summary", "無法識別的班別")
+        return f"{date_label(date_key)}: {daily_class}"
 
     for i in range(0, len(sorted_dates), 2):
-        date_key1 = sorted_dates[i]
-        day1 = date_key1.split("-")[2]
-        daily_class1 = calender_event_dict[date_key1].get("summary", "無法識別的班別")
-
-        line = f"{day1}日: {daily_class1}"
+        line = day_text(sorted_dates[i])
 
         # 檢查是否還有下一筆
         if i + 1 < len(sorted_dates):
-            date_key2 = sorted_dates[i + 1]
-            day2 = date_key2.split("-")[2]
-            daily_class2 = calender_event_dict[date_key2].get(
-                "summary", "無法識別的班別"
-            )
-            line += f" | {day2}日: {daily_class2}"
+            line += f" | {day_text(sorted_dates[i + 1])}"
 
         reply_lines.append(line)
 
+    if unknown_dates:
+        reply_lines.append(
+            "？ 沒有辨識到班別，不會變更："
+            + "、".join(date_label(date_key) for date_key in unknown_dates)
+        )
+    if low_confidence_dates:
+        reply_lines.append(
+            "⚠️ 請確認這幾天的班別："
+            + "、".join(date_label(date_key) for date_key in low_confidence_dates)
+        )
+
     return "\n".join(reply_lines)
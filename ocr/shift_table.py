@@ -0,0 +1,226 @@
+import os
+import re
+import json
+import time
+import hashlib
+import datetime
+import threading
+
+from monitoring.logger import get_logger
+
+logger = get_logger(__name__)
+
+# 獲取當前檔案的絕對路徑
+current_file_path = os.path.abspath(__file__)
+
+# 獲取當前檔案所在的目錄
+current_directory = os.path.dirname(current_file_path)
+
+# 班別設定檔（班別代碼、上班時間、時數、全天、OCR 別名）
+SHIFT_TABLE_PATH = os.getenv(
+    "SHIFT_TABLE_PATH", f"{current_directory}/shift_table.json"
+)
+
+# 每隔幾秒檢查一次設定檔是否變更（修改後不需重啟 worker）
+SHIFT_TABLE_CHECK_SECONDS = float(os.getenv("SHIFT_TABLE_CHECK_SECONDS", "5"))
+
+
+def parse_clock(value):
+    """ "HH:MM" 或 "HH:MM:SS" -> datetime.time"""
+    parts = [int(part) for part in value.split(":")]
+    while len(parts) < 3:
+        parts.append(0)
+    return datetime.time(*parts)
+
+
+def normalize_token(text):
+    """OCR 文字統一成查表用的 key：去空白、轉大寫"""
+    return re.sub(r"\s+", "", text).upper()
+
+
+class Shift:
+    """
+    一種班別
+
+    code: 班別代碼（事件的 summary）
+    start: 上班時間（datetime.time），全天班別為 None
+    duration: 時數（datetime.timedelta）
+    all_day: 是否為全天事件（例如 OFF）
+    aliases: OCR 可能辨識成的其他寫法
+    """
+
+    def __init__(self, code, start=None, duration=None, all_day=False, aliases=()):
+        self.code = code
+        self.start = start
+        self.duration = duration
+        self.all_day = all_day
+        self.aliases = tuple(aliases)
+
+    def event(self, date, time_zone):
+        """回傳該日期的 Google Calendar event dict"""
+        event_dict = {
+            "summary": self.code,
+            "start": {"timeZone": time_zone},
+            "end": {"timeZone": time_zone},
+        }
+
+        if self.all_day:
+            event_dict["start"]["date"] = date.isoformat()
+            event_dict["end"]["date"] = (date + datetime.timedelta(days=1)).isoformat()
+            return event_dict
+
+        start_dt = datetime.datetime.combine(date, self.start)
+        end_dt = start_dt + self.duration
+
+        event_dict["start"]["dateTime"] = start_dt.isoformat()
+        event_dict["end"]["dateTime"] = end_dt.isoformat()
+        return event_dict
+
+
+class ShiftTable:
+    """
+    由設定檔建立的班別表，建立時就編譯好 lexer，之後每次解析都直接使用
+
+    version: 設定檔內容的 sha1（內容相同就視為同一版）
+    """
+
+    def __init__(self, shifts, time_zone="Asia/Taipei", version=None):
+        self.shifts = {shift.code: shift for shift in shifts}
+        self.time_zone = time_zone
+        self.version = version
+
+        # 正規化後的寫法 -> 班別代碼
+        self.aliases = {}
+        for shift in shifts:
+            for text in (shift.code,) + shift.aliases:
+                self.aliases[normalize_token(text)] = shift.code
+
+        self.lexer = self._compile(shifts)
+
+    @classmethod
+    def from_dict(cls, config, version=None):
+        default_hours = float(config.get("default_duration_hours", 8))
+        shifts = []
+
+        for code, options in config["shifts"].items():
+            all_day = bool(options.get("all_day", False))
+            if not all_day and "start" not in options:
+                raise ValueError(f"班別 {code} 缺少 start")
+
+            shifts.append(
+                Shift(
+                    code,
+                    start=None if all_day else parse_clock(options["start"]),
+                    duration=datetime.timedelta(
+                        hours=float(options.get("duration_hours", default_hours))
+                    ),
+                    all_day=all_day,
+                    aliases=options.get("aliases", []),
+                )
+            )
+
+        return cls(shifts, config.get("time_zone", "Asia/Taipei"), version)
+
+    @classmethod
+    def from_file(cls, path=SHIFT_TABLE_PATH):
+        with open(path, "rb") as file:
+            content = file.read()
+
+        return cls.from_dict(
+            json.loads(content.decode("utf-8")), hashlib.sha1(content).hexdigest()
+        )
+
+    @staticmethod
+    def _compile(shifts):
+        texts = set()
+        for shift in shifts:
+            texts.add(shift.code)
+            texts.update(shift.aliases)
+
+        # 長的先匹配，避免 BC 先於 11FBC 匹配；別名中的空白可對應 OCR 的任意空白
+        patterns = [
+            r"\s*".join(re.escape(part) for part in text.split())
+            for text in sorted(texts, key=len, reverse=True)
+        ]
+        return re.compile(r"\b(?:" + "|".join(patterns) + r")\b", re.IGNORECASE)
+
+    def find_all(self, line):
+        """找出一行文字中所有班別，回傳班別代碼 list"""
+        return [self.aliases[normalize_token(m)] for m in self.lexer.findall(line)]
+
+    def event(self, code, date):
+        return self.shifts[code].event(date, self.time_zone)
+
+
+class ShiftTableLoader:
+    """
+    載入並快取班別表
+
+    每隔 check_seconds 檢查一次設定檔的 mtime / 大小，變更時重新載入；
+    內容沒變（version 相同）就沿用原本已編譯的 lexer。
+    新的設定檔格式錯誤時，保留目前的班別表並印出錯誤
+    """
+
+    def __init__(self, path=SHIFT_TABLE_PATH, check_seconds=SHIFT_TABLE_CHECK_SECONDS):
+        self.path = path
+        self.check_seconds = check_seconds
+
+        self._lock = threading.Lock()
+        self._table = None
+        self._file_state = None
+        self._checked_at = 0.0
+        self._stats = {"loads": 0, "reloads": 0, "errors": 0}
+
+    def get(self):
+        now = time.monotonic()
+        if self._table is not None and now - self._checked_at < self.check_seconds:
+            return self._table
+
+        with self._lock:
+            if self._table is None or now - self._checked_at >= self.check_seconds:
+                self._checked_at = now
+                self._reload_if_changed()
+            return self._table
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self._stats)
+            stats["version"] = self._table.version if self._table else None
+            return stats
+
+    def _reload_if_changed(self):
+        file_state = None
+        try:
+            stat = os.stat(self.path)
+            file_state = (stat.st_mtime_ns, stat.st_size)
+            if self._table is not None and file_state == self._file_state:
+                return
+
+            table = ShiftTable.from_file(self.path)
+
+        except (OSError, ValueError, KeyError, TypeError) as e:
+            self._stats["errors"] += 1
+            if self._table is None:
+                raise
+            # 記下這個版本，檔案再次修改前不重複嘗試
+            self._file_state = file_state
+            logger.warning(f"班別設定檔載入失敗，沿用目前的班別表: {e}")
+            return
+
+        self._file_state = file_state
+        if self._table is not None and table.version == self._table.version:
+            return
+
+        if self._table is not None:
+            self._stats["reloads"] += 1
+            logger.info(f"班別設定檔已更新（version {table.version[:8]}）")
+        self._stats["loads"] += 1
+        self._table = table
+
+
+# 每個 process 共用的班別表
+shift_table_loader = ShiftTableLoader()
+
+
+def get_shift_table():
+    return shift_table_loader.get()
@@ -0,0 +1,149 @@
+import os
+import datetime
+import itertools
+import threading
+
+from google.auth.transport.requests import Request
+
+from monitoring.logger import get_logger
+
+logger = get_logger(__name__)
+
+VISION_SCOPES = ["https://www.googleapis.com/auth/cloud-platform"]
+
+# 每個 worker process 保留的 Vision client（gRPC channel）數量
+VISION_CLIENT_POOL_SIZE = int(os.getenv("VISION_CLIENT_POOL_SIZE", "1"))
+
+# token 在到期前多少秒就先更新，避免在使用者請求中途才刷新
+VISION_TOKEN_REFRESH_MARGIN = int(os.getenv("VISION_TOKEN_REFRESH_MARGIN", "300"))
+
+
+def reconnect_errors():
+    """gRPC channel 斷線時會出現的錯誤，遇到時重建 client 再試一次"""
+    # google.cloud.vision / gRPC 載入需要數百毫秒，第一次建立 client 時才 import
+    from google.api_core import exceptions as api_exceptions
+
+    return (
+        api_exceptions.ServiceUnavailable,
+        api_exceptions.DeadlineExceeded,
+    )
+
+
+class VisionClientManager:
+    """
+    每個 process 共用的 Google Vision client pool
+
+    - 第一次呼叫時才解析 service account 金鑰並建立 gRPC channel
+    - gunicorn fork 之後，子行程會偵測到 pid 改變並重新建立 client
+    - token 在到期前 refresh_margin 秒主動更新
+    - channel 失效時重建該 client 並重試
+    - 測試可用 set_annotator_factory 注入假的 annotator
+    """
+
+    def __init__(
+        self,
+        credential_info,
+        pool_size=VISION_CLIENT_POOL_SIZE,
+        refresh_margin=VISION_TOKEN_REFRESH_MARGIN,
+    ):
+        self.credential_info = credential_info
+        self.pool_size = max(1, pool_size)
+        self.refresh_margin = datetime.timedelta(seconds=refresh_margin)
+
+        self._lock = threading.Lock()
+        self._pid = None
+        self._credentials = None
+        self._clients = []
+        self._counter = itertools.count()
+        self._annotator_factory = None
+
+    def set_annotator_factory(self, factory):
+        """
+        測試用 hook：factory() 回傳具有 document_text_detection(image=...) 的物件
+        傳入 None 則恢復使用真正的 Google Vision client
+        """
+        with self._lock:
+            self._annotator_factory = factory
+            self._reset_locked()
+
+    def reset(self):
+        """丟棄目前所有 client，下次使用時重新建立"""
+        with self._lock:
+            self._reset_locked()
+
+    def get_client(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                # fork 後父行程的 gRPC channel 不可沿用
+                self._reset_locked()
+                self._pid = os.getpid()
+
+            if not self._clients:
+                self._clients = [
+                    self._create_client() for _ in range(self.pool_size)
+                ]
+
+            self._refresh_token_if_needed()
+
+            index = next(self._counter) % len(self._clients)
+            return self._clients[index]
+
+    def document_text_detection(self, image):
+        client = self.get_client()
+        try:
+            return client.document_text_detection(image=image)
+        except reconnect_errors() as e:
+            logger.warning(f"Google Vision 連線失效，重新建立 client: {e}")
+            self._replace_client(client)
+            return self.get_client().document_text_detection(image=image)
+
+    def _create_client(self):
+        if self._annotator_factory is not None:
+            return self._annotator_factory()
+
+        from google.cloud import vision
+        from google.oauth2 import service_account
+
+        if self._credentials is None:
+            self._credentials = service_account.Credentials.from_service_account_info(
+                self.credential_info, scopes=VISION_SCOPES
+            )
+
+        return vision.ImageAnnotatorClient(credentials=self._credentials)
+
+    def _refresh_token_if_needed(self):
+        if self._credentials is None:
+            return
+
+        expiry = self._credentials.expiry
+        # google-auth 的 expiry 為不含時區的 UTC 時間
+        now = datetime.datetime.now(datetime.timezone.utc).replace(tzinfo=None)
+        if self._credentials.token is None or expiry is None or (
+            expiry - now < self.refresh_margin
+        ):
+            self._credentials.refresh(Request())
+
+    def _replace_client(self, broken_client):
+        with self._lock:
+            if broken_client not in self._clients:
+                return
+            index = self._clients.index(broken_client)
+            self._close_client(broken_client)
+            self._clients[index] = self._create_client()
+
+    def _reset_locked(self):
+        # fork 後的子行程不關閉繼承來的 channel，只丟棄參考
+        if self._pid == os.getpid():
+            for client in self._clients:
+                self._close_client(client)
+        self._clients = []
+        self._credentials = None
+
+    @staticmethod
+    def _close_client(client):
+        transport = getattr(client, "transport", None)
+        if transport is not None and hasattr(transport, "close"):
+            try:
+                transport.close()
+            except Exception as e:
+                logger.warning(f"關閉 Google Vision client 失敗: {e}")
@@ -0,0 +1,346 @@
+import os
+import json
+import time
+import socket
+import select
+import sqlite3
+import threading
+from collections import OrderedDict
+from urllib.parse import urlparse
+
+# 獲取當前檔案的絕對路徑
+current_file_path = os.path.abspath(__file__)
+
+# 獲取當前檔案所在的目錄
+current_directory = os.path.dirname(current_file_path)
+
+# 待確認班表的儲存方式：memory（單一 worker）、sqlite（同一台機器多個 worker）、
+# redis（多台機器，使用 Redis 協定的任何服務）
+PENDING_STORE = os.getenv("PENDING_STORE", "sqlite")
+
+PENDING_DB_PATH = os.getenv("PENDING_DB_PATH", f"{current_directory}/pending.sqlite3")
+PENDING_REDIS_URL = os.getenv("PENDING_REDIS_URL", "redis://localhost:6379/0")
+
+# 使用者多久沒回覆就丟棄待確認資料（秒），以及最多保留幾筆
+PENDING_TTL_SECONDS = int(os.getenv("PENDING_TTL_SECONDS", str(30 * 60)))
+PENDING_MAX_ENTRIES = int(os.getenv("PENDING_MAX_ENTRIES", "10000"))
+
+
+class MemoryPendingStore:
+    """行程內的待確認資料，只適用單一 gunicorn worker"""
+
+    def __init__(
+        self, ttl_seconds=PENDING_TTL_SECONDS, max_entries=PENDING_MAX_ENTRIES
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._lock = threading.Lock()
+        # user_id -> (到期時間, JSON 字串)
+        self._entries = OrderedDict()
+
+    def put(self, user_id, data):
+        value = json.dumps(data, ensure_ascii=False)
+        with self._lock:
+            self._entries.pop(user_id, None)
+            self._entries[user_id] = (time.time() + self.ttl_seconds, value)
+
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def get(self, user_id):
+        with self._lock:
+            return self._load_locked(user_id, remove=False)
+
+    def pop(self, user_id):
+        with self._lock:
+            return self._load_locked(user_id, remove=True)
+
+    def delete(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def _load_locked(self, user_id, remove):
+        item = self._entries.get(user_id)
+        if item is None:
+            return None
+
+        expires_at, value = item
+        if remove or expires_at < time.time():
+            del self._entries[user_id]
+        if expires_at < time.time():
+            return None
+
+        return json.loads(value)
+
+
+class SQLitePendingStore:
+    """以 SQLite 檔案保存待確認資料，同一台機器上的多個 gunicorn worker 可共用"""
+
+    def __init__(
+        self,
+        db_path=PENDING_DB_PATH,
+        ttl_seconds=PENDING_TTL_SECONDS,
+        max_entries=PENDING_MAX_ENTRIES,
+    ):
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connect()
+        conn.execute("""
+            CREATE TABLE IF NOT EXISTS pending (
+                user_id TEXT PRIMARY KEY,
+                data TEXT NOT NULL,
+                expires_at REAL NOT NULL
+            )
+            """)
+        conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_pending_expires ON pending (expires_at)"
+        )
+
+    def _connect(self):
+        # sqlite3 connection 不能跨 thread / fork 共用
+        key = os.getpid()
+        conn = getattr(self._local, "conn", None)
+        if conn is None or getattr(self._local, "pid", None) != key:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self._local.conn = conn
+            self._local.pid = key
+        return conn
+
+    def put(self, user_id, data):
+        conn = self._connect()
+        now = time.time()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.execute(
+                "INSERT INTO pending (user_id, data, expires_at) VALUES (?, ?, ?) "
+                "ON CONFLICT(user_id) DO UPDATE SET "
+                "data = excluded.data, expires_at = excluded.expires_at",
+                (user_id, json.dumps(data, ensure_ascii=False), now + self.ttl_seconds),
+            )
+            conn.execute("DELETE FROM pending WHERE expires_at < ?", (now,))
+            # 超過上限時，刪除最早到期（最舊）的資料
+            conn.execute(
+                "DELETE FROM pending WHERE user_id IN ("
+                "SELECT user_id FROM pending ORDER BY expires_at DESC "
+                "LIMIT -1 OFFSET ?)",
+                (self.max_entries,),
+            )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def get(self, user_id):
+        conn = self._connect()
+        row = conn.execute(
+            "SELECT data FROM pending WHERE user_id = ? AND expires_at >= ?",
+            (user_id, time.time()),
+        ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def pop(self, user_id):
+        conn = self._connect()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            row = conn.execute(
+                "SELECT data, expires_at FROM pending WHERE user_id = ?", (user_id,)
+            ).fetchone()
+            conn.execute("DELETE FROM pending WHERE user_id = ?", (user_id,))
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+        if row is None or row[1] < time.time():
+            return None
+        return json.loads(row[0])
+
+    def delete(self, user_id):
+        conn = self._connect()
+        conn.execute("DELETE FROM pending WHERE user_id = ?", (user_id,))
+
+
+class RedisConnection:
+    """
+    最小的 Redis 協定（RESP）client，只實作本專案用到的指令
+
+    不需額外安裝套件；任何支援 Redis 協定的服務（Redis、Valkey、
+    本機測試用的替身伺服器）都可使用
+    """
+
+    def __init__(self, url=PENDING_REDIS_URL, timeout=5):
+        parsed = urlparse(url)
+        self.host = parsed.hostname or "localhost"
+        self.port = parsed.port or 6379
+        self.password = parsed.password
+        self.db = int(parsed.path.lstrip("/") or 0)
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._sock = None
+        self._file = None
+        self._pid = None
+
+    def execute(self, *args):
+        with self._lock:
+            self._ensure_connected()
+            try:
+                self._write(args)
+            except OSError:
+                # 指令沒有完整送出，伺服器不會執行，重新連線後再送一次
+                self._close()
+                self._ensure_connected()
+                self._write(args)
+
+            try:
+                return self._read_reply()
+            except OSError:
+                # 指令可能已經執行（例如 GETDEL 已刪除 key），重送會得到不同的結果，直接丟出
+                self._close()
+                raise
+
+    def _ensure_connected(self):
+        if self._sock is not None and self._pid == os.getpid():
+            if not self._is_stale():
+                return
+            # 閒置時被伺服器關閉的連線，在送出指令前就換掉
+            self._close()
+
+        self._sock = socket.create_connection((self.host, self.port), self.timeout)
+        self._file = self._sock.makefile("rb")
+        self._pid = os.getpid()
+
+        if self.password:
+            self._send(("AUTH", self.password))
+        if self.db:
+            self._send(("SELECT", self.db))
+
+    def _is_stale(self):
+        """指令之間不應有可讀的資料；可讀代表伺服器已關閉連線（或回應錯亂）"""
+        try:
+            readable, _, _ = select.select([self._sock], [], [], 0)
+        except (OSError, ValueError):
+            return True
+        return bool(readable)
+
+    def _close(self):
+        if self._sock is not None and self._pid == os.getpid():
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+        self._sock = None
+        self._file = None
+
+    def _send(self, args):
+        self._write(args)
+        return self._read_reply()
+
+    def _write(self, args):
+        parts = [f"*{len(args)}\r\n".encode()]
+        for arg in args:
+            if not isinstance(arg, bytes):
+                arg = str(arg).encode("utf-8")
+            parts.append(f"${len(arg)}\r\n".encode() + arg + b"\r\n")
+        self._sock.sendall(b"".join(parts))
+
+    def _read_reply(self):
+        line = self._file.readline()
+        if not line:
+            raise ConnectionError("Redis 連線已關閉")
+
+        prefix, payload = line[:1], line[1:-2]
+        if prefix == b"+":
+            return payload.decode()
+        if prefix == b"-":
+            raise RuntimeError(f"Redis 錯誤: {payload.decode()}")
+        if prefix == b":":
+            return int(payload)
+        if prefix == b"$":
+            length = int(payload)
+            if length == -1:
+                return None
+            data = self._file.read(length + 2)
+            return data[:-2]
+        if prefix == b"*":
+            length = int(payload)
+            if length == -1:
+                return None
+            return [self._read_reply() for _ in range(length)]
+
+        raise ConnectionError(f"無法解析的 Redis 回應: {line!r}")
+
+
+class RedisPendingStore:
+    """
+    以 Redis 協定保存待確認資料，多台機器的 worker 可共用
+
+    每筆資料一個 key，以 PX 設定到期時間；另用 sorted set 記錄寫入時間，
+    超過 max_entries 時刪除最舊的資料
+    """
+
+    def __init__(
+        self,
+        url=PENDING_REDIS_URL,
+        ttl_seconds=PENDING_TTL_SECONDS,
+        max_entries=PENDING_MAX_ENTRIES,
+        prefix="auto_roster:pending:",
+        connection=None,
+    ):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.prefix = prefix
+        self.index_key = prefix + "index"
+        self.connection = connection or RedisConnection(url)
+
+    def put(self, user_id, data):
+        value = json.dumps(data, ensure_ascii=False)
+        self.connection.execute(
+            "SET", self._key(user_id), value, "PX", int(self.ttl_seconds * 1000)
+        )
+        self.connection.execute("ZADD", self.index_key, time.time(), user_id)
+
+        # 移除已過期的索引，並依上限淘汰最舊的資料
+        self.connection.execute(
+            "ZREMRANGEBYSCORE", self.index_key, "-inf", time.time() - self.ttl_seconds
+        )
+        overflow = self.connection.execute("ZCARD", self.index_key) - self.max_entries
+        if overflow > 0:
+            popped = self.connection.execute("ZPOPMIN", self.index_key, overflow)
+            old_user_ids = popped[0::2]
+            if old_user_ids:
+                self.connection.execute(
+                    "DEL", *[self._key(uid.decode()) for uid in old_user_ids]
+                )
+
+    def get(self, user_id):
+        value = self.connection.execute("GET", self._key(user_id))
+        return json.loads(value) if value is not None else None
+
+    def pop(self, user_id):
+        # GETDEL 需要 Redis 6.2 以上，確保同一筆資料只會被一個 worker 取走
+        value = self.connection.execute("GETDEL", self._key(user_id))
+        self.connection.execute("ZREM", self.index_key, user_id)
+        return json.loads(value) if value is not None else None
+
+    def delete(self, user_id):
+        self.connection.execute("DEL", self._key(user_id))
+        self.connection.execute("ZREM", self.index_key, user_id)
+
+    def _key(self, user_id):
+        return f"{self.prefix}{user_id}"
+
+
+def create_pending_store():
+    """依環境變數 PENDING_STORE 建立待確認資料的儲存"""
+    if PENDING_STORE == "memory":
+        return MemoryPendingStore()
+    if PENDING_STORE == "redis":
+        return RedisPendingStore()
+
+    return SQLitePendingStore()
@@ -0,0 +1,41 @@
+"""
+pytest 共用設定：不需要真的 LINE / Google 設定，所有會落地的路徑都指到暫存目錄
+
+環境變數必須在 import 專案模組之前設定（模組在 import 時讀取設定）
+"""
+
+import os
+import sys
+import tempfile
+
+# 獲取當前檔案的絕對路徑
+current_file_path = os.path.abspath(__file__)
+
+# 獲取當前檔案所在的目錄
+current_directory = os.path.dirname(current_file_path)
+
+PROJECT_ROOT = os.path.dirname(current_directory)
+
+if PROJECT_ROOT not in sys.path:
+    sys.path.insert(0, PROJECT_ROOT)
+
+SCRATCH = tempfile.mkdtemp(prefix="auto_calendar_tests_")
+
+for name, value in {
+    "CHANNEL_SECRET": "test",
+    "CHANNEL_ACCESS_TOKEN": "test",
+    "LOG_LEVEL": "WARNING",
+    "JOB_QUEUE_BROKER": "memory",
+    "PENDING_STORE": "memory",
+    "OCR_ARTIFACTS": "0",
+    "JOB_QUEUE_DB_PATH": os.path.join(SCRATCH, "job_queue.sqlite3"),
+    "PENDING_DB_PATH": os.path.join(SCRATCH, "pending.sqlite3"),
+    "USER_CREDENTIAL_FOLDER": os.path.join(SCRATCH, "user_credentials"),
+    "CALENDAR_MIRROR_FOLDER": os.path.join(SCRATCH, "calendar_mirror"),
+    "OCR_CACHE_FOLDER": os.path.join(SCRATCH, "ocr_cache"),
+    "OCR_ARTIFACT_FOLDER": os.path.join(SCRATCH, "ocr_artifacts"),
+    "PROFILE_FOLDER": os.path.join(SCRATCH, "profiles"),
+}.items():
+    os.environ.setdefault(name, value)
+
+os.environ.pop("METRICS_DIR", None)
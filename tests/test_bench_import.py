@@ -0,0 +1,8 @@
+from benchmark.bench_import import child_env, run_once
+
+
+def test_webhook_start_up_does_not_load_lazy_modules(tmp_path):
+    # 子行程 import line_bot_server，與目前測試 process 已載入的模組無關
+    result = run_once("line_bot_server", child_env(str(tmp_path)))
+
+    assert result["loaded"] == []
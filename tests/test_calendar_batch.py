@@ -0,0 +1,162 @@
+import json
+import datetime
+
+import pytest
+
+from auto_calendar import calendar_scheduler
+from auto_calendar.calendar_batch import CalendarSyncReport, execute_in_batches
+from auto_calendar.calendar_scheduler import CalendarScheduler
+from benchmark.fake_calendar import FakeCalendar
+
+
+class FlakyCalendar(FakeCalendar):
+    """summary 在 failures 中的事件，前 n 次寫入回傳指定的錯誤狀態"""
+
+    def __init__(self, failures=None):
+        super().__init__()
+        # summary -> [剩餘失敗次數, HTTP 狀態]
+        self.failures = failures or {}
+
+    def _handle(self, method, path, query, body):
+        summary = json.loads(body).get("summary") if body else None
+        failure = self.failures.get(summary)
+        if failure and failure[0] > 0:
+            failure[0] -= 1
+            self.counts["failed"] += 1
+            return failure[1], self._error(failure[1], "backendError", "Fail")
+        return super()._handle(method, path, query, body)
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(calendar_scheduler, "backoff_seconds", lambda attempt: 0)
+
+
+def make_scheduler(max_retries=3):
+    return CalendarScheduler(user_qps=1000, project_qps=1000, max_retries=max_retries)
+
+
+def insert_operations(service, days):
+    operations = []
+    for day in days:
+        date = datetime.date(2025, 9, 1) + datetime.timedelta(days=day - 1)
+        date_key = date.isoformat()
+        body = {
+            "summary": date_key,
+            "start": {"date": date_key},
+            "end": {"date": (date + datetime.timedelta(days=1)).isoformat()},
+        }
+        operations.append(
+            (
+                "insert",
+                date_key,
+                service.events().insert(calendarId="primary", body=body),
+            )
+        )
+    return operations
+
+
+def test_operations_are_sent_in_chunks():
+    calendar = FlakyCalendar()
+    service = calendar.service()
+    scheduler = make_scheduler()
+    report = CalendarSyncReport()
+
+    execute_in_batches(
+        service,
+        insert_operations(service, range(1, 121)),
+        report,
+        batch_size=50,
+        scheduler=scheduler,
+        user_id="user",
+    )
+
+    assert calendar.counts["batch"] == 3
+    assert calendar.counts["events.insert"] == 120
+    assert report.ok and report.count("insert") == 120
+    assert len(calendar.events()) == 120
+    assert scheduler.stats()["requests"] == 120
+
+
+def test_retryable_failures_are_resent_alone():
+    calendar = FlakyCalendar(
+        {"2025-09-02": [1, 503], "2025-09-05": [2, 429], "2025-09-07": [1, 500]}
+    )
+    service = calendar.service()
+    scheduler = make_scheduler()
+    report = CalendarSyncReport()
+
+    execute_in_batches(
+        service,
+        insert_operations(service, range(1, 11)),
+        report,
+        scheduler=scheduler,
+        user_id="user",
+    )
+
+    assert report.ok and report.count("insert") == 10
+    assert len(calendar.events()) == 10
+    # 第一個 batch 10 個請求，之後只重送失敗的 3 個、再重送仍失敗的 1 個
+    assert calendar.counts["batch"] == 3
+    assert calendar.counts["events.insert"] == 10
+    stats = scheduler.stats()
+    assert stats["retried"] == 4
+    assert stats["requests"] == 14
+    assert stats["failed"] == 0
+
+
+def test_non_retryable_failure_is_reported_without_retry():
+    calendar = FlakyCalendar({"2025-09-03": [1, 400]})
+    service = calendar.service()
+    scheduler = make_scheduler()
+    report = CalendarSyncReport()
+
+    execute_in_batches(
+        service,
+        insert_operations(service, range(1, 6)),
+        report,
+        scheduler=scheduler,
+        user_id="user",
+    )
+
+    assert calendar.counts["batch"] == 1
+    assert report.count("insert") == 4
+    assert list(report.failed) == ["2025-09-03"]
+    assert report.failed["2025-09-03"][0] == "insert"
+    assert scheduler.stats()["failed"] == 1
+    assert "2025-09-03" in report.summary()
+
+
+def test_failure_is_reported_after_max_retries():
+    calendar = FlakyCalendar({"2025-09-04": [10, 503]})
+    service = calendar.service()
+    scheduler = make_scheduler(max_retries=2)
+    report = CalendarSyncReport()
+
+    execute_in_batches(
+        service,
+        insert_operations(service, range(1, 6)),
+        report,
+        scheduler=scheduler,
+        user_id="user",
+    )
+
+    # 第一次 + 2 次重試
+    assert calendar.counts["batch"] == 3
+    assert report.count("insert") == 4
+    assert list(report.failed) == ["2025-09-04"]
+    stats = scheduler.stats()
+    assert stats["retried"] == 2
+    assert stats["failed"] == 1
+
+
+def test_without_scheduler_failures_are_not_retried():
+    calendar = FlakyCalendar({"2025-09-01": [1, 503]})
+    service = calendar.service()
+    report = CalendarSyncReport()
+
+    execute_in_batches(service, insert_operations(service, range(1, 4)), report)
+
+    assert calendar.counts["batch"] == 1
+    assert report.count("insert") == 2
+    assert list(report.failed) == ["2025-09-01"]
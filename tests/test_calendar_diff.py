@@ -0,0 +1,159 @@
+import pytest
+
+from auto_calendar import calendar_scheduler
+from auto_calendar.calendar_diff import diff_events
+from auto_calendar.calendar_utils import create_events_in_calendar, mark_ocr_event
+from benchmark.fake_calendar import FakeCalendar
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(calendar_scheduler, "backoff_seconds", lambda attempt: 0)
+
+
+def shift(date_key, summary, start="08:00:00", end="16:00:00"):
+    return {
+        "summary": summary,
+        "start": {"dateTime": f"{date_key}T{start}", "timeZone": "Asia/Taipei"},
+        "end": {"dateTime": f"{date_key}T{end}", "timeZone": "Asia/Taipei"},
+    }
+
+
+def day_off(date_key, next_date_key, summary="Off"):
+    return {
+        "summary": summary,
+        "start": {"date": date_key, "timeZone": "Asia/Taipei"},
+        "end": {"date": next_date_key, "timeZone": "Asia/Taipei"},
+    }
+
+
+def current(event, event_id):
+    # 行事曆回傳的 dateTime 一律帶時區位移
+    event = dict(event, id=event_id)
+    for key in ("start", "end"):
+        if "dateTime" in event[key]:
+            event[key] = {"dateTime": event[key]["dateTime"] + "+08:00"}
+    return event
+
+
+def test_same_event_with_offset_is_noop():
+    plan = diff_events(
+        {"2025-09-01": current(shift("2025-09-01", "BC"), "a")},
+        {"2025-09-01": shift("2025-09-01", "BC")},
+    )
+
+    assert plan.counts() == {"insert": 0, "patch": 0, "delete": 0, "noop": 1}
+    assert not plan.has_writes
+
+
+def test_patch_contains_only_changed_fields():
+    plan = diff_events(
+        {
+            "2025-09-01": current(shift("2025-09-01", "BC"), "a"),
+            "2025-09-02": current(shift("2025-09-02", "BC"), "b"),
+        },
+        {
+            "2025-09-01": shift("2025-09-01", "DB"),
+            "2025-09-02": shift("2025-09-02", "BC", end="20:00:00"),
+        },
+    )
+
+    first, second = plan.by_operation("patch")
+    assert first.event_id == "a"
+    assert first.patch_body() == {"summary": "DB"}
+    assert second.patch_body() == {
+        "end": {"dateTime": "2025-09-02T20:00:00", "timeZone": "Asia/Taipei"}
+    }
+
+
+def test_switching_to_all_day_clears_date_time():
+    plan = diff_events(
+        {"2025-09-01": current(shift("2025-09-01", "BC"), "a")},
+        {"2025-09-01": day_off("2025-09-01", "2025-09-02")},
+    )
+
+    (item,) = plan.by_operation("patch")
+    body = item.patch_body()
+    assert body["start"] == {
+        "date": "2025-09-01",
+        "timeZone": "Asia/Taipei",
+        "dateTime": None,
+    }
+    assert body["summary"] == "Off"
+
+
+def test_stale_ocr_events_are_deleted_except_keep_dates():
+    plan = diff_events(
+        {
+            "2025-09-01": current(shift("2025-09-01", "BC"), "a"),
+            "2025-09-02": current(shift("2025-09-02", "BC"), "b"),
+            "2025-09-03": current(shift("2025-09-03", "BC"), "c"),
+        },
+        {"2025-09-01": shift("2025-09-01", "BC")},
+        keep_dates=["2025-09-03"],
+    )
+
+    assert [item.event_id for item in plan.by_operation("delete")] == ["b"]
+    assert plan.counts() == {"insert": 0, "patch": 0, "delete": 1, "noop": 1}
+
+
+def test_delete_missing_can_be_disabled():
+    plan = diff_events(
+        {"2025-09-02": current(shift("2025-09-02", "BC"), "b")},
+        {"2025-09-01": shift("2025-09-01", "BC")},
+        delete_missing=False,
+    )
+
+    assert plan.counts() == {"insert": 1, "patch": 0, "delete": 0, "noop": 0}
+
+
+def test_apply_then_reapply_writes_nothing():
+    calendar = FakeCalendar()
+    service = calendar.service()
+    # 行事曆上已有的 OCR 事件：一天班別不同、一天已不在新班表、一天沒辨識到班別
+    for event in (
+        shift("2025-09-01", "BC"),
+        shift("2025-09-02", "BC"),
+        shift("2025-09-03", "BC"),
+        shift("2025-09-05", "BC"),
+    ):
+        calendar.add_event(mark_ocr_event(event))
+    # 使用者自己建立的事件不受影響
+    calendar.add_event(shift("2025-09-03", "看牙醫", start="18:00:00", end="19:00:00"))
+
+    new_event_dict = {
+        "2025-09-01": shift("2025-09-01", "DB"),
+        "2025-09-02": shift("2025-09-02", "BC"),
+        "2025-09-04": day_off("2025-09-04", "2025-09-05"),
+        "2025-09-06": shift("2025-09-06", "JB"),
+    }
+
+    report = create_events_in_calendar(
+        new_event_dict, service, keep_dates=["2025-09-05"]
+    )
+
+    assert report.ok
+    assert report.plan.counts() == {"insert": 2, "patch": 1, "delete": 1, "noop": 1}
+    assert calendar.counts["events.insert"] == 2
+    assert calendar.counts["events.patch"] == 1
+    assert calendar.counts["events.delete"] == 1
+    assert sorted(
+        (event["start"].get("date") or event["start"]["dateTime"][:10], event["summary"])
+        for event in calendar.events()
+    ) == [
+        ("2025-09-01", "DB"),
+        ("2025-09-02", "BC"),
+        ("2025-09-03", "看牙醫"),
+        ("2025-09-04", "Off"),
+        ("2025-09-05", "BC"),
+        ("2025-09-06", "JB"),
+    ]
+
+    calendar.reset_counts()
+    report = create_events_in_calendar(
+        new_event_dict, service, keep_dates=["2025-09-05"]
+    )
+
+    assert not report.plan.has_writes
+    assert calendar.write_count() == 0
+    assert calendar.counts["batch"] == 0
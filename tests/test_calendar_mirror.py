@@ -0,0 +1,118 @@
+import datetime
+
+import pytest
+
+from auto_calendar.calendar_mirror import CalendarMirror
+from auto_calendar.calendar_utils import iter_event_pages
+from benchmark.fake_calendar import FakeCalendar
+
+OCR_MARKER = {"private": {"created_by": "ocr_service", "creation_method": "ocr"}}
+
+
+def all_day_event(date_key, summary, ocr=True):
+    end = datetime.date.fromisoformat(date_key) + datetime.timedelta(days=1)
+    event = {
+        "summary": summary,
+        "start": {"date": date_key},
+        "end": {"date": end.isoformat()},
+    }
+    if ocr:
+        event["extendedProperties"] = OCR_MARKER
+    return event
+
+
+@pytest.fixture
+def calendar():
+    calendar = FakeCalendar(page_size=2)
+    calendar.add_event(all_day_event("2025-09-01", "早班"))
+    calendar.add_event(all_day_event("2025-09-02", "晚班"))
+    calendar.add_event(all_day_event("2025-09-03", "會議", ocr=False))
+    calendar.add_event(all_day_event("2025-10-01", "夜班"))
+    return calendar
+
+
+@pytest.fixture
+def mirror(tmp_path):
+    return CalendarMirror(iter_event_pages, folder=str(tmp_path))
+
+
+def summaries(events):
+    return sorted(event["summary"] for event in events.values())
+
+
+def event_id(calendar, summary):
+    return next(e["id"] for e in calendar.events() if e["summary"] == summary)
+
+
+def test_full_sync_keeps_only_ocr_events(calendar, mirror):
+    events = mirror.sync(calendar.service(), "user")
+
+    assert summaries(events) == ["夜班", "早班", "晚班"]
+    assert mirror.stats() == {"full_syncs": 1, "delta_syncs": 0, "resyncs": 0}
+    # page_size=2：完整同步要讀完所有分頁
+    assert calendar.counts["events.list"] == 2
+
+
+def test_mirror_is_reused_from_disk(calendar, mirror, tmp_path):
+    mirror.sync(calendar.service(), "user")
+    calendar.reset_counts()
+
+    # 新的 process 讀取磁碟上的鏡像，只送出一個增量請求
+    other = CalendarMirror(iter_event_pages, folder=str(tmp_path))
+    events = other.sync(calendar.service(), "user")
+
+    assert summaries(events) == ["夜班", "早班", "晚班"]
+    assert other.stats()["delta_syncs"] == 1
+    assert calendar.counts["events.list"] == 1
+
+
+def test_delta_applies_inserts_updates_and_removals(calendar, mirror):
+    service = calendar.service()
+    mirror.sync(service, "user")
+
+    calendar.add_event(all_day_event("2025-09-04", "休假"))
+    calendar.add_event(all_day_event("2025-09-05", "聚餐", ocr=False))
+    service.events().delete(
+        calendarId="primary", eventId=event_id(calendar, "早班")
+    ).execute()
+    service.events().patch(
+        calendarId="primary",
+        eventId=event_id(calendar, "晚班"),
+        body={"summary": "小夜"},
+    ).execute()
+    # 使用者移除了 OCR 標記，之後不再由 OCR 管理
+    service.events().patch(
+        calendarId="primary",
+        eventId=event_id(calendar, "夜班"),
+        body={"extendedProperties": {"private": {"created_by": None}}},
+    ).execute()
+
+    events = mirror.sync(service, "user")
+
+    assert summaries(events) == ["休假", "小夜"]
+    assert mirror.stats() == {"full_syncs": 1, "delta_syncs": 1, "resyncs": 0}
+
+
+def test_expired_sync_token_triggers_full_resync(calendar, mirror):
+    service = calendar.service()
+    mirror.sync(service, "user")
+
+    calendar.add_event(all_day_event("2025-09-06", "早班"))
+    calendar.expire_sync_tokens()
+
+    events = mirror.sync(service, "user")
+
+    assert summaries(events) == ["夜班", "早班", "早班", "晚班"]
+    assert mirror.stats() == {"full_syncs": 2, "delta_syncs": 0, "resyncs": 1}
+
+    # 重新同步後取得新的 syncToken，下次又是增量同步
+    mirror.sync(service, "user")
+    assert mirror.stats()["delta_syncs"] == 1
+
+
+def test_range_events_filters_by_start_date(calendar, mirror):
+    events = mirror.range_events(
+        calendar.service(), "user", "2025-09-02", "2025-09-30"
+    )
+
+    assert [event["summary"] for event in events] == ["晚班"]
@@ -0,0 +1,214 @@
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from auto_calendar.calendar_scheduler import CalendarScheduler
+
+
+def test_quota_is_divided_between_processes():
+    scheduler = CalendarScheduler(user_qps=10, project_qps=100, processes=4)
+
+    assert scheduler.user_qps == 2.5
+    assert scheduler.project_qps == 25
+
+
+def test_idle_users_are_removed():
+    scheduler = CalendarScheduler(user_qps=1000, project_qps=1000, idle_seconds=0)
+
+    scheduler.acquire("a")
+    scheduler.acquire("b")
+    time.sleep(0.01)
+    scheduler.acquire("c")
+
+    assert scheduler.stats()["users"] == 1
+
+
+def test_active_user_is_kept():
+    scheduler = CalendarScheduler(user_qps=1000, project_qps=1000, idle_seconds=0)
+
+    with scheduler.user_session("a"):
+        time.sleep(0.01)
+        scheduler.acquire("b")
+        assert "a" in scheduler._users
+
+    time.sleep(0.01)
+    scheduler.acquire("b")
+    assert "a" not in scheduler._users
+
+
+def test_same_user_sessions_run_one_at_a_time():
+    scheduler = CalendarScheduler()
+    running = []
+    overlaps = []
+
+    def work(user_id):
+        with scheduler.user_session(user_id):
+            running.append(user_id)
+            overlaps.append(running.count(user_id))
+            time.sleep(0.02)
+            running.remove(user_id)
+
+    threads = [threading.Thread(target=work, args=(user,)) for user in "aab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert max(overlaps) == 1
+
+
+@pytest.fixture
+def sent():
+    return []
+
+
+@pytest.fixture
+def server(monkeypatch, sent):
+    import line_bot_server
+
+    monkeypatch.setattr(
+        line_bot_server,
+        "line_bot_api",
+        SimpleNamespace(
+            reply_message=lambda token, message: sent.append(message.text),
+            push_message=lambda to, messages: sent.append(messages.text),
+        ),
+    )
+    monkeypatch.setattr(line_bot_server.job_queue, "workers", 0)
+    return line_bot_server
+
+
+def text_event(user_id, text):
+    return SimpleNamespace(
+        source=SimpleNamespace(user_id=user_id),
+        message=SimpleNamespace(text=text),
+        reply_token="token",
+    )
+
+
+def test_confirmed_write_goes_through_job_queue(server, monkeypatch):
+    written = []
+    monkeypatch.setattr(server, "write_calendar", lambda *args: written.append(args))
+    pending = {"year": 2025, "month": 9, "event_dict": {}, "unknown_dates": []}
+    server.pending_store.put("user", pending)
+
+    server.handle_text(text_event("user", "同意"))
+
+    assert written == []
+    assert server.job_queue.broker.depth() == 1
+    assert server.pending_store.get("user") is None
+
+    assert server.job_queue.drain() == 1
+    assert written == [("user", pending)]
+
+
+def test_full_queue_keeps_pending_roster(server, sent, monkeypatch):
+    monkeypatch.setattr(server.job_queue, "max_size", 0)
+    pending = {"year": 2025, "month": 9, "event_dict": {}, "unknown_dates": []}
+    server.pending_store.put("user", pending)
+
+    server.handle_text(text_event("user", "同意"))
+
+    assert server.pending_store.pop("user") == pending
+    assert "稍後" in sent[-1]
+
+
+def http_error(status):
+    from googleapiclient.errors import HttpError
+
+    return HttpError(SimpleNamespace(status=status, reason="error"), b"{}")
+
+
+def test_transient_sync_error_is_retried_before_notifying(server, sent, monkeypatch):
+    monkeypatch.setattr(server.job_queue, "retry_delay", 0)
+    calls = []
+
+    def create_events(*args, **kwargs):
+        calls.append(args)
+        raise http_error(503)
+
+    monkeypatch.setattr(server, "get_calendar_service", lambda user_id: None)
+    monkeypatch.setattr(server, "create_events_in_calendar", create_events)
+    pending = {"year": 2025, "month": 9, "event_dict": {}, "unknown_dates": []}
+    server.job_queue.enqueue("sync_calendar", {"user_id": "user", "pending": pending})
+
+    server.job_queue.drain()
+
+    assert len(calls) == server.JOB_MAX_ATTEMPTS
+    assert len(sent) == 1
+    assert sent[0].startswith("❌ 建立行事曆事件失敗")
+
+
+def test_permanent_sync_error_is_reported_once(server, sent, monkeypatch):
+    calls = []
+
+    def create_events(*args, **kwargs):
+        calls.append(args)
+        raise http_error(400)
+
+    monkeypatch.setattr(server, "get_calendar_service", lambda user_id: None)
+    monkeypatch.setattr(server, "create_events_in_calendar", create_events)
+    pending = {"year": 2025, "month": 9, "event_dict": {}, "unknown_dates": []}
+    server.job_queue.enqueue("sync_calendar", {"user_id": "user", "pending": pending})
+
+    server.job_queue.drain()
+
+    assert len(calls) == 1
+    assert len(sent) == 1
+    assert sent[0].startswith("❌ 建立行事曆事件失敗")
+
+
+def sync_outcomes():
+    from monitoring.metrics import requests_total
+
+    return {
+        key[1]: value
+        for key, value in requests_total.snapshot()
+        if key[0] == "sync_calendar"
+    }
+
+
+def test_handled_sync_error_is_counted_as_error(server, monkeypatch):
+    def create_events(*args, **kwargs):
+        raise http_error(400)
+
+    monkeypatch.setattr(server, "get_calendar_service", lambda user_id: None)
+    monkeypatch.setattr(server, "create_events_in_calendar", create_events)
+    pending = {"year": 2025, "month": 9, "event_dict": {}, "unknown_dates": []}
+    before = sync_outcomes()
+
+    server.job_queue.enqueue("sync_calendar", {"user_id": "user", "pending": pending})
+    server.job_queue.drain()
+
+    after = sync_outcomes()
+    assert after.get("error", 0) == before.get("error", 0) + 1
+    assert after.get("ok", 0) == before.get("ok", 0)
+
+
+def test_image_job_records_download_info(server, sent, monkeypatch):
+    image = b"\x89PNG\r\n\x1a\n" + bytes(100)
+    content = SimpleNamespace(
+        response=SimpleNamespace(headers={"content-length": str(len(image))}),
+        iter_content=lambda chunk_size: [image],
+    )
+    submitted = []
+
+    def image_to_lines(image_view, user_id=None):
+        raise ValueError("沒有偵測到班表")
+
+    server.line_bot_api.get_message_content = lambda message_id: content
+    monkeypatch.setattr(server, "image_to_lines", image_to_lines)
+    monkeypatch.setattr(
+        server.artifact_writer, "submit", lambda *args: submitted.append(args)
+    )
+
+    server.job_queue.enqueue("ocr_image", {"user_id": "user", "message_id": "1"})
+    server.job_queue.drain()
+
+    meta = submitted[0][3]
+    assert meta["download"]["bytes"] == len(image)
+    assert meta["download"]["type"] == "png"
+    assert "seconds" in meta["download"]
+    assert sent[-1].startswith("❌ 處理失敗")
@@ -0,0 +1,210 @@
+import time
+import datetime
+import threading
+
+import pytest
+from google.auth.exceptions import RefreshError
+
+from auto_calendar.credential_cache import CredentialCache, utcnow
+
+INVALID_GRANT = RefreshError(
+    "invalid_grant: Token has been expired or revoked.",
+    {
+        "error": "invalid_grant",
+        "error_description": "Token has been expired or revoked.",
+    },
+    retryable=False,
+)
+
+
+def server_error():
+    return RefreshError(
+        "server_error: Internal error", {"error": "server_error"}, retryable=True
+    )
+
+
+class FakeCredentials:
+    """google.oauth2.credentials.Credentials 的替身，refresh 依序丟出 errors 中的錯誤"""
+
+    def __init__(self, expires_in=-60, errors=(), delay=0):
+        self.token = "old"
+        self.refresh_token = "refresh"
+        self.expiry = utcnow() + datetime.timedelta(seconds=expires_in)
+        self.errors = list(errors)
+        self.delay = delay
+        self.refreshes = 0
+
+    @property
+    def valid(self):
+        return self.token is not None and self.expiry > utcnow()
+
+    def refresh(self, request):
+        self.refreshes += 1
+        time.sleep(self.delay)
+        if self.errors:
+            raise self.errors.pop(0)
+        self.token = f"new-{self.refreshes}"
+        self.expiry = utcnow() + datetime.timedelta(hours=1)
+
+
+class Store:
+    def __init__(self):
+        self.credentials = {}
+        self.versions = {}
+        self.revoked = []
+
+    def load(self, user_id):
+        return self.credentials.get(user_id)
+
+    def save(self, user_id, creds):
+        self.credentials[user_id] = creds
+        self.versions[user_id] = self.versions.get(user_id, 0) + 1
+
+    def version(self, user_id):
+        return self.versions.get(user_id)
+
+    def mark_revoked(self, user_id):
+        self.revoked.append(user_id)
+        self.credentials.pop(user_id, None)
+        self.versions.pop(user_id, None)
+
+
+def make_cache(store, **kwargs):
+    kwargs.setdefault("refresh_interval", 0)
+    kwargs.setdefault("request_factory", lambda: None)
+    return CredentialCache(
+        store.load,
+        store.save,
+        store.version,
+        mark_revoked=store.mark_revoked,
+        **kwargs,
+    )
+
+
+def wait_for(predicate, timeout=1):
+    deadline = time.monotonic() + timeout
+    while not predicate():
+        assert time.monotonic() < deadline
+        time.sleep(0.01)
+
+
+def test_expired_token_is_refreshed_on_get():
+    store = Store()
+    store.save("user", FakeCredentials())
+    cache = make_cache(store)
+
+    creds = cache.get("user")
+
+    assert creds.token == "new-1"
+    assert cache.stats()["refreshes"] == 1
+
+
+def test_invalid_grant_marks_credential_revoked():
+    store = Store()
+    store.save("user", FakeCredentials(errors=[INVALID_GRANT]))
+    cache = make_cache(store)
+
+    assert cache.get("user") is None
+    assert store.revoked == ["user"]
+    assert cache.stats()["revoked"] == 1
+
+
+@pytest.mark.parametrize(
+    "error",
+    [
+        server_error(),
+        RefreshError("No access token in response.", {}, retryable=False),
+    ],
+)
+def test_other_refresh_errors_keep_the_credential(error):
+    store = Store()
+    creds = FakeCredentials(errors=[error])
+    store.save("user", creds)
+    cache = make_cache(store)
+
+    with pytest.raises(RefreshError):
+        cache.get("user")
+
+    assert store.revoked == []
+    assert cache.stats()["refresh_failures"] == 1
+
+    # 下一次使用時重新更新
+    assert cache.get("user").token == "new-2"
+    assert creds.refreshes == 2
+
+
+def test_is_usable_does_not_wait_for_token_endpoint():
+    store = Store()
+    creds = FakeCredentials()
+    store.save("user", creds)
+    # token endpoint 在測試放行前不回應
+    network = threading.Event()
+    cache = make_cache(store, request_factory=network.wait)
+
+    started = time.monotonic()
+    assert cache.is_usable("user")
+    assert time.monotonic() - started < 0.1
+    assert not creds.valid
+
+    # 更新在背景完成
+    network.set()
+    wait_for(lambda: creds.valid)
+    assert creds.refreshes == 1
+
+
+def test_is_usable_is_false_once_refresh_token_is_revoked():
+    store = Store()
+    store.save("user", FakeCredentials(errors=[INVALID_GRANT]))
+    cache = make_cache(store)
+
+    # 快取中的憑證仍有 refresh token，背景更新時才發現已被撤銷
+    assert cache.is_usable("user")
+    wait_for(lambda: store.revoked == ["user"])
+    assert not cache.is_usable("user")
+
+
+def test_is_usable_keeps_credential_after_temporary_refresh_failure():
+    store = Store()
+    creds = FakeCredentials(errors=[server_error()])
+    store.save("user", creds)
+    cache = make_cache(store)
+
+    assert cache.is_usable("user")
+    wait_for(lambda: cache.stats()["refresh_failures"] == 1 and not cache._inflight)
+    assert store.revoked == []
+
+    # 背景工作取得憑證時再更新一次
+    assert cache.get("user").token == "new-2"
+
+
+def test_is_usable_is_false_without_refresh_token():
+    store = Store()
+    creds = FakeCredentials()
+    creds.refresh_token = None
+    store.save("user", creds)
+    cache = make_cache(store)
+
+    assert not cache.is_usable("user")
+    assert not cache.is_usable("missing")
+    assert creds.refreshes == 0
+
+
+def test_background_refresh_skips_idle_users():
+    store = Store()
+    active = FakeCredentials(expires_in=60)
+    idle = FakeCredentials(expires_in=60)
+    store.save("active", active)
+    store.save("idle", idle)
+    cache = make_cache(store, active_seconds=0.1)
+
+    cache.get("idle")
+    time.sleep(0.15)
+
+    # 之後的 get 才啟動背景 thread，此時 idle 已超過 active_seconds 沒有使用
+    cache.refresh_interval = 0.02
+    cache.get("active")
+    time.sleep(0.06)
+    cache.stop()
+
+    assert active.refreshes == 1
+    assert idle.refreshes == 0
@@ -0,0 +1,116 @@
+import json
+import datetime
+
+import pytest
+from google.oauth2.credentials import Credentials
+
+from auto_calendar.credential_store import (
+    FileCredentialStore,
+    SQLiteCredentialStore,
+    migrate_folder_to_sqlite,
+)
+
+
+def credentials(expires_in=3600, refresh_token="refresh"):
+    expiry = datetime.datetime.now(datetime.timezone.utc).replace(
+        tzinfo=None
+    ) + datetime.timedelta(seconds=expires_in)
+    return Credentials(
+        "token",
+        refresh_token=refresh_token,
+        token_uri="https://oauth2.googleapis.com/token",
+        client_id="client",
+        client_secret="secret",
+        expiry=expiry,
+    )
+
+
+@pytest.fixture
+def sqlite_store(tmp_path):
+    return SQLiteCredentialStore(str(tmp_path / "credentials.sqlite3"), None)
+
+
+@pytest.fixture
+def file_store(tmp_path):
+    return FileCredentialStore(str(tmp_path / "users"), None)
+
+
+def write_corrupt(store, user_id):
+    # 缺少 refresh_token，from_authorized_user_info 會拋出 ValueError
+    with open(store.path(user_id), "w") as file:
+        json.dump({"token": "token", "client_id": "client"}, file)
+
+
+def test_sqlite_upsert_bumps_version(sqlite_store):
+    assert sqlite_store.version("user") is None
+
+    sqlite_store.save("user", credentials())
+    assert sqlite_store.version("user") == 1
+
+    sqlite_store.save("user", credentials(expires_in=7200))
+    assert sqlite_store.version("user") == 2
+    assert sqlite_store.list_users() == ["user"]
+    assert sqlite_store.load("user").refresh_token == "refresh"
+
+
+def test_sqlite_revoked_users_are_hidden_until_purged(sqlite_store):
+    sqlite_store.save("revoked", credentials())
+    sqlite_store.save("active", credentials())
+
+    sqlite_store.mark_revoked("revoked")
+
+    assert sqlite_store.load("revoked") is None
+    assert sqlite_store.version("revoked") is None
+    assert sqlite_store.list_users() == ["active"]
+    assert sqlite_store.purge_revoked() == 1
+    assert sqlite_store.purge_revoked() == 0
+
+    # 重新授權後可再次使用
+    sqlite_store.save("revoked", credentials())
+    assert sqlite_store.load("revoked") is not None
+
+
+def test_sqlite_list_expiring(sqlite_store):
+    sqlite_store.save("soon", credentials(expires_in=60))
+    sqlite_store.save("later", credentials(expires_in=7200))
+    sqlite_store.save("revoked", credentials(expires_in=30))
+    sqlite_store.mark_revoked("revoked")
+
+    assert sqlite_store.list_expiring(300) == ["soon"]
+    assert sqlite_store.list_expiring(10000) == ["soon", "later"]
+
+
+def test_file_revoked_users_are_hidden_until_purged(file_store):
+    file_store.save("revoked", credentials())
+    file_store.save("active", credentials())
+
+    file_store.mark_revoked("revoked")
+
+    assert file_store.load("revoked") is None
+    assert file_store.version("revoked") is None
+    assert file_store.list_users() == ["active"]
+    assert file_store.purge_revoked() == 1
+
+
+def test_file_list_expiring_skips_corrupt_files(file_store):
+    file_store.save("soon", credentials(expires_in=60))
+    file_store.save("later", credentials(expires_in=7200))
+    write_corrupt(file_store, "corrupt")
+
+    assert file_store.list_expiring(300) == ["soon"]
+    assert file_store.skipped == 1
+
+
+def test_migration_skips_corrupt_file(file_store, tmp_path):
+    file_store.save("first", credentials(expires_in=60))
+    file_store.save("second", credentials())
+    write_corrupt(file_store, "corrupt")
+    db_path = str(tmp_path / "migrated.sqlite3")
+
+    count, skipped = migrate_folder_to_sqlite(file_store.folder, db_path)
+
+    assert (count, skipped) == (2, 1)
+    target = SQLiteCredentialStore(db_path, None)
+    assert sorted(target.list_users()) == ["first", "second"]
+    assert target.list_expiring(300) == ["first"]
+    assert target.load("second").refresh_token == "refresh"
@@ -0,0 +1,51 @@
+import random
+
+import pytest
+
+from benchmark.bench_grid_parser import drop_middle_shift, shuffle_layout, summaries
+from benchmark.fake_vision import load_fixtures
+from ocr.process_text import layout_to_calender_event_dict
+from ocr.shift_table import get_shift_table
+
+FIXTURES = load_fixtures()
+
+
+@pytest.fixture(params=sorted(FIXTURES))
+def layout(request):
+    return FIXTURES[request.param]
+
+
+def test_every_grid_day_is_parsed_with_full_confidence(layout):
+    _, _, events, grid = layout_to_calender_event_dict(layout)
+
+    assert grid is not None
+    assert summaries(events) == grid.shifts
+    assert grid.unknown_dates == []
+    assert grid.low_confidence_dates() == []
+    assert set(grid.confidence) == set(events)
+
+
+def test_dropped_word_only_loses_its_own_day(layout):
+    _, _, events, _ = layout_to_calender_event_dict(layout)
+    expected = summaries(events)
+
+    dropped_layout, _ = drop_middle_shift(layout, get_shift_table())
+    _, _, dropped_events, grid = layout_to_calender_event_dict(dropped_layout)
+
+    # 其他日期不會往前移
+    for date_key, summary in summaries(dropped_events).items():
+        assert expected[date_key] == summary
+
+    missing = set(expected) - set(dropped_events)
+    assert len(missing) == 1
+    assert grid.unknown_dates == sorted(missing)
+
+
+def test_shuffled_word_order_gives_same_roster(layout):
+    _, _, events, _ = layout_to_calender_event_dict(layout)
+
+    shuffled = shuffle_layout(layout, random.Random(0))
+    _, _, shuffled_events, grid = layout_to_calender_event_dict(shuffled)
+
+    assert summaries(shuffled_events) == summaries(events)
+    assert grid.unknown_dates == []
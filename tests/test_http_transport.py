@@ -0,0 +1,155 @@
+from types import SimpleNamespace
+
+import pytest
+import requests
+
+from auto_calendar import http_transport
+from auto_calendar.http_transport import PooledTransport
+
+
+class FakeSession:
+    """requests.Session 的替身，依序回傳 responses 中的回應或丟出其中的例外"""
+
+    instances = []
+
+    def __init__(self):
+        self.responses = []
+        self.calls = []
+        self.mounted = {}
+        self.closed = False
+        FakeSession.instances.append(self)
+
+    def mount(self, prefix, adapter):
+        self.mounted[prefix] = adapter
+
+    def request(self, method, url, **kwargs):
+        self.calls.append((method, url, kwargs))
+        response = self.responses.pop(0)
+        if isinstance(response, Exception):
+            raise response
+        return response
+
+    def close(self):
+        self.closed = True
+
+
+def response(status=200, content=b"{}", headers=None):
+    return SimpleNamespace(
+        status_code=status,
+        reason="OK" if status == 200 else "Error",
+        headers=headers or {"Content-Type": "application/json"},
+        content=content,
+    )
+
+
+@pytest.fixture
+def transport(monkeypatch):
+    FakeSession.instances = []
+    monkeypatch.setattr(http_transport.requests, "Session", FakeSession)
+    return PooledTransport(pool_size=2, connect_timeout=1, read_timeout=2)
+
+
+def queue(transport, *responses):
+    session = transport.session()
+    session.responses.extend(responses)
+    return session
+
+
+def test_request_returns_httplib2_response_and_content(transport):
+    session = queue(transport, response(content=b'{"id": "a"}'))
+
+    resp, content = transport.http().request(
+        "https://www.googleapis.com/calendar/v3/calendars/primary/events",
+        method="POST",
+        body='{"summary": "BC"}',
+        headers={"content-type": "application/json"},
+    )
+
+    assert resp.status == 200
+    assert resp["status"] == "200"
+    assert resp.reason == "OK"
+    assert content == b'{"id": "a"}'
+
+    method, url, kwargs = session.calls[0]
+    assert method == "POST"
+    assert kwargs["data"] == b'{"summary": "BC"}'
+    assert kwargs["timeout"] == (1, 2)
+    assert kwargs["allow_redirects"] is True
+
+
+def test_hop_by_hop_headers_are_dropped(transport):
+    queue(
+        transport,
+        response(
+            headers={
+                "Content-Type": "application/json",
+                "Content-Encoding": "gzip",
+                "Content-Length": "20",
+                "Transfer-Encoding": "chunked",
+                "ETag": '"1"',
+            }
+        ),
+    )
+
+    resp, _ = transport.http().request("https://example.com/")
+
+    assert "content-encoding" not in resp
+    assert "content-length" not in resp
+    assert "transfer-encoding" not in resp
+    assert resp["content-type"] == "application/json"
+    assert resp["etag"] == '"1"'
+
+
+@pytest.mark.parametrize(
+    "error, expected",
+    [
+        (requests.exceptions.ReadTimeout("read timed out"), TimeoutError),
+        (requests.exceptions.ConnectionError("connection reset"), ConnectionError),
+    ],
+)
+def test_requests_errors_become_builtin_errors(transport, error, expected):
+    queue(transport, error)
+
+    with pytest.raises(expected):
+        transport.http().request("https://example.com/")
+
+    stats = transport.stats()
+    assert stats["errors"] == 1
+    assert stats["in_flight"] == 0
+
+
+def test_session_is_reused_across_calls(transport):
+    session = queue(transport, response(), response(), response(status=500))
+
+    transport.http().request("https://example.com/a")
+    transport.http().request("https://example.com/b")
+    resp, _ = transport.http().request("https://example.com/c")
+
+    assert resp.status == 500
+    assert len(FakeSession.instances) == 1
+    assert len(session.calls) == 3
+    assert set(session.mounted) == {"https://", "http://"}
+    assert transport.stats()["requests"] == 3
+
+
+def test_auth_request_shares_the_session_and_does_not_close_it(transport):
+    session = queue(transport, response(content=b'{"access_token": "x"}'))
+
+    auth_request = transport.auth_request()
+    result = auth_request("https://oauth2.googleapis.com/token", method="POST")
+    del auth_request
+
+    assert result.status == 200
+    assert session.calls[0][0] == "POST"
+    assert not session.closed
+    assert transport.session() is session
+
+
+def test_new_session_after_fork(transport):
+    session = transport.session()
+
+    # 模擬 gunicorn fork 後的子行程
+    transport._pid = -1
+
+    assert transport.session() is not session
+    assert len(FakeSession.instances) == 2
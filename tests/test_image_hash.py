@@ -0,0 +1,144 @@
+import copy
+
+import cv2
+import numpy as np
+import pytest
+
+from benchmark.fake_vision import (
+    build_fake_response,
+    load_fixtures,
+    render_fixture_image,
+)
+from ocr import ocr_utils
+from ocr.process_text import lines_to_text
+from ocr.image_hash import NearDuplicateIndex, fingerprint_from_gray, layout_signature
+from ocr.ocr_cache import OcrResultCache
+
+FIXTURES = load_fixtures()
+
+# 班表上最常被改的幾種班別，彼此只差一兩個字母
+EDITS = {"BC": "JB", "JB": "DB", "DB": "BC"}
+
+
+def decode_gray(image_bytes):
+    return cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_GRAYSCALE)
+
+
+def reencode(image_bytes, quality):
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    return cv2.imencode(".jpg", img, [cv2.IMWRITE_JPEG_QUALITY, quality])[1].tobytes()
+
+
+def single_cell_edits(sorted_lines_dict):
+    for y, words in sorted_lines_dict.items():
+        for i, word in enumerate(words):
+            if word["text"] in EDITS:
+                edited = copy.deepcopy(sorted_lines_dict)
+                edited[y][i]["text"] = EDITS[word["text"]]
+                yield edited
+
+
+def index_with(tmp_path, sorted_lines_dict, image_bytes):
+    index = NearDuplicateIndex(folder=str(tmp_path))
+    gray = decode_gray(image_bytes)
+    index.add(
+        "user",
+        fingerprint_from_gray(gray),
+        "original",
+        layout_signature(gray, sorted_lines_dict),
+    )
+    return index
+
+
+def is_reused(index, sorted_lines_dict, image_bytes):
+    # 與 ocr_utils.image_to_lines 相同：指紋找出候選，再以候選的版面逐字確認
+    gray = decode_gray(image_bytes)
+    key = index.lookup("user", fingerprint_from_gray(gray))
+    return key is not None and index.verify("user", key, gray, sorted_lines_dict)
+
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_reencoded_copy_is_reused(tmp_path, name):
+    layout = FIXTURES[name]
+    original = render_fixture_image(layout)
+    index = index_with(tmp_path, layout, original)
+
+    for quality in (95, 80, 70, 60):
+        assert is_reused(index, layout, reencode(original, quality)), quality
+
+
+def draw_status_bar(image_bytes, clock):
+    img = cv2.imdecode(np.frombuffer(image_bytes, np.uint8), cv2.IMREAD_COLOR)
+    cv2.putText(img, clock, (20, 40), cv2.FONT_HERSHEY_SIMPLEX, 1.2, (0, 0, 0), 2)
+    return cv2.imencode(".jpg", img)[1].tobytes()
+
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_new_screenshot_with_other_status_bar_is_reused(tmp_path, name):
+    layout = FIXTURES[name]
+    original = render_fixture_image(layout)
+    index = index_with(tmp_path, layout, draw_status_bar(original, "10:42"))
+
+    assert is_reused(index, layout, draw_status_bar(original, "23:05"))
+
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_edited_cell_is_not_reused(tmp_path, name):
+    layout = FIXTURES[name]
+    index = index_with(tmp_path, layout, render_fixture_image(layout))
+
+    for edited in single_cell_edits(layout):
+        assert not is_reused(index, layout, render_fixture_image(edited))
+
+
+def test_entry_without_signature_is_not_reused(tmp_path):
+    layout = FIXTURES["2025_08"]
+    image_bytes = render_fixture_image(layout)
+    index = NearDuplicateIndex(folder=str(tmp_path))
+    index.add("user", fingerprint_from_gray(decode_gray(image_bytes)), "original")
+
+    assert not is_reused(index, layout, reencode(image_bytes, 90))
+    assert index.stats()["rejected"] == 1
+
+
+class FakeVisionClient:
+    def __init__(self):
+        self.layouts = []
+
+    def get_client(self):
+        return self
+
+    def document_text_detection(self, image):
+        return build_fake_response(self.layouts.pop(0))
+
+
+@pytest.fixture
+def fake_ocr(tmp_path, monkeypatch):
+    vision = FakeVisionClient()
+    monkeypatch.setattr(ocr_utils, "OCR_PREPROCESS", False)
+    monkeypatch.setattr(ocr_utils, "vision_client_manager", vision)
+    monkeypatch.setattr(ocr_utils, "ocr_cache", OcrResultCache(str(tmp_path / "ocr")))
+    monkeypatch.setattr(
+        ocr_utils, "duplicate_index", NearDuplicateIndex(str(tmp_path / "index"))
+    )
+    return vision
+
+
+def test_edited_upload_calls_vision_again(fake_ocr):
+    layout = FIXTURES["2025_08"]
+    edited = next(single_cell_edits(layout))
+    original_bytes = render_fixture_image(layout)
+
+    fake_ocr.layouts = [layout, edited]
+    first = ocr_utils.image_to_text(original_bytes, user_id="user")
+    assert first == lines_to_text(layout)
+
+    # 重新壓縮的同一張班表沿用版面，不呼叫 Vision
+    assert ocr_utils.image_to_text(reencode(original_bytes, 80), "user") == first
+    assert fake_ocr.layouts == [edited]
+
+    # 改過一格的班表不可沿用舊版面
+    edited_bytes = render_fixture_image(edited)
+    second = ocr_utils.image_to_text(edited_bytes, user_id="user")
+    assert second == lines_to_text(edited) != first
+    assert fake_ocr.layouts == []
@@ -0,0 +1,79 @@
+from types import SimpleNamespace
+
+import pytest
+
+from ocr.image_ingest import ImageRejectedError, read_image_content, sniff_image_type
+
+PNG_HEADER = b"\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR"
+
+
+class FakeContent:
+    """linebot 的 message content 替身，記錄 iter_content 送出了幾個 chunk"""
+
+    def __init__(self, chunks, content_length=None):
+        self.chunks = list(chunks)
+        self.read = 0
+        headers = {}
+        if content_length is not None:
+            headers["content-length"] = str(content_length)
+        self.response = SimpleNamespace(headers=headers)
+
+    def iter_content(self, chunk_size):
+        for chunk in self.chunks:
+            self.read += 1
+            yield chunk
+
+
+@pytest.mark.parametrize(
+    "header, image_type",
+    [
+        (b"\xff\xd8\xff\xe0" + bytes(8), "jpeg"),
+        (PNG_HEADER, "png"),
+        (b"GIF89a" + bytes(6), "gif"),
+        (b"RIFF\x00\x00\x00\x00WEBP", "webp"),
+        (b"%PDF-1.7\n" + bytes(3), None),
+    ],
+)
+def test_sniff_image_type(header, image_type):
+    assert sniff_image_type(header) == image_type
+
+
+def test_content_length_over_cap_is_rejected_before_reading():
+    content = FakeContent([PNG_HEADER], content_length=101)
+
+    with pytest.raises(ImageRejectedError, match="太大"):
+        read_image_content(content, max_bytes=100)
+
+    assert content.read == 0
+
+
+def test_stream_without_content_length_is_cut_off_at_cap():
+    content = FakeContent([PNG_HEADER + bytes(28)] * 5)
+
+    with pytest.raises(ImageRejectedError, match="大小上限"):
+        read_image_content(content, max_bytes=100)
+
+    # 每個 chunk 40 bytes，第三個 chunk 超過上限，之後的內容不再讀取
+    assert content.read == 3
+
+
+def test_non_image_is_rejected_after_header():
+    content = FakeContent([b"<html><body>", b"x" * 1000])
+
+    with pytest.raises(ImageRejectedError, match="圖片格式"):
+        read_image_content(content)
+
+    assert content.read == 1
+
+
+def test_short_png_is_returned_as_sliced_memoryview():
+    data = PNG_HEADER + b"body"
+    # Content-Length 比實際內容長時，回傳的 view 只包含讀到的 bytes
+    content = FakeContent([data[:5], data[5:]], content_length=64)
+
+    view, info = read_image_content(content)
+
+    assert isinstance(view, memoryview)
+    assert bytes(view) == data
+    assert info["bytes"] == len(data)
+    assert info["type"] == "png"
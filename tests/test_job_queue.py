@@ -0,0 +1,228 @@
+import sys
+import time
+import socket
+import subprocess
+
+import pytest
+
+from jobs import job_queue as job_queue_module
+from jobs.job_queue import Job, JobQueue, JobQueueFull, MemoryBroker, SQLiteBroker
+
+
+@pytest.fixture(params=["memory", "sqlite"])
+def broker(request, tmp_path):
+    if request.param == "memory":
+        return MemoryBroker()
+    return SQLiteBroker(str(tmp_path / "job_queue.sqlite3"))
+
+
+def make_queue(broker, **kwargs):
+    # workers=0：不啟動背景 thread，以 drain() 在測試 thread 中同步執行
+    kwargs.setdefault("retry_delay", 0)
+    return JobQueue(broker, workers=0, **kwargs)
+
+
+def test_enqueue_runs_handler(broker):
+    job_queue = make_queue(broker)
+    received = []
+    job_queue.register("echo", received.append)
+
+    job_queue.enqueue("echo", {"n": 1})
+    job_queue.enqueue("echo", {"n": 2})
+    assert job_queue.stats()["depth"] == 2
+
+    assert job_queue.drain() == 2
+    assert received == [{"n": 1}, {"n": 2}]
+
+    stats = job_queue.stats()
+    assert stats["enqueued"] == 2
+    assert stats["processed"] == 2
+    assert stats["depth"] == 0
+
+
+def test_enqueue_rejects_unknown_kind_and_full_queue(broker):
+    job_queue = make_queue(broker, max_size=1)
+    job_queue.register("echo", lambda payload: None)
+
+    with pytest.raises(ValueError):
+        job_queue.enqueue("missing", {})
+
+    job_queue.enqueue("echo", {})
+    with pytest.raises(JobQueueFull):
+        job_queue.enqueue("echo", {})
+    assert job_queue.stats()["rejected"] == 1
+
+
+def test_failed_job_is_retried_until_success(broker):
+    job_queue = make_queue(broker)
+    calls = []
+
+    def flaky(payload):
+        calls.append(payload)
+        if len(calls) < 3:
+            raise RuntimeError("temporary")
+
+    job_queue.register("flaky", flaky, max_attempts=3)
+    job_queue.enqueue("flaky", {"n": 1})
+
+    assert job_queue.drain() == 3
+    assert calls == [{"n": 1}] * 3
+
+    stats = job_queue.stats()
+    assert stats["retried"] == 2
+    assert stats["processed"] == 1
+    assert stats["failed"] == 0
+    assert stats["depth"] == 0
+
+
+def test_failed_job_is_dropped_after_max_attempts(broker):
+    job_queue = make_queue(broker)
+    calls = []
+
+    def broken(payload):
+        calls.append(payload)
+        raise RuntimeError("permanent")
+
+    job_queue.register("broken", broken, max_attempts=2)
+    job_queue.register("once", broken)
+    job_queue.enqueue("broken", {})
+    job_queue.enqueue("once", {})
+
+    job_queue.drain()
+    assert len(calls) == 3
+
+    stats = job_queue.stats()
+    assert stats["retried"] == 1
+    assert stats["failed"] == 2
+    assert stats["depth"] == 0
+
+
+def test_retry_waits_for_backoff(broker):
+    job_queue = make_queue(broker, retry_delay=60)
+    calls = []
+
+    def failing(payload):
+        calls.append(payload)
+        raise RuntimeError("temporary")
+
+    job_queue.register("failing", failing, max_attempts=2)
+    job_queue.enqueue("failing", {})
+
+    # 重試排在 60 秒後，這次 drain 不會再取出
+    assert job_queue.drain() == 1
+    assert job_queue.stats()["depth"] == 1
+    assert broker.claim() is None
+
+
+def test_stale_running_job_is_recovered(broker):
+    broker.put(Job("echo", {"n": 1}))
+    claimed = broker.claim()
+    assert claimed is not None and broker.depth() == 0
+
+    # 剛取出的工作還不算逾時
+    assert broker.recover_stale(60) == 0
+    assert broker.depth() == 0
+
+    # worker 取出後就死亡，逾時後重新排入，由其他 worker 執行
+    time.sleep(0.01)
+    assert broker.recover_stale(0) == 1
+
+    job_queue = make_queue(broker)
+    received = []
+    job_queue.register("echo", received.append)
+    assert job_queue.drain() == 1
+    assert received == [{"n": 1}]
+    assert broker.recover_stale(0) == 0
+
+
+def test_acked_job_is_not_recovered(broker):
+    broker.put(Job("echo", {}))
+    job = broker.claim()
+    broker.ack(job.id)
+
+    time.sleep(0.01)
+    assert broker.recover_stale(0) == 0
+    assert broker.depth() == 0
+
+
+def test_on_failure_runs_only_after_last_attempt(broker):
+    job_queue = make_queue(broker)
+    calls = []
+    reported = []
+
+    def failing(payload):
+        calls.append(payload)
+        raise RuntimeError("temporary")
+
+    job_queue.register(
+        "failing",
+        failing,
+        max_attempts=3,
+        on_failure=lambda payload, error: reported.append((payload, str(error))),
+    )
+    job_queue.enqueue("failing", {"n": 1})
+
+    job_queue.drain()
+    assert len(calls) == 3
+    assert reported == [({"n": 1}, "temporary")]
+
+
+def test_on_failure_is_not_called_when_retry_succeeds(broker):
+    job_queue = make_queue(broker)
+    calls = []
+    reported = []
+
+    def flaky(payload):
+        calls.append(payload)
+        if len(calls) < 2:
+            raise RuntimeError("temporary")
+
+    job_queue.register(
+        "flaky",
+        flaky,
+        max_attempts=3,
+        on_failure=lambda payload, error: reported.append(payload),
+    )
+    job_queue.enqueue("flaky", {})
+
+    job_queue.drain()
+    assert len(calls) == 2
+    assert reported == []
+
+
+def test_running_job_with_heartbeat_is_not_recovered(broker):
+    broker.put(Job("echo", {}))
+    job = broker.claim()
+
+    # 執行很久但所屬 process 仍持續更新 heartbeat（例如 Calendar API backoff 中）
+    time.sleep(0.05)
+    broker.heartbeat([job.id])
+    assert broker.recover_stale(0.04) == 0
+    assert broker.depth() == 0
+
+
+def test_job_of_dead_owner_is_recovered_immediately(broker, monkeypatch):
+    dead = subprocess.Popen([sys.executable, "-c", "pass"])
+    dead.wait()
+    monkeypatch.setattr(
+        job_queue_module,
+        "current_owner",
+        lambda: f"{socket.gethostname()}:{dead.pid}",
+    )
+
+    broker.put(Job("echo", {}))
+    broker.claim()
+
+    assert broker.recover_stale(3600) == 1
+    assert broker.depth() == 1
+
+
+def test_job_of_other_host_waits_for_heartbeat_timeout(broker, monkeypatch):
+    monkeypatch.setattr(job_queue_module, "current_owner", lambda: "other-host:1")
+
+    broker.put(Job("echo", {}))
+    broker.claim()
+
+    assert broker.recover_stale(3600) == 0
+    time.sleep(0.01)
+    assert broker.recover_stale(0) == 1
@@ -0,0 +1,117 @@
+import os
+import json
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from ocr import ocr_cache
+from ocr.ocr_cache import OcrResultCache
+
+
+def layout(shift):
+    return {
+        120: [{"text": "8月,", "x": 10}, {"text": "2025", "x": 60}],
+        480: [{"text": shift, "x": 40}],
+    }
+
+
+# 每筆快取在磁碟上的大小（班別代碼長度相同時都一樣）
+ITEM_BYTES = len(json.dumps(layout("BC"), ensure_ascii=False, indent=2).encode("utf-8"))
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    # 快取以 time.time() 判斷過期，換成可手動前進的時鐘
+    clock = SimpleNamespace(now=time.time())
+    monkeypatch.setattr(ocr_cache, "time", SimpleNamespace(time=lambda: clock.now))
+    return clock
+
+
+def make_cache(tmp_path, **kwargs):
+    kwargs.setdefault("ttl_seconds", 60)
+    return OcrResultCache(folder=str(tmp_path), **kwargs)
+
+
+def age(cache, key, seconds, clock):
+    mtime = clock.now - seconds
+    os.utime(cache._path(key), (mtime, mtime))
+
+
+def test_expired_entry_is_dropped_from_both_layers(tmp_path, clock):
+    cache = make_cache(tmp_path)
+    cache.put("a", layout("BC"))
+    assert cache.get("a") == layout("BC")
+
+    clock.now += 61
+
+    assert cache.get("a") is None
+    stats = cache.stats()
+    assert stats["expired"] == 2
+    assert stats["memory_items"] == 0
+    assert not os.path.exists(cache._path("a"))
+
+
+def test_expired_file_is_not_read_by_other_worker(tmp_path, clock):
+    make_cache(tmp_path).put("a", layout("BC"))
+    other = make_cache(tmp_path)
+    age(other, "a", 61, clock)
+
+    assert other.get("a") is None
+    assert other.stats()["misses"] == 1
+    assert not os.path.exists(other._path("a"))
+
+
+def test_memory_evicts_least_recently_used_item(tmp_path, clock):
+    cache = make_cache(tmp_path, memory_items=2)
+    cache.put("a", layout("BC"))
+    cache.put("b", layout("JB"))
+    cache.get("a")
+    cache.put("c", layout("DB"))
+
+    stats = cache.stats()
+    assert stats["memory_items"] == 2
+    assert stats["evictions"] == 1
+
+    # b 只剩磁碟層
+    assert cache.get("b") == layout("JB")
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_memory_evicts_by_size(tmp_path, clock):
+    cache = make_cache(tmp_path, memory_max_bytes=ITEM_BYTES * 2 + 1)
+    for key, shift in (("a", "BC"), ("b", "JB"), ("c", "DB")):
+        cache.put(key, layout(shift))
+
+    stats = cache.stats()
+    assert stats["memory_items"] == 2
+    assert stats["memory_bytes"] == ITEM_BYTES * 2
+
+    cache.get("b")
+    cache.get("c")
+    assert cache.stats()["memory_hits"] == 2
+    cache.get("a")
+    assert cache.stats()["disk_hits"] == 1
+
+
+def test_disk_evicts_oldest_files_down_to_max_bytes(tmp_path, clock):
+    cache = make_cache(tmp_path, max_bytes=ITEM_BYTES * 3)
+    cache.put("a", layout("BC"))
+    cache.put("b", layout("JB"))
+    age(cache, "a", 30, clock)
+    age(cache, "b", 20, clock)
+
+    cache.max_bytes = ITEM_BYTES * 2
+    cache.put("c", layout("DB"))
+
+    assert sorted(os.listdir(tmp_path)) == ["b.json", "c.json"]
+    assert cache.stats()["disk_bytes"] == ITEM_BYTES * 2
+
+
+def test_disk_hit_restores_int_y_keys(tmp_path, clock):
+    make_cache(tmp_path).put("a", layout("BC"))
+
+    restored = make_cache(tmp_path).get("a")
+
+    assert restored == layout("BC")
+    assert all(isinstance(y, int) for y in restored)
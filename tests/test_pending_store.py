@@ -0,0 +1,284 @@
+import time
+import socket
+import threading
+import socketserver
+
+import pytest
+
+from storage.pending_store import (
+    MemoryPendingStore,
+    RedisConnection,
+    RedisPendingStore,
+    SQLitePendingStore,
+)
+
+
+class RespServer(socketserver.ThreadingTCPServer):
+    """
+    行程內的迷你 Redis 替身：以 RESP 協定回應 RedisPendingStore 用到的指令
+
+    commands 記錄收到的每個指令；password 有設定時需先 AUTH
+    drop_after 中的指令執行後不回應，直接關閉連線（模擬回應途中斷線）
+    """
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, password=None):
+        super().__init__(("127.0.0.1", 0), RespHandler)
+        self.password = password
+        self.commands = []
+        # db -> {key: (value, 到期時間 | None)} / {key: {member: score}}
+        self.strings = {}
+        self.zsets = {}
+        self.connections = []
+        self.drop_after = set()
+        self.lock = threading.Lock()
+
+    @property
+    def url(self):
+        host, port = self.server_address
+        auth = f":{self.password}@" if self.password else ""
+        return f"redis://{auth}{host}:{port}"
+
+    def drop_connections(self):
+        for conn in self.connections:
+            try:
+                conn.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+
+class RespHandler(socketserver.StreamRequestHandler):
+    def handle(self):
+        self.server.connections.append(self.request)
+        self.db = 0
+        self.authenticated = self.server.password is None
+
+        while True:
+            args = self.read_command()
+            if args is None:
+                return
+            with self.server.lock:
+                self.server.commands.append(args)
+                reply = self.run(args)
+            if args[0].upper() in self.server.drop_after:
+                return
+            self.wfile.write(reply)
+
+    def read_command(self):
+        line = self.rfile.readline()
+        if not line:
+            return None
+        count = int(line[1:-2])
+        args = []
+        for _ in range(count):
+            length = int(self.rfile.readline()[1:-2])
+            args.append(self.rfile.read(length + 2)[:-2])
+        return args
+
+    def run(self, args):
+        name = args[0].decode().upper()
+        args = args[1:]
+
+        if name == "AUTH":
+            if args[0].decode() != self.server.password:
+                return b"-WRONGPASS invalid password\r\n"
+            self.authenticated = True
+            return b"+OK\r\n"
+        if not self.authenticated:
+            return b"-NOAUTH Authentication required.\r\n"
+        if name == "SELECT":
+            self.db = int(args[0])
+            return b"+OK\r\n"
+
+        strings = self.server.strings.setdefault(self.db, {})
+        zsets = self.server.zsets.setdefault(self.db, {})
+
+        if name == "SET":
+            expires_at = None
+            if len(args) > 2 and args[2].upper() == b"PX":
+                expires_at = time.time() + int(args[3]) / 1000
+            strings[args[0]] = (args[1], expires_at)
+            return b"+OK\r\n"
+        if name in ("GET", "GETDEL"):
+            value, expires_at = strings.get(args[0], (None, None))
+            if expires_at is not None and expires_at < time.time():
+                value = None
+            if name == "GETDEL":
+                strings.pop(args[0], None)
+            return bulk(value)
+        if name == "DEL":
+            removed = sum(strings.pop(key, None) is not None for key in args)
+            return integer(removed)
+        if name == "ZADD":
+            zset = zsets.setdefault(args[0], {})
+            added = args[2] not in zset
+            zset[args[2]] = float(args[1])
+            return integer(int(added))
+        if name == "ZREM":
+            zset = zsets.setdefault(args[0], {})
+            return integer(sum(zset.pop(m, None) is not None for m in args[1:]))
+        if name == "ZREMRANGEBYSCORE":
+            zset = zsets.setdefault(args[0], {})
+            low, high = float(args[1]), float(args[2])
+            removed = [m for m, score in zset.items() if low <= score <= high]
+            for member in removed:
+                del zset[member]
+            return integer(len(removed))
+        if name == "ZCARD":
+            return integer(len(zsets.get(args[0], {})))
+        if name == "ZPOPMIN":
+            zset = zsets.setdefault(args[0], {})
+            count = int(args[1]) if len(args) > 1 else 1
+            popped = sorted(zset.items(), key=lambda item: item[1])[:count]
+            items = []
+            for member, score in popped:
+                del zset[member]
+                items += [bulk(member), bulk(repr(score).encode())]
+            return f"*{len(items)}\r\n".encode() + b"".join(items)
+
+        return f"-ERR unknown command '{name}'\r\n".encode()
+
+
+def bulk(value):
+    if value is None:
+        return b"$-1\r\n"
+    return f"${len(value)}\r\n".encode() + value + b"\r\n"
+
+
+def integer(value):
+    return f":{value}\r\n".encode()
+
+
+@pytest.fixture
+def redis_server():
+    server = RespServer()
+    threading.Thread(target=server.serve_forever, args=(0.05,), daemon=True).start()
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def make_store(request, tmp_path):
+    def make(**kwargs):
+        if request.param == "memory":
+            return MemoryPendingStore(**kwargs)
+        if request.param == "sqlite":
+            return SQLitePendingStore(str(tmp_path / "pending.sqlite3"), **kwargs)
+        server = request.getfixturevalue("redis_server")
+        return RedisPendingStore(server.url, **kwargs)
+
+    return make
+
+
+ROSTER = {
+    "year": 2025,
+    "month": 9,
+    "event_dict": {"2025-09-01": {"summary": "早班 BC", "description": "a\r\nb"}},
+    "unknown_dates": [],
+}
+
+
+def test_put_get_pop(make_store):
+    store = make_store()
+
+    assert store.get("user") is None
+    store.put("user", ROSTER)
+    assert store.get("user") == ROSTER
+    assert store.get("user") == ROSTER
+
+    # pop 只會取得一次，避免使用者重複按下同意
+    assert store.pop("user") == ROSTER
+    assert store.pop("user") is None
+
+
+def test_delete(make_store):
+    store = make_store()
+    store.put("user", ROSTER)
+    store.delete("user")
+
+    assert store.get("user") is None
+
+
+def test_expired_entry_is_not_returned(make_store):
+    store = make_store(ttl_seconds=0.05)
+    store.put("user", ROSTER)
+    time.sleep(0.1)
+
+    assert store.get("user") is None
+    assert store.pop("user") is None
+
+
+def test_oldest_entries_are_evicted(make_store):
+    store = make_store(max_entries=2)
+    for user_id in ("a", "b", "c"):
+        store.put(user_id, {"user": user_id})
+        time.sleep(0.01)
+
+    assert store.get("a") is None
+    assert store.get("b") == {"user": "b"}
+    assert store.get("c") == {"user": "c"}
+
+
+def test_redis_auth_and_select(redis_server):
+    redis_server.password = "secret"
+    store = RedisPendingStore(redis_server.url + "/3")
+
+    store.put("user", ROSTER)
+
+    assert redis_server.commands[0] == [b"AUTH", b"secret"]
+    assert redis_server.commands[1] == [b"SELECT", b"3"]
+    assert b"auto_roster:pending:user" in redis_server.strings[3]
+    assert store.get("user") == ROSTER
+
+
+def test_redis_error_reply_is_raised(redis_server):
+    redis_server.password = "secret"
+    connection = RedisConnection(redis_server.url.replace("secret", "wrong"))
+
+    with pytest.raises(RuntimeError, match="WRONGPASS"):
+        connection.execute("GET", "key")
+
+
+def test_redis_reply_types(redis_server):
+    connection = RedisConnection(redis_server.url)
+
+    assert connection.execute("SET", "key", "值") == "OK"
+    assert connection.execute("GET", "key") == "值".encode()
+    assert connection.execute("GET", "missing") is None
+    assert connection.execute("ZADD", "z", 1, "a") == 1
+    assert connection.execute("ZADD", "z", 2, "b") == 1
+    assert connection.execute("ZPOPMIN", "z", 5) == [b"a", b"1.0", b"b", b"2.0"]
+    assert connection.execute("ZPOPMIN", "z", 5) == []
+
+
+def test_redis_reconnects_after_connection_drop(redis_server):
+    connection = RedisConnection(redis_server.url)
+    connection.execute("SET", "key", "value")
+
+    redis_server.drop_connections()
+    # 等待 FIN 送達，閒置時被關閉的連線在送出指令前就會換掉
+    time.sleep(0.05)
+
+    assert connection.execute("GET", "key") == b"value"
+    assert len(redis_server.connections) == 2
+
+
+def test_redis_does_not_resend_after_command_was_executed(redis_server):
+    store = RedisPendingStore(url=redis_server.url)
+    store.put("user", {"year": 2025})
+
+    # GETDEL 已在伺服器執行（key 已刪除），回應前連線中斷
+    redis_server.drop_after.add(b"GETDEL")
+    with pytest.raises(ConnectionError):
+        store.pop("user")
+
+    getdels = [args for args in redis_server.commands if args[0] == b"GETDEL"]
+    assert len(getdels) == 1
+
+    # 之後的指令會重新連線
+    redis_server.drop_after.clear()
+    store.put("user", {"year": 2026})
+    assert store.pop("user") == {"year": 2026}
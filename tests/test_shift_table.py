@@ -0,0 +1,90 @@
+import os
+import json
+
+import pytest
+
+from ocr.shift_table import ShiftTableLoader
+
+CONFIG = {
+    "time_zone": "Asia/Taipei",
+    "shifts": {
+        "BC": {"start": "08:00:00"},
+        "OFF": {"all_day": True, "aliases": ["Off"]},
+    },
+}
+
+
+def write_config(path, content, mtime):
+    path.write_text(
+        content if isinstance(content, str) else json.dumps(content), encoding="utf-8"
+    )
+    # 檔案系統的 mtime 精度可能不足，明確調整以確保被偵測到
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def config_path(tmp_path):
+    path = tmp_path / "shift_table.json"
+    write_config(path, CONFIG, 1_000_000)
+    return path
+
+
+def test_edited_file_is_reloaded(config_path):
+    loader = ShiftTableLoader(str(config_path), check_seconds=0)
+    table = loader.get()
+    assert sorted(table.shifts) == ["BC", "OFF"]
+
+    config = json.loads(json.dumps(CONFIG))
+    config["shifts"]["NT"] = {"start": "22:00:00", "aliases": ["N T"]}
+    write_config(config_path, config, 1_000_010)
+
+    reloaded = loader.get()
+    assert reloaded is not table
+    assert reloaded.version != table.version
+    assert reloaded.find_all("BC N T Off") == ["BC", "NT", "OFF"]
+    assert loader.stats()["reloads"] == 1
+
+
+def test_touched_file_with_same_content_keeps_table(config_path):
+    loader = ShiftTableLoader(str(config_path), check_seconds=0)
+    table = loader.get()
+
+    write_config(config_path, CONFIG, 1_000_010)
+
+    assert loader.get() is table
+    assert loader.stats()["reloads"] == 0
+
+
+@pytest.mark.parametrize(
+    "content",
+    [
+        "{not json",
+        {"shifts": {"NT": {"duration_hours": 8}}},
+    ],
+)
+def test_invalid_edit_keeps_previous_table(config_path, content):
+    loader = ShiftTableLoader(str(config_path), check_seconds=0)
+    table = loader.get()
+
+    write_config(config_path, content, 1_000_010)
+
+    assert loader.get() is table
+    assert loader.stats()["errors"] == 1
+
+    # 修正後的設定檔會再被載入
+    config = json.loads(json.dumps(CONFIG))
+    config["shifts"]["NT"] = {"start": "22:00:00"}
+    write_config(config_path, config, 1_000_020)
+
+    assert "NT" in loader.get().shifts
+
+
+def test_changes_are_not_checked_before_interval(config_path):
+    loader = ShiftTableLoader(str(config_path), check_seconds=3600)
+    table = loader.get()
+
+    config = json.loads(json.dumps(CONFIG))
+    config["shifts"]["NT"] = {"start": "22:00:00"}
+    write_config(config_path, config, 1_000_010)
+
+    assert loader.get() is table
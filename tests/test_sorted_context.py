@@ -0,0 +1,83 @@
+import random
+
+import numpy as np
+import pytest
+
+from benchmark.bench_sorted_context import legacy_get_sorted_context
+from benchmark.fake_vision import build_fake_response, load_fixtures
+from ocr.ocr_utils import cluster_lines, get_sorted_context
+
+FIXTURES = load_fixtures()
+
+
+def layout_summary(sorted_lines_dict):
+    """每一行的 y 與依序的 (文字, x, y)，用來比較兩個版本的輸出"""
+    return [
+        (y, [(w["text"], w["x"], w["y"]) for w in sorted_lines_dict[y]])
+        for y in sorted(sorted_lines_dict)
+    ]
+
+
+def shuffled_layout(sorted_lines_dict, seed):
+    """把所有字打亂順序後放在同一行，模擬 Vision 以不同的 block 順序回傳"""
+    words = [w for words in sorted_lines_dict.values() for w in words]
+    random.Random(seed).shuffle(words)
+    return {0: words}
+
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_matches_legacy_output(name):
+    response = build_fake_response(FIXTURES[name])
+
+    legacy_lines, legacy_text = legacy_get_sorted_context(response)
+    lines, text = get_sorted_context(response)
+
+    assert text == legacy_text
+    assert layout_summary(lines) == layout_summary(legacy_lines)
+
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_rebuilds_stored_layout(name):
+    # ocr/ocr_result 的版面由舊版在正式環境產生，依 Vision 的順序重播後應完全相同
+    lines, _ = get_sorted_context(build_fake_response(FIXTURES[name]))
+
+    assert layout_summary(lines) == layout_summary(FIXTURES[name])
+
+
+@pytest.mark.parametrize("name", sorted(FIXTURES))
+def test_matches_legacy_output_in_any_word_order(name):
+    for seed in range(5):
+        response = build_fake_response(shuffled_layout(FIXTURES[name], seed))
+
+        legacy_lines, legacy_text = legacy_get_sorted_context(response)
+        lines, text = get_sorted_context(response)
+
+        assert text == legacy_text
+        assert layout_summary(lines) == layout_summary(legacy_lines)
+
+
+def boxes_at(points):
+    return np.array(
+        [[[x, y], [x + 10, y], [x + 10, y + 10], [x, y + 10]] for x, y in points],
+        dtype=np.int32,
+    ).reshape(-1, 4, 2)
+
+
+def test_lines_are_anchored_to_first_word():
+    # 相鄰的字各差 4 px，但 108 與錨點 100 相差超過 5 px，應另起一行
+    texts = ["a", "b", "c", "d"]
+    boxes = boxes_at([(0, 100), (20, 104), (0, 108), (20, 112)])
+
+    lines = [
+        (y, " ".join(texts[i] for i in indices)) for y, indices in cluster_lines(boxes)
+    ]
+
+    assert lines == [(100, "a b"), (108, "c d")]
+
+
+def test_word_between_two_lines_joins_the_earlier_line():
+    boxes = boxes_at([(0, 108), (0, 100), (20, 104)])
+
+    lines = [(y, indices.tolist()) for y, indices in cluster_lines(boxes)]
+
+    assert lines == [(100, [1]), (108, [0, 2])]